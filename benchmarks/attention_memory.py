@@ -0,0 +1,136 @@
+"""Peak activation memory and latency of ECT_SAL per batch size, fused vs math attention.
+
+    python benchmarks/attention_memory.py --batch-sizes 1 4 8 16 32 --out attention_memory.json
+
+Every (attention implementation, batch size) pair runs in a fresh process.
+The activation peak is that process's peak RSS after one inference_mode
+forward at that batch size, minus its RSS once the model is built, so it
+covers everything the forward allocates on top of the weights. Allocator
+caching means the figure is an upper bound, which is the right side to err
+on when setting BATCH_MAX_SIZE / image_batch_size for a memory budget.
+
+The report also gives the largest batch size whose activations fit
+--budget-mb next to the weights, and the size of the attention score
+matrices the math path materialises (tokens x tokens per head and stream,
+summed over layers).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from common import ROOT, peak_rss_mb, set_threads
+
+sys.path.append(os.path.join(ROOT, "brand_predictor"))
+
+IMPLS = ("math", "sdpa")
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def attention_shapes():
+    """(tokens, heads) of every Attention layer in ECT_SAL."""
+    from model_arch import ECT_SAL, TransEncoder
+
+    model = ECT_SAL(fused=True, pretrained=False)
+    shapes = []
+    for encoder in (m for m in model.modules() if isinstance(m, TransEncoder)):
+        tokens = encoder.position_embeddings.shape[1]
+        shapes.extend((tokens, block.attn.num_attention_heads) for block in encoder.transformer_encoder.layer)
+    return shapes
+
+
+def score_matrix_mb(shapes, batch_size):
+    """float32 attention scores the math path materialises per forward, all layers, both streams."""
+    return sum(2 * batch_size * heads * tokens * tokens * 4 for tokens, heads in shapes) / 2**20
+
+
+def _measure(impl, batch_size, threads, repeats):
+    import torch
+
+    from model_arch import ECT_SAL, set_attention_impl
+
+    set_threads(threads)
+    torch.manual_seed(0)
+    model = set_attention_impl(ECT_SAL(fused=True, pretrained=False).eval(), impl)
+    img = torch.rand(batch_size, 3, 256, 256)
+    tmap = torch.rand(batch_size, 3, 256, 256)
+    baseline = _rss_mb()
+
+    durations = []
+    with torch.inference_mode():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(img, tmap)
+            durations.append(time.perf_counter() - start)
+    return {
+        "impl": impl,
+        "batch_size": batch_size,
+        "weights_rss_mb": baseline,
+        "activation_peak_mb": peak_rss_mb() - baseline,
+        "ms_per_image": min(durations) * 1000 / batch_size,
+    }
+
+
+def run(batch_sizes, threads, repeats):
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for batch_size in batch_sizes:
+        for impl in IMPLS:
+            with ctx.Pool(1) as pool:
+                row = pool.apply(_measure, (impl, batch_size, threads, repeats))
+            rows.append(row)
+            print(f"{impl:>5} batch {batch_size:>3}: {row['activation_peak_mb']:>8.0f} MB activations, "
+                  f"{row['ms_per_image']:>7.1f} ms/image", flush=True)
+    return rows
+
+
+def max_batch(rows, impl, budget_mb):
+    """Largest measured batch size whose weights plus activations stay within budget_mb."""
+    fitting = [r["batch_size"] for r in rows
+               if r["impl"] == impl and r["weights_rss_mb"] + r["activation_peak_mb"] <= budget_mb]
+    return max(fitting, default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--repeats", type=int, default=2, help="forwards per measurement (fastest is reported)")
+    parser.add_argument("--budget-mb", type=float, default=8 * 1024, help="memory available to one process")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    rows = run(args.batch_sizes, args.threads, args.repeats)
+    shapes = attention_shapes()
+    for row in rows:
+        row["math_score_matrices_mb"] = score_matrix_mb(shapes, row["batch_size"])
+    report = {
+        "threads": args.threads,
+        "budget_mb": args.budget_mb,
+        "rows": rows,
+        "max_batch_within_budget": {impl: max_batch(rows, impl, args.budget_mb) for impl in IMPLS},
+    }
+
+    print(f"{'batch':>5} {'math MB':>9} {'sdpa MB':>9} {'saved':>7} {'scores MB':>10}")
+    for batch_size in args.batch_sizes:
+        math_row, sdpa_row = (next(r for r in rows if r["impl"] == impl and r["batch_size"] == batch_size) for impl in IMPLS)
+        saved = 1 - sdpa_row["activation_peak_mb"] / math_row["activation_peak_mb"]
+        print(f"{batch_size:>5} {math_row['activation_peak_mb']:>9.0f} {sdpa_row['activation_peak_mb']:>9.0f} "
+              f"{saved:>7.0%} {math_row['math_score_matrices_mb']:>10.0f}")
+    for impl, batch_size in report["max_batch_within_budget"].items():
+        print(f"Largest {impl} batch within {args.budget_mb:.0f} MB: {batch_size}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""brand_predictor benchmark: YOLO, saliency, crops, classifier and end-to-end."""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import (
+    ROOT,
+    SyntheticDetections,
+    peak_rss_mb,
+    set_threads,
+    summarize,
+    synthetic_scene,
+    time_calls,
+)
+
+sys.path.append(os.path.join(ROOT, "brand_predictor"))
+
+WEIGHTS = {
+    "yolo": "Logo_Detection_Yolov8.pt",
+    "saliency": "ECT_SAL.pth",
+    "classifier": "brand_attention_efficientnet_twostream.pth",
+}
+
+
+def _weights(weights_dir, tmp_dir, seed):
+    """Checkpoint paths, writing randomly initialised ones for any that are missing."""
+    import torch
+
+    from model_arch import ECT_SAL, TwoStreamEfficientNet
+    from pipeline import CLASSES
+
+    paths, sources = {}, {}
+    for key, name in WEIGHTS.items():
+        path = os.path.join(weights_dir, name)
+        if os.path.exists(path):
+            paths[key], sources[key] = path, "checkpoint"
+            continue
+        torch.manual_seed(seed)
+        path = os.path.join(tmp_dir, name)
+        if key == "yolo":
+            from ultralytics import YOLO
+
+            YOLO("yolov8n.yaml").save(path)
+        elif key == "saliency":
+            torch.save(ECT_SAL(pretrained=False).state_dict(), path)
+        else:
+            torch.save(TwoStreamEfficientNet(len(CLASSES), pretrained=False).state_dict(), path)
+        paths[key], sources[key] = path, "random"
+    return paths, sources
+
+
+def run(config):
+    import torch
+
+    from pipeline import CLASSES, BrandAttentionPipeline
+
+    set_threads(config["threads"][0])
+    width, height = config["resolution"]
+    tmp_dir = tempfile.mkdtemp(prefix="brand-bench-")
+    try:
+        paths, sources = _weights(config.get("brand_weights") or os.path.join(ROOT, "brand_predictor"), tmp_dir, config["seed"])
+        start = time.perf_counter()
+        pipeline = BrandAttentionPipeline(
+            paths["yolo"], paths["saliency"], paths["classifier"], CLASSES, device=torch.device("cpu")
+        )
+        load_s = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    rss_after_load = peak_rss_mb()
+
+    detector = SyntheticDetections(pipeline.yolo)
+    pipeline.yolo = detector
+
+    def scenes(n):
+        images = []
+        for i in range(n):
+            image, _, boxes = synthetic_scene(width, height, config["boxes"], seed=config["seed"] + i)
+            detector.register(image, boxes)
+            images.append(image)
+        return images
+
+    # ---- Per-stage latency, one image per call ----
+    iterations, warmup = config["iterations"], config["warmup"]
+    image, _, scene_boxes = synthetic_scene(width, height, config["boxes"], seed=config["seed"])
+    detector.register(image, scene_boxes)
+    boxes = [scene_boxes[:, :4]]
+    size = (pipeline.img_size, pipeline.img_size)
+    saliency_maps = pipeline.run_saliency_batch([image], output_size=size)
+    saliency_inputs = pipeline.saliency_inputs([image], saliency_maps)
+
+    stages = {
+        "yolo": lambda: detector.model([image], verbose=False),
+        "saliency": lambda: pipeline.run_saliency_batch([image], output_size=size),
+        "saliency_inputs": lambda: pipeline.saliency_inputs([image], saliency_maps),
+        "crops": lambda: pipeline.crop_inputs(image, boxes[0]),
+        "classify": lambda: pipeline.classify_boxes([image], boxes, saliency_inputs),
+        "end_to_end": lambda: pipeline.predict_boxes_bgr([image]),
+    }
+    with torch.inference_mode():
+        latency = {name: summarize(time_calls(fn, iterations, warmup)) for name, fn in stages.items()}
+
+        # ---- Throughput against batch size and thread count ----
+        throughput = []
+        batches = {bs: scenes(bs) for bs in config["batch_sizes"]}
+        for threads in config["threads"]:
+            set_threads(threads)
+            for bs, images in batches.items():
+                durations = time_calls(lambda: pipeline.predict_boxes_bgr(images), max(1, iterations // bs), 1)
+                throughput.append({
+                    "threads": threads,
+                    "batch_size": bs,
+                    "images_per_s": bs * len(durations) / sum(durations),
+                })
+
+    return {
+        "weights": sources,
+        "load_s": load_s,
+        "stages": latency,
+        "throughput": throughput,
+        "rss_after_load_mb": rss_after_load,
+        "peak_rss_mb": peak_rss_mb(),
+    }
@@ -0,0 +1,118 @@
+"""dim_predictor benchmark: segmentation, mask geometry, ArUco/Hough calibration and end-to-end."""
+import os
+import sys
+import time
+
+from common import (
+    ROOT,
+    SyntheticDetections,
+    peak_rss_mb,
+    set_threads,
+    summarize,
+    synthetic_scene,
+    time_calls,
+)
+
+sys.path.append(os.path.join(ROOT, "dim_predictor"))
+
+MARKER_CM = 5.0
+
+
+def _model(weights_dir, seed):
+    """The segmentation model from weights_dir, or a randomly initialised one of the same architecture."""
+    import torch
+    from ultralytics import YOLO
+
+    from measurement import MODEL_NAME
+
+    path = os.path.join(weights_dir, MODEL_NAME + ".pt")
+    if os.path.exists(path):
+        return YOLO(path), "checkpoint"
+    torch.manual_seed(seed)
+    return YOLO(MODEL_NAME + ".yaml"), "random"
+
+
+def run(config):
+    import torch
+
+    from geometry import mask_bbox
+    from measurement import (
+        CALIBRATOR,
+        compute_measurements,
+        compute_measurements_batch,
+        pixel_height_and_diameter_from_mask,
+        segment,
+    )
+
+    set_threads(config["threads"][0])
+    width, height = config["resolution"]
+    marker_px = max(24, min(width, height) // 8)
+
+    start = time.perf_counter()
+    model, source = _model(config.get("dim_weights") or os.path.join(ROOT, "dim_predictor"), config["seed"])
+    load_s = time.perf_counter() - start
+    rss_after_load = peak_rss_mb()
+    detector = SyntheticDetections(model)
+
+    def scenes(n):
+        images = []
+        for i in range(n):
+            image, masks, boxes = synthetic_scene(width, height, config["boxes"], seed=config["seed"] + i, marker_px=marker_px)
+            # Segmentation boxes span the whole bottle, not just its label
+            boxes[:, :4] = [mask_bbox(m) for m in masks]
+            detector.register(image, boxes, masks)
+            images.append((image, masks))
+        return images
+
+    def request(image):
+        return dict(image=image, use_aruco=True, aruco_size=MARKER_CM, cap_size=None, fx=None, fy=None, dist=None, crushed=False)
+
+    # ---- Per-stage latency, one image per call ----
+    iterations, warmup = config["iterations"], config["warmup"]
+    image, masks = scenes(1)[0]
+    mask = masks[0]
+
+    stages = {
+        "segment": lambda: segment(image, model),
+        "measure_mask_upright": lambda: pixel_height_and_diameter_from_mask(mask, False, "upright"),
+        "measure_mask_pca": lambda: pixel_height_and_diameter_from_mask(mask, False, "pca"),
+        "aruco": lambda: CALIBRATOR.marker_side_px(image),
+        "cap_hough": lambda: CALIBRATOR.cap_diameter_px(image, mask),
+        "end_to_end": lambda: compute_measurements(model=detector, **request(image)),
+        "end_to_end_multi": lambda: compute_measurements(model=detector, multi=True, **request(image)),
+    }
+    with torch.inference_mode():
+        latency = {name: summarize(time_calls(fn, iterations, warmup)) for name, fn in stages.items()}
+
+        # ---- Throughput against batch size and thread count ----
+        throughput = []
+        batches = {bs: [request(im) for im, _ in scenes(bs)] for bs in config["batch_sizes"]}
+        for threads in config["threads"]:
+            set_threads(threads)
+            for bs, requests in batches.items():
+                # The batch call returns per-image exceptions instead of raising them,
+                # and an image that failed must not count as a fast measurement
+                failures = []
+
+                def measure_batch():
+                    outputs = compute_measurements_batch(requests, detector)
+                    failures.append(sum(isinstance(o, Exception) for o in outputs))
+
+                durations = time_calls(measure_batch, max(1, iterations // bs), 1)
+                failed = sum(failures[1:])  # the warm-up call is not timed
+                throughput.append({
+                    "threads": threads,
+                    "batch_size": bs,
+                    "images_per_s": (bs * len(durations) - failed) / sum(durations),
+                    "failed": failed,
+                })
+
+    return {
+        "weights": {"segmentation": source},
+        "load_s": load_s,
+        "stages": latency,
+        "throughput": throughput,
+        "rss_after_load_mb": rss_after_load,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
@@ -0,0 +1,132 @@
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# ------------------------- Timing -------------------------
+
+
+def summarize(seconds):
+    """Latency percentiles in ms from a list of per-call durations in seconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    stats = {f"p{p}": float(np.percentile(ms, p)) for p in PERCENTILES}
+    stats.update(mean=float(ms.mean()), min=float(ms.min()), n=int(ms.size))
+    return stats
+
+
+def time_calls(fn, iterations, warmup):
+    """Run fn warmup times untimed, then iterations times; returns per-call seconds."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def set_threads(n):
+    """Thread count for torch intra-op parallelism and OpenCV."""
+    import torch
+
+    torch.set_num_threads(n)
+    cv2.setNumThreads(n)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def parse_resolution(text):
+    width, height = (int(v) for v in text.lower().split("x"))
+    return width, height
+
+
+# ------------------------- Synthetic data -------------------------
+
+
+def synthetic_scene(width, height, count, seed=0, marker_px=0):
+    """BGR image with count upright bottles (body, cap, printed label) on a textured background.
+
+    Returns (image, masks, boxes): masks is (count, H, W) uint8 per bottle,
+    boxes is (count, 6) float32 [x0, y0, x1, y1, conf, cls] around each
+    label. marker_px > 0 also draws an ArUco DICT_4X4_50 marker in the
+    bottom-right corner.
+    """
+    rng = np.random.default_rng(seed)
+    small = rng.integers(90, 200, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    masks = np.zeros((count, height, width), np.uint8)
+    boxes = np.zeros((count, 6), np.float32)
+    slot = width / max(count, 1)
+    for i in range(count):
+        cx = int(slot * (i + 0.5))
+        dia = max(8, int(min(slot * 0.6, height * 0.2)))
+        top, bottom = int(height * 0.2), int(height * 0.9)
+        cap_r = max(3, dia // 4)
+
+        cv2.rectangle(masks[i], (cx - dia // 2, top), (cx + dia // 2, bottom), 1, -1)
+        cv2.rectangle(masks[i], (cx - cap_r, top - 2 * cap_r), (cx + cap_r, top), 1, -1)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        image[masks[i] > 0] = color
+        cv2.circle(image, (cx, top - cap_r), cap_r, (255, 255, 255), -1)
+
+        label_top, label_bottom = int(height * 0.45), int(height * 0.6)
+        cv2.rectangle(image, (cx - dia // 2, label_top), (cx + dia // 2, label_bottom), (20, 20, 200), -1)
+        cv2.putText(image, "LOGO", (cx - dia // 2, (label_top + label_bottom) // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    max(0.3, dia / 120), (255, 255, 255), max(1, dia // 60))
+        boxes[i] = (cx - dia // 2, label_top, cx + dia // 2, label_bottom, 0.9, 0)
+
+    if marker_px:
+        aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+        marker = cv2.aruco.generateImageMarker(aruco_dict, 0, marker_px)
+        pad = marker_px // 4
+        y0, x0 = height - marker_px - 2 * pad, width - marker_px - 2 * pad
+        image[y0:y0 + marker_px + 2 * pad, x0:x0 + marker_px + 2 * pad] = 255
+        image[y0 + pad:y0 + pad + marker_px, x0 + pad:x0 + pad + marker_px] = marker[:, :, None]
+    return image, masks, boxes
+
+
+class SyntheticDetections:
+    """Wraps an Ultralytics model: the real forward runs (and is timed), its detections are replaced.
+
+    Random-init weights find nothing meaningful in synthetic scenes. Swapping
+    in the known boxes/masks of each registered image keeps the downstream
+    work (crops to classify, masks to measure) fixed across runs.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._detections = {}
+
+    def register(self, image, boxes, masks=None):
+        self._detections[id(image)] = (boxes, masks)
+
+    def predict(self, images, **kwargs):
+        import torch
+
+        batch = images if isinstance(images, list) else [images]
+        results = self.model.predict(batch, **kwargs)
+        for image, res in zip(batch, results):
+            if id(image) in self._detections:
+                boxes, masks = self._detections[id(image)]
+                res.update(
+                    boxes=torch.from_numpy(boxes),
+                    masks=torch.from_numpy(masks).float() if masks is not None else None,
+                )
+        return results
+
+    __call__ = predict
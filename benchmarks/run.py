@@ -0,0 +1,160 @@
+"""Offline benchmark suite for brand_predictor and dim_predictor.
+
+    python benchmarks/run.py run --out results.json
+    python benchmarks/run.py run --suites dim --resolution 4000x3000 --boxes 6 --threads 1 4
+    python benchmarks/run.py compare baseline.json results.json --threshold 0.10
+
+Each suite runs in its own process, so peak RSS is per suite. Checkpoints
+that are missing are replaced by randomly initialised models of the same
+architecture. The "weights" entry of each suite records which ones were
+used. Inputs are synthetic scenes (bottles with caps and labels, plus an
+ArUco marker) at a configurable resolution and box count. The detector's
+forward pass always runs, but its detections are swapped for the known
+boxes/masks, so downstream stages do the same work on every run.
+
+Results hold latency percentiles per stage and end-to-end, images/sec for
+each thread count and batch size, model load time and peak RSS. Images the
+dim batch path could not measure are reported as "failed" and do not count
+towards its images/sec. compare flags every metric that got worse by more
+than --threshold. It exits with status 1 if any did.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+from common import parse_resolution
+
+SUITES = ("brand", "dim")
+
+# metric -> True if higher is better
+DIRECTIONS = {"p50": False, "p95": False, "images_per_s": True, "peak_rss_mb": False, "load_s": False}
+
+
+def _run_suite(name, config):
+    module = __import__(f"bench_{name}")
+    return module.run(config)
+
+
+def run(config):
+    import torch
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": config,
+    }
+    # spawn: each suite starts from a fresh interpreter, so its peak RSS is its own
+    ctx = multiprocessing.get_context("spawn")
+    for name in config["suites"]:
+        print(f"Running {name} benchmark...", flush=True)
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(_run_suite, (name, config))
+    return results
+
+
+def _metrics(suite):
+    for stage, stats in suite["stages"].items():
+        for key in ("p50", "p95"):
+            yield f"stages.{stage}.{key}", key, stats[key]
+    for row in suite["throughput"]:
+        yield f"throughput.threads={row['threads']}.batch={row['batch_size']}", "images_per_s", row["images_per_s"]
+    for key in ("peak_rss_mb", "load_s"):
+        yield key, key, suite[key]
+
+
+def compare(baseline, current, threshold):
+    """Rows (suite, metric, baseline, current, relative change, regressed) for metrics present in both runs."""
+    rows = []
+    for name in SUITES:
+        if name not in baseline or name not in current:
+            continue
+        if baseline[name]["weights"] != current[name]["weights"]:
+            print(f"Warning: {name} runs used different weights {baseline[name]['weights']} vs {current[name]['weights']}")
+        before = {metric: (kind, value) for metric, kind, value in _metrics(baseline[name])}
+        for metric, kind, value in _metrics(current[name]):
+            if metric not in before or not before[metric][1]:
+                continue
+            old = before[metric][1]
+            change = (value - old) / old
+            worse = -change if DIRECTIONS[kind] else change
+            rows.append((name, metric, old, value, change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="run the benchmarks")
+    p.add_argument("--out", default="benchmark_results.json")
+    p.add_argument("--suites", nargs="+", default=list(SUITES), choices=SUITES)
+    p.add_argument("--resolution", default="1920x1080", help="synthetic image size, WIDTHxHEIGHT")
+    p.add_argument("--boxes", type=int, default=3, help="bottles/logo boxes per image")
+    p.add_argument("--iterations", type=int, default=20)
+    p.add_argument("--warmup", type=int, default=3)
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    p.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--brand-weights", help="directory with the brand checkpoints (default: brand_predictor/)")
+    p.add_argument("--dim-weights", help="directory with the segmentation weights (default: dim_predictor/)")
+
+    c = sub.add_parser("compare", help="flag regressions between two result files")
+    c.add_argument("baseline")
+    c.add_argument("current")
+    c.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        config = {
+            "suites": args.suites,
+            "resolution": parse_resolution(args.resolution),
+            "boxes": args.boxes,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "batch_sizes": args.batch_sizes,
+            "threads": sorted(set(args.threads)),
+            "seed": args.seed,
+            "brand_weights": args.brand_weights,
+            "dim_weights": args.dim_weights,
+        }
+        results = run(config)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        for name in config["suites"]:
+            print(f"\n{name} (weights: {results[name]['weights']}, peak RSS {results[name]['peak_rss_mb']:.0f} MB)")
+            for stage, stats in results[name]["stages"].items():
+                print(f"  {stage:<22} p50 {stats['p50']:>9.2f} ms   p95 {stats['p95']:>9.2f} ms")
+            for row in results[name]["throughput"]:
+                failed = f"   {row['failed']} failed" if row.get("failed") else ""
+                print(f"  threads={row['threads']:<3} batch={row['batch_size']:<3} {row['images_per_s']:>8.2f} images/s{failed}")
+        print(f"\nWrote {args.out}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("config", {}).get("resolution") != current.get("config", {}).get("resolution"):
+        print("Warning: runs used different resolutions")
+
+    rows = compare(baseline, current, args.threshold)
+    for name, metric, old, new, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<6} {metric:<40} {old:>10.2f} -> {new:>10.2f} {change:>+8.1%} {flag}")
+    regressions = [r for r in rows if r[5]]
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
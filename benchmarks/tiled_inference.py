@@ -0,0 +1,85 @@
+"""Tiled vs single-pass YOLO inference on large images.
+
+    python benchmarks/tiled_inference.py --resolutions 1280x960 2000x1500 4000x3000 --tile-size 1280 --out tiling.json
+
+For each resolution, a synthetic pile of --boxes bottles goes through the
+segmentation model (dim_predictor MODEL_NAME, randomly initialised if the
+checkpoint is missing) once as a whole image and once through
+serving/tiling.py TiledDetector. The report holds latency, tile count, ms
+per tile and ms per megapixel (flat across resolutions when cost is
+linear in area), plus detections found by each path. Detection counts only
+mean something with real weights.
+"""
+import argparse
+import json
+import os
+import sys
+
+from common import ROOT, parse_resolution, set_threads, summarize, synthetic_scene, time_calls
+
+sys.path.append(os.path.join(ROOT, "dim_predictor"))
+sys.path.append(os.path.join(ROOT, "serving"))
+
+from bench_dim import _model  # noqa: E402
+
+
+def run(config):
+    from measurement import CONFIDENCE, IMG_SIZE
+    from tiling import TiledDetector, tile_grid
+
+    set_threads(config["threads"])
+    model, source = _model(config["weights_dir"], config["seed"])
+    tiled = TiledDetector(model, tile_size=config["tile_size"], overlap=config["overlap"], max_batch=config["tile_batch"])
+    kwargs = dict(imgsz=IMG_SIZE, conf=CONFIDENCE, device="cpu", verbose=False)
+
+    rows = []
+    for width, height in config["resolutions"]:
+        image, _, _ = synthetic_scene(width, height, config["boxes"], seed=config["seed"])
+        tiles = len(tile_grid(width, height, config["tile_size"], config["overlap"]))
+        single = summarize(time_calls(lambda: model.predict(image, **kwargs), config["iterations"], config["warmup"]))
+        multi = summarize(time_calls(lambda: tiled.predict(image, **kwargs), config["iterations"], config["warmup"]))
+        megapixels = width * height / 1e6
+        rows.append({
+            "resolution": f"{width}x{height}",
+            "tiles": tiles,
+            "single_pass": single,
+            "tiled": multi,
+            "tiled_ms_per_tile": multi["p50"] / tiles,
+            "tiled_ms_per_megapixel": multi["p50"] / megapixels,
+            "detections": {
+                "single_pass": len(model.predict(image, **kwargs)[0].boxes),
+                "tiled": len(tiled.predict(image, **kwargs)[0].boxes),
+            },
+        })
+        r = rows[-1]
+        print(f"{r['resolution']:>10} {tiles:>5} tiles: single {single['p50']:>7.0f} ms | tiled {multi['p50']:>7.0f} ms "
+              f"({r['tiled_ms_per_tile']:.0f} ms/tile, {r['tiled_ms_per_megapixel']:.0f} ms/MP) | "
+              f"detections {r['detections']['single_pass']} vs {r['detections']['tiled']}", flush=True)
+    return {"weights": source, "rows": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", nargs="+", default=["1280x960", "2000x1500", "4000x3000"])
+    parser.add_argument("--boxes", type=int, default=24, help="bottles per synthetic image")
+    parser.add_argument("--tile-size", type=int, default=1280)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--tile-batch", type=int, default=16, help="tiles per forward")
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--weights-dir", default=os.path.join(ROOT, "dim_predictor"))
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    config = dict(vars(args), resolutions=[parse_resolution(r) for r in args.resolutions])
+    results = run(config)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"config": dict(config, resolutions=args.resolutions), **results}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,156 @@
-import gradio as gr
-from pipeline import BrandAttentionPipeline
-from PIL import Image
 import os
+import sys
+import threading
+from contextlib import nullcontext
+from startup import StartupTimer
+
+timer = StartupTimer()
+with timer.phase("import torch + pipeline"):
+    from pipeline import BrandAttentionPipeline, CLASSES
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serving"))
+from batching import MicroBatcher, OverloadedError
+from cache import cache_from_env, weights_version
+from metrics import instrumentation_from_env
+from profiling import profiler_from_env
+from tiling import tiled_from_env
+from worker_pool import WorkerPool, cpu_ids
 
 # --- DEPENDENCIES ---
 YOLO_PATH = "Logo_Detection_Yolov8.pt"
-SALIENCY_PATH = "ECT_SAL.pth"
+# SALIENCY_ARCH=lite: a LiteSaliency checkpoint from distill_saliency.py (SALIENCY_PATH) instead of ECT_SAL
+SALIENCY_ARCH = os.environ.get("SALIENCY_ARCH", "ect_sal")
+SALIENCY_PATH = os.environ.get("SALIENCY_PATH", "lite_saliency.pth" if SALIENCY_ARCH == "lite" else "ECT_SAL.pth")
 CLASSIFIER_PATH = "brand_attention_efficientnet_twostream.pth"
+# eager | torchscript | onnx (artifacts from export.py in ARTIFACTS_DIR)
+BACKEND = os.environ.get("BRAND_BACKEND", "eager")
+ARTIFACTS_DIR = os.environ.get("ARTIFACTS_DIR", "exported")
+# Load-time graph optimizations per eager model, comma-separated fold_bn,channels_last,compile
+# (pick them with optimize_report.py)
+OPTIMIZATIONS = {
+    "saliency": [o.strip() for o in os.environ.get("BRAND_OPTIMIZE_SALIENCY", "").split(",") if o.strip()],
+    "classifier": [o.strip() for o in os.environ.get("BRAND_OPTIMIZE_CLASSIFIER", "").split(",") if o.strip()],
+}
+# Confidence-gated cascade: ECT_SAL only for uncertain images (tune thresholds with cascade_report.py)
+CASCADE = os.environ.get("CASCADE", "0") == "1"
+CASCADE_THRESHOLDS = {
+    key: float(os.environ[env])
+    for key, env in (("min_detection_confidence", "CASCADE_MIN_DETECTION"), ("min_margin", "CASCADE_MIN_MARGIN"))
+    if env in os.environ
+}
+
+# Results are cached per decoded image and weights version (CACHE_* env vars)
+MODEL_VERSION = f"{weights_version(YOLO_PATH, SALIENCY_PATH, CLASSIFIER_PATH)}-{BACKEND}"
+if SALIENCY_ARCH != "ect_sal":
+    MODEL_VERSION += f"-{SALIENCY_ARCH}"
+if CASCADE:
+    MODEL_VERSION += "-cascade" + "".join(f"-{key}={value}" for key, value in sorted(CASCADE_THRESHOLDS.items()))
+if int(os.environ.get("BRAND_TILE_SIZE", 0)) > 0:
+    MODEL_VERSION += f"-tile{os.environ['BRAND_TILE_SIZE']}-{os.environ.get('BRAND_TILE_OVERLAP', 0.2)}"
+cache = cache_from_env()
+
+# Cross-request micro-batching
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+BATCH_MAX_QUEUE = int(os.environ.get("BATCH_MAX_QUEUE", 64))
+
+# WORKERS > 1: inference in forked worker processes sharing one copy of the weights
+# (find the best split with autotune.py)
+WORKERS = int(os.environ.get("WORKERS", 1))
+THREADS_PER_WORKER = int(os.environ.get("THREADS_PER_WORKER", max(len(cpu_ids()) // WORKERS, 1)))
+
+# Stage metrics on METRICS_PORT (unset: off; e.g. 9101), sampled torch.profiler traces (PROFILE_SAMPLE_RATE)
+instrumentation = instrumentation_from_env("brand")
+profiler = profiler_from_env()
 
-CLASSES = [
-    'Aquafina', 'Bisleri', 'Coca-Cola', 'Fanta', 
-    'Pepsi', 'Sprite', 'Tropicana', 'Unbranded'
+# Warm-up image shapes run at startup, "HxW" comma-separated ("" disables)
+WARMUP_SHAPES = [
+    tuple(int(v) for v in shape.lower().split("x"))
+    for shape in os.environ.get("WARMUP_SHAPES", "640x640").split(",") if shape.strip()
 ]
 
-# Initialize Pipeline (Global)
-try:
+# Set once loading succeeds; with WORKERS > 1 and a spawn/forkserver pool there is no pipeline in this process
+pipeline = batcher = None
+
+def build_pipeline():
     pipeline = BrandAttentionPipeline(
         yolo_path=YOLO_PATH,
         saliency_path=SALIENCY_PATH,
         classifier_path=CLASSIFIER_PATH,
-        classes=CLASSES
+        classes=CLASSES,
+        backend=BACKEND,
+        artifacts_dir=ARTIFACTS_DIR,
+        warmup_shapes=WARMUP_SHAPES,
+        timer=timer,
+        cascade=CASCADE,
+        cascade_thresholds=CASCADE_THRESHOLDS,
+        saliency_arch=SALIENCY_ARCH,
+        optimizations=OPTIMIZATIONS,
     )
-    print("Pipeline initialized successfully.")
-except Exception as e:
-    print(f"Error initializing pipeline: {e}")
-    pipeline = None
+    # BRAND_TILE_SIZE > 0: detect logos in overlapping tiles of large photos (BRAND_TILE_OVERLAP, BRAND_TILE_BATCH)
+    pipeline.yolo = tiled_from_env(pipeline.yolo, "BRAND_TILE")
+    return pipeline
+
+def load_pipeline():
+    global pipeline, batcher
+    try:
+        if WORKERS > 1:
+            # Stage metrics of the workers stay in their processes; requests are still timed here
+            batcher = WorkerPool(
+                build_pipeline,
+                "predict_batch",
+                workers=WORKERS,
+                threads_per_worker=THREADS_PER_WORKER,
+                max_batch_size=BATCH_MAX_SIZE,
+                max_queue=BATCH_MAX_QUEUE,
+                name="brand-worker",
+            )
+            pipeline = batcher.target
+            print(f"Started {WORKERS} workers x {THREADS_PER_WORKER} threads.")
+        else:
+            pipeline = build_pipeline()
+            # Warm-up runs stay out of the request metrics
+            pipeline.instrumentation = instrumentation
+            batcher = MicroBatcher(
+                profiler.wrap(pipeline.predict_batch, "brand"),
+                max_batch_size=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                max_queue=BATCH_MAX_QUEUE,
+                name="brand-batcher",
+                instrumentation=instrumentation,
+            )
+        print("Pipeline initialized successfully.")
+    except Exception as e:
+        print(f"Error initializing pipeline: {e}")
+        pipeline = batcher = None
+
+# Initialize Pipeline (Global) while gradio is imported and the UI is built
+loader = threading.Thread(target=load_pipeline, name="pipeline-loader")
+loader.start()
+
+with timer.phase("import gradio"):
+    import gradio as gr
 
 def infer(image):
-    if pipeline is None:
+    if batcher is None:
         return "Error: Deployment not configured correctly (missing weights)."
     
     if image is None:
         return "Please upload an image."
     
-    brands = pipeline.predict(image)
+    try:
+        with instrumentation.stage("request") if instrumentation else nullcontext():
+            brands = cache.get_or_compute(image, MODEL_VERSION, lambda: batcher(image))
+    except OverloadedError:
+        return "Error: Server is overloaded, please retry shortly."
     if not brands:
         return "No brands detected."
     
     return ", ".join(brands)
 
+def cache_stats() -> dict:
+    return cache.stats()
+
 # --- GRADIO APP ---
 demo = gr.Interface(
     fn=infer,
@@ -48,6 +160,13 @@ demo = gr.Interface(
     description="Detects brands in images using a Two-Stream network (YOLOv8 + Saliency Map + EfficientNet). Handles unbranded images via saliency analysis.",
     examples=["test.jpg"] if os.path.exists("test.jpg") else None
 )
+with demo:
+    gr.api(cache_stats, api_name="cache_stats")
+
+loader.join()
+timer.log("Startup (load and gradio phases overlap)")
 
 if __name__ == "__main__":
+    # Let concurrent requests reach the batcher instead of queueing one at a time in Gradio
+    demo.queue(default_concurrency_limit=BATCH_MAX_QUEUE)
     demo.launch()
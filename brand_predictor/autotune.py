@@ -0,0 +1,124 @@
+"""Find the best worker processes x threads split for this machine.
+
+    python autotune.py --images sample_images/ --requests 64 --out autotune.json
+
+Starts a WorkerPool (serving/worker_pool.py) for every split of the
+available cores (1 x N, 2 x N/2, ... N x 1, plus --extra splits such as
+"3x2"). Each split serves the same single-image requests, all submitted at
+once as concurrent clients would. Reports throughput, request latency and
+the private memory of each worker, i.e. what the shared weights do not
+cover. The pipeline is built once; every pool forks from it. The winner
+goes into the app as WORKERS and THREADS_PER_WORKER.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serving"))
+from worker_pool import WorkerPool, cpu_ids, private_memory_bytes
+
+from report_utils import add_model_args, load_images
+
+
+def splits(cpus, extra=()):
+    """(workers, threads) pairs that use all cpus, plus extra "WxT" strings."""
+    pairs = {(w, cpus // w) for w in range(1, cpus + 1) if cpus % w == 0}
+    for spec in extra:
+        w, t = (int(v) for v in spec.lower().split("x"))
+        pairs.add((w, t))
+    return sorted(pairs)
+
+
+def load_requests(folder, count, size):
+    """count BGR images, cycled from folder, or textured synthetic size x size images."""
+    if folder:
+        images = load_images(folder)
+    else:
+        rng = np.random.default_rng(0)
+        images = [
+            cv2.GaussianBlur((rng.random((size, size, 3)) * 255).astype(np.uint8), (9, 9), 3)
+            for _ in range(4)
+        ]
+    return [images[i % len(images)] for i in range(count)]
+
+
+def measure(pool, images):
+    """Throughput and request latency with every request in flight at once."""
+    # One request per worker first, so no worker pays its first-call costs in the measurement
+    for future in [pool.submit(img) for img in images[:pool.workers]]:
+        future.result()
+    start = time.perf_counter()
+    submitted = [(time.perf_counter(), pool.submit(img)) for img in images]
+    latencies = []
+    for sent, future in submitted:
+        future.result()
+        latencies.append(time.perf_counter() - sent)
+    wall = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    private = [private_memory_bytes(pid) for pid in pool.pids]
+    return {
+        "workers": pool.workers,
+        "threads_per_worker": pool.threads_per_worker,
+        "images_per_second": len(images) / wall,
+        "latency_ms": {"p50": float(np.percentile(latencies, 50)), "p95": float(np.percentile(latencies, 95))},
+        "worker_private_mb": [p / 1e6 for p in private] if None not in private else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="folder of sample images (default: synthetic)")
+    parser.add_argument("--size", type=int, default=640, help="synthetic image size")
+    parser.add_argument("--requests", type=int, default=32, help="requests per split")
+    parser.add_argument("--cpus", type=int, default=len(cpu_ids()), help="cores to split (default: all available)")
+    parser.add_argument("--extra", default="", help="additional comma-separated WORKERSxTHREADS splits")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    add_model_args(parser)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    images = load_requests(args.images, args.requests, args.size)
+    pipeline = None
+
+    def build():
+        # Built (and warmed up) on the first pool only; later pools fork from the same object
+        nonlocal pipeline
+        if pipeline is None:
+            from pipeline import CLASSES, BrandAttentionPipeline
+
+            pipeline = BrandAttentionPipeline(
+                args.yolo, args.saliency, args.classifier, CLASSES, warmup_shapes=[images[0].shape[:2]]
+            )
+        return pipeline
+
+    results = []
+    candidates = splits(args.cpus, [s for s in args.extra.split(",") if s.strip()])
+    print(f"{'workers':>7} {'threads':>7} {'img/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'private MB/worker':>18}")
+    for workers, threads in candidates:
+        pool = WorkerPool(build, "predict_boxes_bgr", workers=workers, threads_per_worker=threads,
+                          max_batch_size=args.max_batch_size, max_queue=len(images) + workers)
+        try:
+            r = measure(pool, images)
+        finally:
+            pool.close()
+        results.append(r)
+        private = f"{np.mean(r['worker_private_mb']):.0f}" if r["worker_private_mb"] else "n/a"
+        print(f"{workers:>7} {threads:>7} {r['images_per_second']:>7.2f} {r['latency_ms']['p50']:>8.0f} "
+              f"{r['latency_ms']['p95']:>8.0f} {private:>18}")
+
+    best = max(results, key=lambda r: r["images_per_second"])
+    print(f"Best: WORKERS={best['workers']} THREADS_PER_WORKER={best['threads_per_worker']} "
+          f"({best['images_per_second']:.2f} images/s)")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"cpus": args.cpus, "requests": len(images), "results": results, "best": best}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import os
+import torch
+
+BACKENDS = ("eager", "torchscript", "onnx")
+QUANTIZATION = (None, "dynamic", "static")
+EXTENSIONS = {"torchscript": ".pt", "onnx": ".onnx"}
+
+# Exported graph names inside an artifacts directory (see export.py)
+SALIENCY_ARTIFACT = "ect_sal"
+ENCODER_ARTIFACT = "classifier_encoder"
+HEAD_ARTIFACT = "classifier_head"
+YOLO_ARTIFACT = "logo_yolo"
+
+
+def artifact_path(artifacts_dir, name, backend):
+    return os.path.join(artifacts_dir, name + EXTENSIONS[backend])
+
+
+class TorchScriptGraph:
+    def __init__(self, path, device):
+        self.device = device
+        self.module = torch.jit.load(path, map_location=device).eval()
+
+    def __call__(self, *inputs):
+        return self.module(*[x.to(self.device) for x in inputs])
+
+
+class OnnxGraph:
+    """Runs an ONNX graph with onnxruntime, taking and returning torch tensors."""
+
+    def __init__(self, path, device):
+        import onnxruntime as ort
+
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.device = device
+        self.session = ort.InferenceSession(path, providers=providers)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, *inputs):
+        feeds = {name: x.detach().cpu().numpy() for name, x in zip(self.input_names, inputs)}
+        return torch.from_numpy(self.session.run(None, feeds)[0]).to(self.device)
+
+
+def load_graph(backend, path, device):
+    if backend == "torchscript":
+        return TorchScriptGraph(path, device)
+    if backend == "onnx":
+        return OnnxGraph(path, device)
+    raise ValueError(f"Unknown backend: {backend} (expected one of {BACKENDS})")
+
+
+class ExportedSaliency:
+    """ECT_SAL artifact with the eager module's call signature."""
+
+    def __init__(self, backend, artifacts_dir, device):
+        self.graph = load_graph(backend, artifact_path(artifacts_dir, SALIENCY_ARTIFACT, backend), device)
+
+    def __call__(self, img, tmap):
+        return self.graph(img, tmap)
+
+
+class ExportedClassifier:
+    """TwoStreamEfficientNet artifacts (encoder + head) with the eager encode/classify API."""
+
+    def __init__(self, backend, artifacts_dir, device):
+        self.encoder = load_graph(backend, artifact_path(artifacts_dir, ENCODER_ARTIFACT, backend), device)
+        self.head = load_graph(backend, artifact_path(artifacts_dir, HEAD_ARTIFACT, backend), device)
+
+    def encode(self, x):
+        return self.encoder(x)
+
+    def classify(self, yolo_features, saliency_features):
+        if saliency_features.shape[0] != yolo_features.shape[0]:
+            saliency_features = saliency_features.expand(yolo_features.shape[0], -1)
+        return self.head(yolo_features, saliency_features)
+
+    def __call__(self, yolo_input, saliency_input):
+        return self.classify(self.encode(yolo_input), self.encode(saliency_input))
+
+
+def exported_yolo_path(artifacts_dir, backend, fallback):
+    """Exported logo detector if present (Ultralytics loads .onnx/.torchscript itself), else fallback."""
+    ext = {"torchscript": ".torchscript", "onnx": ".onnx"}[backend]
+    path = os.path.join(artifacts_dir, YOLO_ARTIFACT + ext)
+    return path if os.path.exists(path) else fallback
+
+
+def select_quantized_engine():
+    """Pick the best available INT8 kernel backend (x86 > fbgemm > qnnpack on ARM)."""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"No INT8 quantized engine available (supported: {supported})")
+
+
+def quantize_transformer_linears(module):
+    """Dynamic INT8 for the nn.Linear layers inside Attention/Mlp blocks, in place; everything else stays FP32."""
+    from torch.ao.quantization import quantize_dynamic
+    from model_arch import Attention, Mlp
+
+    select_quantized_engine()
+    return quantize_dynamic(module, {Attention, Mlp}, dtype=torch.qint8, inplace=True)
+
+
+# Load-time graph optimizations for the eager modules, applied in this order (see optimize_for_inference)
+OPTIMIZATIONS = ("fold_bn", "channels_last", "compile")
+
+
+def conv_bn_pairs(module, prefix=""):
+    """(conv, bn) names where every call of bn reads the output of conv and nothing else does.
+
+    Found by tracing module with torch.fx. Submodules without BatchNorm2d are
+    not traced into. If module's forward does not trace (e.g. Python control
+    flow on tensor shapes), its children are searched one by one.
+    """
+    import torch.fx as fx
+    import torch.nn as nn
+
+    def has_bn(m):
+        return any(isinstance(x, nn.BatchNorm2d) for x in m.modules())
+
+    class Tracer(fx.Tracer):
+        def is_leaf_module(self, m, qualified_name):
+            return super().is_leaf_module(m, qualified_name) or not has_bn(m)
+
+    try:
+        graph = Tracer().trace(module)
+    except Exception:
+        return [
+            pair
+            for name, child in module.named_children() if has_bn(child)
+            for pair in conv_bn_pairs(child, f"{prefix}{name}.")
+        ]
+
+    modules = dict(module.named_modules())
+    calls = {}
+    for node in graph.nodes:
+        if node.op == "call_module":
+            calls.setdefault(node.target, []).append(node)
+
+    def feeds_only(conv_node, bn_target):
+        return len(conv_node.users) == 1 and next(iter(conv_node.users)).target == bn_target
+
+    pairs = []
+    for target, nodes in calls.items():
+        if not isinstance(modules[target], nn.BatchNorm2d):
+            continue
+        sources = {n.args[0].target if isinstance(n.args[0], fx.Node) and n.args[0].op == "call_module" else None
+                   for n in nodes}
+        if len(sources) != 1 or None in sources:
+            continue
+        source = sources.pop()
+        if isinstance(modules[source], nn.Conv2d) and all(feeds_only(n, target) for n in calls[source]):
+            pairs.append((prefix + source, prefix + target))
+    return pairs
+
+
+def fold_batchnorm(model):
+    """Fold eval-mode BatchNorm2d layers into the Conv2d that feeds them, in place. Returns how many were folded."""
+    import torch.nn as nn
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+    pairs = conv_bn_pairs(model)
+    for conv_name, bn_name in pairs:
+        fused = fuse_conv_bn_eval(model.get_submodule(conv_name), model.get_submodule(bn_name))
+        for name, replacement in ((conv_name, fused), (bn_name, nn.Identity())):
+            parent, _, attr = name.rpartition(".")
+            setattr(model.get_submodule(parent), attr, replacement)
+    return len(pairs)
+
+
+def optimize_for_inference(model, optimizations, compile_methods=("forward",)):
+    """Apply OPTIMIZATIONS to an eval-mode model in place.
+
+    "fold_bn": fold_batchnorm. "channels_last": 4D weights in NHWC, the
+    layout oneDNN convolutions prefer on CPU (feed inputs in the same
+    format). "compile": wrap compile_methods with torch.compile (dynamic
+    batch size); the first call of each new shape pays for compilation.
+    """
+    unknown = set(optimizations) - set(OPTIMIZATIONS)
+    if unknown:
+        raise ValueError(f"Unknown optimizations: {sorted(unknown)} (expected some of {OPTIMIZATIONS})")
+    if "fold_bn" in optimizations:
+        fold_batchnorm(model)
+    if "channels_last" in optimizations:
+        model.to(memory_format=torch.channels_last)
+    if "compile" in optimizations:
+        for name in compile_methods:
+            setattr(model, name, torch.compile(getattr(model, name), dynamic=True))
+    return model
@@ -0,0 +1,78 @@
+"""Escalation rate, agreement and speedup of the confidence-gated cascade.
+
+    python cascade_report.py --images labelled_images/ --margins 0.1,0.3,0.5 --out cascade_report.json
+
+Runs the full pipeline (ECT_SAL on every image) and the cascade
+(BrandAttentionPipeline(..., cascade=True)) over the same images, once per
+--margins value, and reports how many images escalated to ECT_SAL, how
+often the cascade agrees with the full pipeline, and how much faster it is.
+Pick the smallest margin whose agreement is acceptable and set it with
+CASCADE_MIN_MARGIN.
+"""
+import argparse
+import json
+
+import torch
+
+from pipeline import CASCADE_THRESHOLDS, CLASSES, BrandAttentionPipeline
+from report_utils import add_model_args, agreement, latency, load_images, predict_timed
+
+
+def build_report(pipeline, images, margins, min_detection_confidence):
+    """Full pipeline vs cascade at each margin threshold, on one pipeline instance."""
+    pipeline.cascade = False
+    full_predictions, full_ms = predict_timed(pipeline, images)
+    report = {
+        "images": len(images),
+        "threads": torch.get_num_threads(),
+        "full": {"latency_ms": latency(full_ms)},
+        "cascade": {},
+    }
+
+    pipeline.cascade = True
+    for margin in margins:
+        pipeline.cascade_thresholds = dict(
+            CASCADE_THRESHOLDS, min_margin=margin, min_detection_confidence=min_detection_confidence
+        )
+        predictions, ms = predict_timed(pipeline, images)
+        report["cascade"][str(margin)] = {
+            "min_margin": margin,
+            "min_detection_confidence": min_detection_confidence,
+            "escalation_rate": pipeline.cascade_stats["escalated"] / len(images),
+            "latency_ms": latency(ms),
+            "speedup": float(full_ms.mean() / ms.mean()),
+            "agreement": agreement(full_predictions, predictions),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="folder of test images")
+    add_model_args(parser)
+    parser.add_argument("--limit", type=int, help="use at most this many images")
+    parser.add_argument("--margins", default=str(CASCADE_THRESHOLDS["min_margin"]),
+                        help="comma-separated min_margin values to evaluate")
+    parser.add_argument("--min-detection", type=float, default=CASCADE_THRESHOLDS["min_detection_confidence"])
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    pipeline = BrandAttentionPipeline(args.yolo, args.saliency, args.classifier, CLASSES)
+    images = load_images(args.images, args.limit)
+    margins = [float(m) for m in args.margins.split(",")]
+    report = build_report(pipeline, images, margins, args.min_detection)
+
+    print(f"full pipeline: {report['full']['latency_ms']['mean']:.1f} ms/image over {len(images)} images")
+    print(f"{'margin':>7} {'escalated':>10} {'mean ms':>8} {'speedup':>8} {'label set':>10} {'top-1':>6}")
+    for r in report["cascade"].values():
+        print(f"{r['min_margin']:>7.2f} {r['escalation_rate']:>10.1%} {r['latency_ms']['mean']:>8.1f} "
+              f"{r['speedup']:>8.2f} {r['agreement']['label_set']:>10.3f} {r['agreement']['top1']:>6.3f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Distil ECT_SAL into the small LiteSaliency network on local images.
+
+    python distill_saliency.py --images unlabelled_images/ --out lite_saliency.pth --epochs 30 --report distill_report.json
+
+ECT_SAL (the teacher) runs once over every image, on exactly the 256x256
+image and get_text_map_simple inputs the pipeline feeds it. Its maps are
+the training targets, so no labels are needed. LiteSaliency (the student)
+is trained to reproduce them (BCE on soft targets, random horizontal
+flips), and the checkpoint with the lowest validation error is written to
+--out. Load it with BrandAttentionPipeline(..., saliency_arch="lite") or
+SALIENCY_ARCH=lite.
+
+--report runs the held-out images through the pipeline with both saliency
+models and reports:
+- the saliency-map error on the maps the pipeline actually uses;
+- how often the brand predictions agree;
+- saliency and end-to-end latency on CPU.
+"""
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from model_arch import LiteSaliency
+from pipeline import CLASSES, BrandAttentionPipeline, load_saliency_model, saliency_model_inputs
+from report_utils import add_model_args, agreement, latency, load_images, predict_timed, state_dict_mb
+
+
+def teacher_targets(teacher, images, batch_size):
+    """uint8 (N, 3, 256, 256) images and text maps, and ECT_SAL's float16 (N, 1, 256, 256) maps."""
+    inputs, tmaps, targets = [], [], []
+    with torch.inference_mode():
+        for start in range(0, len(images), batch_size):
+            img_t, tmap_t = saliency_model_inputs(images[start:start + batch_size])
+            targets.append(teacher(img_t, tmap_t).half())
+            # Stored as uint8: the inputs are uint8 images / 255 to begin with
+            inputs.append(img_t.mul(255).round().to(torch.uint8))
+            tmaps.append(tmap_t.mul(255).round().to(torch.uint8))
+            print(f"Teacher: {min(start + batch_size, len(images))}/{len(images)} images", flush=True)
+    return torch.cat(inputs), torch.cat(tmaps), torch.cat(targets)
+
+
+def map_error(student, inputs, tmaps, targets, batch_size=32):
+    """Error of the student's maps after the pipeline's own sigmoid: MAE, max and correlation (CC)."""
+    student.eval()
+    abs_err, max_err, ccs = [], 0.0, []
+    with torch.inference_mode():
+        for start in range(0, len(inputs), batch_size):
+            end = start + batch_size
+            pred = torch.sigmoid(student(inputs[start:end].float() / 255, tmaps[start:end].float() / 255))
+            ref = torch.sigmoid(targets[start:end].float())
+            diff = (pred - ref).abs()
+            abs_err.append(diff.flatten(1).mean(dim=1))
+            max_err = max(max_err, float(diff.max()))
+            ccs.extend(float(np.corrcoef(p.flatten(), r.flatten())[0, 1]) for p, r in zip(pred.numpy(), ref.numpy()))
+    return {"mae": float(torch.cat(abs_err).mean()), "max_abs": max_err, "cc": float(np.nanmean(ccs))}
+
+
+def distill(student, data, val_data, epochs, batch_size, lr, seed=0):
+    """Train student on (inputs, tmaps, targets); returns the weights with the lowest validation MAE."""
+    generator = torch.Generator().manual_seed(seed)
+    inputs, tmaps, targets = data
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    steps = epochs * ((len(inputs) + batch_size - 1) // batch_size)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=lr, total_steps=steps)
+    loss_fn = nn.BCEWithLogitsLoss()
+
+    best, best_state = None, copy.deepcopy(student.state_dict())
+    for epoch in range(epochs):
+        student.train()
+        start, losses = time.perf_counter(), []
+        for idx in torch.randperm(len(inputs), generator=generator).split(batch_size):
+            img, tmap, target = inputs[idx].float() / 255, tmaps[idx].float() / 255, targets[idx].float()
+            flip = torch.rand(len(idx), generator=generator) < 0.5
+            img[flip], tmap[flip], target[flip] = img[flip].flip(-1), tmap[flip].flip(-1), target[flip].flip(-1)
+            loss = loss_fn(student.logits(img, tmap), target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            losses.append(loss.item())
+
+        val = map_error(student, *val_data)
+        print(f"epoch {epoch + 1}/{epochs}: loss {np.mean(losses):.4f}, val MAE {val['mae']:.4f}, "
+              f"CC {val['cc']:.3f} ({time.perf_counter() - start:.0f} s)", flush=True)
+        if best is None or val["mae"] < best:
+            best, best_state = val["mae"], copy.deepcopy(student.state_dict())
+    student.load_state_dict(best_state)
+    return student.eval()
+
+
+def saliency_latency(pipeline, images):
+    """ms per image of run_saliency_batch, one image per call."""
+    pipeline.run_saliency_batch(images[:1])  # warm-up
+    ms = []
+    for img in images:
+        start = time.perf_counter()
+        pipeline.run_saliency_batch([img], output_size=(pipeline.img_size, pipeline.img_size))
+        ms.append((time.perf_counter() - start) * 1000)
+    return np.array(ms)
+
+
+def build_report(reference, student, images):
+    """ECT_SAL pipeline vs the same pipeline with the student as saliency model, on held-out images."""
+    lite = copy.copy(reference)
+    lite.saliency_model, lite.saliency_arch = student, "lite"
+
+    size = (reference.img_size, reference.img_size)
+    ref_maps = np.stack(reference.run_saliency_batch(images, output_size=size))
+    lite_maps = np.stack(lite.run_saliency_batch(images, output_size=size))
+    diff = np.abs(ref_maps - lite_maps)
+
+    ref_predictions, ref_ms = predict_timed(reference, images)
+    predictions, ms = predict_timed(lite, images)
+    ref_sal_ms, sal_ms = saliency_latency(reference, images), saliency_latency(lite, images)
+    return {
+        "images": len(images),
+        "threads": torch.get_num_threads(),
+        "saliency_map": {
+            "mae": float(diff.mean()),
+            "max_abs": float(diff.max()),
+            "cc": float(np.mean([np.corrcoef(a.ravel(), b.ravel())[0, 1] for a, b in zip(ref_maps, lite_maps)])),
+        },
+        "agreement": agreement(ref_predictions, predictions),
+        "ect_sal": {
+            "saliency_ms": latency(ref_sal_ms),
+            "latency_ms": latency(ref_ms),
+            "size_mb": state_dict_mb(reference.saliency_model),
+        },
+        "lite": {
+            "saliency_ms": latency(sal_ms),
+            "latency_ms": latency(ms),
+            "size_mb": state_dict_mb(student),
+        },
+        "saliency_speedup": float(ref_sal_ms.mean() / sal_ms.mean()),
+        "speedup": float(ref_ms.mean() / ms.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="folder of training images (no labels needed)")
+    add_model_args(parser, saliency_help="teacher checkpoint")
+    parser.add_argument("--out", default="lite_saliency.pth")
+    parser.add_argument("--limit", type=int, help="use at most this many images")
+    parser.add_argument("--val-fraction", type=float, default=0.1, help="images held out for validation and --report")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=2e-3)
+    parser.add_argument("--pretrained", action="store_true", help="start from ImageNet MobileNetV3 weights (download)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="write the ECT_SAL vs LiteSaliency comparison to this JSON file")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    images = load_images(args.images, args.limit)
+    order = np.random.default_rng(args.seed).permutation(len(images))
+    n_val = max(1, int(round(len(images) * args.val_fraction)))
+    train_images = [images[i] for i in order[n_val:]]
+    val_images = [images[i] for i in order[:n_val]]
+    if not train_images:
+        raise ValueError(f"Need more than {n_val} images to hold out {n_val} for validation")
+
+    teacher = load_saliency_model(args.saliency, torch.device("cpu"))
+    data = teacher_targets(teacher, train_images, args.batch_size)
+    val_data = teacher_targets(teacher, val_images, args.batch_size)
+    del teacher
+
+    print(f"Distilling on {len(train_images)} images, validating on {len(val_images)}...")
+    student = distill(LiteSaliency(pretrained=args.pretrained), data, val_data, args.epochs, args.batch_size,
+                      args.lr, args.seed)
+    torch.save(student.state_dict(), args.out)
+    print(f"Wrote {args.out} (val {map_error(student, *val_data)})")
+
+    if args.report:
+        reference = BrandAttentionPipeline(args.yolo, args.saliency, args.classifier, CLASSES, device=torch.device("cpu"))
+        report = dict(build_report(reference, student, val_images), val_images=len(val_images))
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"saliency maps: MAE {report['saliency_map']['mae']:.4f}, CC {report['saliency_map']['cc']:.3f}")
+        print(f"{'model':<8} {'sal ms':>8} {'mean ms':>8} {'size MB':>8}")
+        for name in ("ect_sal", "lite"):
+            r = report[name]
+            print(f"{name:<8} {r['saliency_ms']['mean']:>8.1f} {r['latency_ms']['mean']:>8.1f} {r['size_mb']:>8.1f}")
+        agree = report["agreement"]
+        print(f"speedup {report['speedup']:.2f}x (saliency {report['saliency_speedup']:.1f}x), "
+              f"label set {agree['label_set']:.3f}, top-1 {agree['top1']:.3f}")
+        print(f"Wrote {args.report}")
+
+
+if __name__ == "__main__":
+    main()
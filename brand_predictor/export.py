@@ -0,0 +1,149 @@
+"""Export the brand models to TorchScript / ONNX for the non-eager pipeline backends.
+
+    python export.py --out exported --formats torchscript onnx --check
+
+Writes ect_sal, classifier_encoder and classifier_head graphs with a
+dynamic batch axis, plus the logo YOLO through Ultralytics' own exporter.
+--check compares every exported graph against the eager modules.
+--saliency-arch lite exports a distill_saliency.py checkpoint as the
+saliency graph instead of ECT_SAL.
+"""
+import argparse
+import inspect
+import os
+import shutil
+
+import torch
+import torch.nn as nn
+
+from backends import (
+    ENCODER_ARTIFACT,
+    HEAD_ARTIFACT,
+    SALIENCY_ARTIFACT,
+    YOLO_ARTIFACT,
+    ExportedClassifier,
+    ExportedSaliency,
+    artifact_path,
+)
+from pipeline import CLASSES, load_classifier, load_saliency_model
+from report_utils import add_model_args, saliency_checkpoint
+
+
+class ClassifierHead(nn.Module):
+    """TwoStreamEfficientNet.classify as a standalone graph (no broadcasting)."""
+
+    def __init__(self, classifier):
+        super().__init__()
+        self.classifier = classifier.classifier
+
+    def forward(self, yolo_features, saliency_features):
+        return self.classifier(torch.cat((yolo_features, saliency_features), dim=1))
+
+
+def _graphs(saliency_model, classifier, img_size):
+    num_features = classifier.classifier[1].in_features // 2
+    return {
+        SALIENCY_ARTIFACT: (saliency_model, (torch.rand(2, 3, 256, 256), torch.rand(2, 3, 256, 256)), ["img", "tmap"]),
+        ENCODER_ARTIFACT: (classifier.backbone, (torch.rand(2, 3, img_size, img_size),), ["x"]),
+        HEAD_ARTIFACT: (ClassifierHead(classifier).eval(), (torch.rand(2, num_features), torch.rand(2, num_features)), ["yolo_features", "saliency_features"]),
+    }
+
+
+def export_torchscript(module, example_inputs, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example_inputs)
+    torch.jit.save(torch.jit.freeze(traced), path)
+
+
+def export_onnx(module, example_inputs, input_names, path):
+    dynamic_axes = {name: {0: "batch"} for name in input_names + ["output"]}
+    # Newer torch defaults to the dynamo exporter; the TorchScript-based one handles dynamic_axes reliably
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            example_inputs,
+            path,
+            input_names=input_names,
+            output_names=["output"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            **kwargs,
+        )
+
+
+def export_yolo(yolo_path, fmt, out_dir):
+    from ultralytics import YOLO
+
+    exported = YOLO(yolo_path).export(format=fmt, dynamic=True)
+    target = os.path.join(out_dir, YOLO_ARTIFACT + os.path.splitext(exported)[1])
+    shutil.move(exported, target)
+    return target
+
+
+def export_all(saliency_model, classifier, out_dir, formats, img_size=260, yolo_path=None):
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name, (module, example_inputs, input_names) in _graphs(saliency_model, classifier, img_size).items():
+        for fmt in formats:
+            path = artifact_path(out_dir, name, fmt)
+            if fmt == "torchscript":
+                export_torchscript(module, example_inputs, path)
+            else:
+                export_onnx(module, example_inputs, input_names, path)
+            written.append(path)
+    if yolo_path:
+        for fmt in formats:
+            written.append(export_yolo(yolo_path, fmt, out_dir))
+    return written
+
+
+def check_parity(saliency_model, classifier, out_dir, backend, img_size=260, batch_size=3):
+    """Max absolute difference between eager and exported outputs, per graph.
+
+    Uses a batch size different from the export example, so the dynamic batch
+    axis is exercised too.
+    """
+    device = torch.device("cpu")
+    saliency = ExportedSaliency(backend, out_dir, device)
+    exported = ExportedClassifier(backend, out_dir, device)
+
+    img, tmap = torch.rand(batch_size, 3, 256, 256), torch.rand(batch_size, 3, 256, 256)
+    crops = torch.randn(batch_size, 3, img_size, img_size)
+    with torch.no_grad():
+        report = {
+            SALIENCY_ARTIFACT: (saliency_model(img, tmap) - saliency(img, tmap)).abs().max().item(),
+            ENCODER_ARTIFACT: (classifier.encode(crops) - exported.encode(crops)).abs().max().item(),
+        }
+        features = classifier.encode(crops)
+        report[HEAD_ARTIFACT] = (
+            classifier.classify(features, features[:1]) - exported.classify(features, features[:1])
+        ).abs().max().item()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_args(parser, yolo=False, saliency_arch=True)
+    parser.add_argument("--yolo", default="Logo_Detection_Yolov8.pt", help="set to '' to skip the YOLO export")
+    parser.add_argument("--out", default="exported")
+    parser.add_argument("--formats", nargs="+", default=["torchscript", "onnx"], choices=["torchscript", "onnx"])
+    parser.add_argument("--img-size", type=int, default=260)
+    parser.add_argument("--check", action="store_true", help="compare exported graphs against eager outputs")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    saliency_model = load_saliency_model(saliency_checkpoint(args), device, args.saliency_arch)
+    classifier = load_classifier(args.classifier, len(CLASSES), device)
+
+    for path in export_all(saliency_model, classifier, args.out, args.formats, args.img_size, args.yolo or None):
+        print(f"Wrote {path}")
+
+    if args.check:
+        for fmt in args.formats:
+            for name, diff in check_parity(saliency_model, classifier, args.out, fmt, args.img_size).items():
+                print(f"[{fmt}] {name}: max abs diff {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
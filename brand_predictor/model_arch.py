@@ -1,3 +1,4 @@
+import os
 import torch
 import torch.nn as nn
 import math
@@ -9,6 +10,8 @@ try:
 except ImportError:
     from torch.utils.model_zoo import load_url as load_state_dict_from_url
 
+from utils import normalize_batch
+
 # ==================================================================================================
 # ================================ PART 1: RESNET HELPERS ==========================================
 # ==================================================================================================
@@ -95,8 +98,8 @@ def resnet50(pretrained=False, progress=True, **kwargs):
         try:
              state_dict = load_state_dict_from_url("https://download.pytorch.org/models/resnet50-0676ba61.pth", progress=progress)
              model.load_state_dict(state_dict)
-        except:
-             pass 
+        except Exception as e:
+             print(f"Could not load ImageNet weights for ResNet-50, using random init: {e}")
     return model
 
 
@@ -104,6 +107,19 @@ def resnet50(pretrained=False, progress=True, **kwargs):
 # ============================ PART 2: TRANSFORMER & ECT_SAL =======================================
 # ==================================================================================================
 
+# "sdpa": fused scaled_dot_product_attention, which never materialises the tokens x tokens
+# score matrix. "math": the explicit matmul/softmax path (ECT_ATTENTION=math to fall back).
+ATTENTION_IMPL = os.environ.get("ECT_ATTENTION", "sdpa")
+
+def set_attention_impl(model, impl):
+    """Switch every Attention module of model to "sdpa" or "math"."""
+    if impl not in ("sdpa", "math"):
+        raise ValueError(f"Unknown attention implementation {impl!r}")
+    for module in model.modules():
+        if isinstance(module, Attention):
+            module.impl = impl
+    return model
+
 class Attention(nn.Module):
     def __init__(self, config):
         super(Attention, self).__init__()
@@ -117,6 +133,7 @@ class Attention(nn.Module):
         self.attn_dropout = nn.Dropout(config["attention_dropout_rate"])
         self.proj_dropout = nn.Dropout(config["attention_dropout_rate"])
         self.softmax = nn.Softmax(dim=-1)
+        self.impl = ATTENTION_IMPL
 
     def transpose_for_scores(self, x):
         new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
@@ -130,10 +147,14 @@ class Attention(nn.Module):
         query_layer = self.transpose_for_scores(mixed_query_layer)
         key_layer = self.transpose_for_scores(mixed_key_layer)
         value_layer = self.transpose_for_scores(mixed_value_layer)
-        attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
-        attention_scores = attention_scores / math.sqrt(self.attention_head_size)
-        attention_probs = self.attn_dropout(self.softmax(attention_scores))
-        context_layer = torch.matmul(attention_probs, value_layer)
+        if self.impl == "sdpa":
+            dropout_p = self.attn_dropout.p if self.training else 0.0
+            context_layer = nn.functional.scaled_dot_product_attention(query_layer, key_layer, value_layer, dropout_p=dropout_p)
+        else:
+            attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+            attention_scores = attention_scores / math.sqrt(self.attention_head_size)
+            attention_probs = self.attn_dropout(self.softmax(attention_scores))
+            context_layer = torch.matmul(attention_probs, value_layer)
         context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
         new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
         context_layer = context_layer.view(*new_context_layer_shape)
@@ -198,9 +219,9 @@ cfg2 = {"hidden_size" : 768, "mlp_dim" : 768*4, "num_heads" : 1, "num_layers" :
 cfg3 = {"hidden_size" : 512, "mlp_dim" : 512*4, "num_heads" : 1, "num_layers" : 1, "attention_dropout_rate" : 0.1, "dropout_rate" : 0.1}
 
 class _Encoder(nn.Module):
-    def __init__(self):
+    def __init__(self, pretrained=True):
         super(_Encoder, self).__init__()
-        base_model = resnet50(pretrained=True)
+        base_model = resnet50(pretrained=pretrained)
         base_layers = list(base_model.children())[:8]
         self.encoder = nn.ModuleList(base_layers).eval()
     def forward(self, x):
@@ -226,15 +247,22 @@ class _Decoder(nn.Module):
         self.TransEncoder3 = TransEncoder(in_channels=512, spatial_size=32*32, cfg=cfg3)
         self.add = torch.add; self.relu = nn.ReLU(True); self.upsample = nn.Upsample(scale_factor=2, mode='nearest'); self.sigmoid = nn.Sigmoid()
 
-    def forward(self, x , y ):
-        x3, x4, x5 = x; y3 , y4 , y5 = y
-        x5 = self.TransEncoder1(x5); y5 = self.TransEncoder1(y5)
+    def forward(self, x , y=None):
+        if y is None:
+            # Fused: x holds both streams stacked on the batch dim (image first, text map second)
+            x3, x4, x5 = x
+            x5, y5 = self.TransEncoder1(x5).chunk(2)
+            x4_a, y4 = self.TransEncoder2(x4).chunk(2)
+            x3_a, y3 = self.TransEncoder3(x3).chunk(2)
+        else:
+            x3, x4, x5 = x; y3 , y4 , y5 = y
+            x5 = self.TransEncoder1(x5); y5 = self.TransEncoder1(y5)
+            x4_a = self.TransEncoder2(x4); y4 = self.TransEncoder2(y4)
+            x3_a = self.TransEncoder3(x3); y3 = self.TransEncoder3(y3)
         x5 = self.alpha*x5 + (1-self.alpha)*y5 
         x5 = self.upsample(self.relu(self.batchnorm1(self.conv1(x5))))
-        x4_a = self.TransEncoder2(x4); y4 = self.TransEncoder2(y4)
         x4_a = self.alpha*x4_a + (1-self.alpha)*y4 
         x4 = self.upsample(self.relu(self.batchnorm2(self.conv2(self.relu(x5 * x4_a)))))
-        x3_a = self.TransEncoder3(x3); y3 = self.TransEncoder3(y3)
         x3_a = self.alpha*x3_a + (1-self.alpha)*y3
         x3 = self.upsample(self.relu(self.batchnorm3(self.conv3(self.relu(x4 * x3_a)))))
         x2 = self.relu(self.batchnorm5(self.conv5(self.upsample(self.relu(self.batchnorm4(self.conv4(x3)))))))
@@ -242,25 +270,97 @@ class _Decoder(nn.Module):
         return self.sigmoid(x1)
 
 class ECT_SAL(nn.Module):
-    def __init__(self):
+    """Two-stream saliency model (RGB image + text map) with shared encoder weights.
+
+    fused=True stacks both streams on the batch dim so ResNet-50 and every
+    TransEncoder run once per call instead of twice. It adds no parameters,
+    so ECT_SAL_PATH checkpoints load either way. Meant for inference: in
+    training mode BatchNorm statistics would span both streams.
+
+    pretrained=False skips the ImageNet ResNet-50 download, for when a
+    checkpoint overwrites the weights anyway.
+    """
+    def __init__(self, fused=False, pretrained=True):
         super(ECT_SAL, self).__init__()
-        self.encoder = _Encoder()
+        self.fused = fused
+        self.encoder = _Encoder(pretrained=pretrained)
         self.decoder = _Decoder()
     def forward(self, x , y):
+        if self.fused:
+            return self.decoder(self.encoder(torch.cat((x, y), dim=0)))
         x = self.encoder(x); y = self.encoder(y)
         x = self.decoder(x , y)
         return x
 
 class TwoStreamEfficientNet(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, pretrained=True):
         super(TwoStreamEfficientNet, self).__init__()
-        self.backbone = models.efficientnet_b2(weights=models.EfficientNet_B2_Weights.DEFAULT)
+        self.backbone = models.efficientnet_b2(weights=models.EfficientNet_B2_Weights.DEFAULT if pretrained else None)
         num_features = self.backbone.classifier[1].in_features
         self.backbone.classifier = nn.Identity()
         self.classifier = nn.Sequential(nn.Dropout(p=0.3), nn.Linear(num_features * 2, num_classes))
 
-    def forward(self, yolo_input, saliency_input):
-        feat1 = self.backbone(yolo_input)
-        feat2 = self.backbone(saliency_input)
-        combined = torch.cat((feat1, feat2), dim=1)
+    def encode(self, x):
+        return self.backbone(x)
+
+    def classify(self, yolo_features, saliency_features):
+        # A single saliency embedding is broadcast to every crop of the same image
+        if saliency_features.shape[0] != yolo_features.shape[0]:
+            saliency_features = saliency_features.expand(yolo_features.shape[0], -1)
+        combined = torch.cat((yolo_features, saliency_features), dim=1)
         return self.classifier(combined)
+
+    def forward(self, yolo_input, saliency_input):
+        return self.classify(self.encode(yolo_input), self.encode(saliency_input))
+
+# ==================================================================================================
+# ============================== PART 3: DISTILLED SALIENCY ========================================
+# ==================================================================================================
+
+class LiteSaliency(nn.Module):
+    """Small saliency network distilled from ECT_SAL (see distill_saliency.py).
+
+    Drop-in for ECT_SAL: forward(image, text_map) takes the same (N, 3, 256, 256)
+    BGR image and text map in [0, 1] and returns an (N, 1, 256, 256) map in
+    [0, 1]. A MobileNetV3-Small encoder sees the text map as a fourth input
+    channel, so there is one encoder pass instead of two. A light FPN decoder
+    merges strides 4-32 and predicts at 1/4 resolution; the logits are
+    upsampled bilinearly.
+
+    pretrained=False skips the ImageNet MobileNetV3 download, for when a
+    checkpoint overwrites the weights anyway.
+    """
+    def __init__(self, pretrained=True, width=48):
+        super(LiteSaliency, self).__init__()
+        features = models.mobilenet_v3_small(weights=models.MobileNet_V3_Small_Weights.DEFAULT if pretrained else None).features
+        stem = features[0][0]
+        conv = nn.Conv2d(4, stem.out_channels, stem.kernel_size, stem.stride, stem.padding, bias=False)
+        with torch.no_grad():
+            conv.weight[:, :3] = stem.weight
+            conv.weight[:, 3:] = 0
+        features[0][0] = conv
+        # Strides 4, 8, 16, 32; the final 576-channel expansion conv is not needed
+        self.stages = nn.ModuleList([features[:2], features[2:4], features[4:9], features[9:12]])
+        self.lateral = nn.ModuleList([nn.Conv2d(c, width, 1) for c in (16, 24, 48, 96)])
+        self.refine = nn.Sequential(
+            nn.Conv2d(width, width, 3, 1, 1, bias=False), nn.BatchNorm2d(width), nn.ReLU(True),
+            nn.Conv2d(width, width, 3, 1, 1, bias=False), nn.BatchNorm2d(width), nn.ReLU(True),
+        )
+        self.head = nn.Conv2d(width, 1, 3, 1, 1)
+
+    def logits(self, x, y):
+        """Pre-sigmoid map; distillation trains on these."""
+        # ImageNet-normalised RGB for the pretrained encoder, plus one channel of the (gray) text map
+        h = torch.cat((normalize_batch(x.flip(1)), y[:, :1]), dim=1)
+        features = []
+        for stage in self.stages:
+            h = stage(h)
+            features.append(h)
+        top = self.lateral[-1](features[-1])
+        for lateral, feature in zip(self.lateral[-2::-1], features[-2::-1]):
+            top = nn.functional.interpolate(top, size=feature.shape[-2:], mode="nearest") + lateral(feature)
+        out = self.head(self.refine(top))
+        return nn.functional.interpolate(out, size=x.shape[-2:], mode="bilinear", align_corners=False)
+
+    def forward(self, x, y):
+        return torch.sigmoid(self.logits(x, y))
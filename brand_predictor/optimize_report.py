@@ -0,0 +1,159 @@
+"""Parity and speedup of the load-time graph optimizations, per model.
+
+    python optimize_report.py --images sample_images/ --compile --out optimize_report.json
+
+Each model is loaded from its checkpoint and then optimised, cumulatively:
+- eager (the reference);
+- fold_bn;
+- fold_bn + channels_last;
+- with --compile, also torch.compile.
+
+The saliency model (ECT_SAL, or LiteSaliency with --saliency-arch lite)
+runs on the 256x256 image + text map inputs the pipeline builds. The
+TwoStreamEfficientNet encoder runs on classifier-sized images. For every
+variant the report gives the number of BatchNorms folded, the largest
+deviation from the eager outputs and the latency per batch. The last line
+gives the fastest variant within --tolerance for each model, as the
+BRAND_OPTIMIZE_* settings for app.py.
+"""
+import argparse
+import copy
+import json
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from backends import conv_bn_pairs, optimize_for_inference
+from pipeline import CLASSES, load_classifier, load_saliency_model, saliency_model_inputs
+from report_utils import add_model_args, latency, load_images, saliency_checkpoint
+from saliency_report import synthetic_image
+from utils import normalize_batch
+
+VARIANTS = {
+    "eager": (),
+    "fold_bn": ("fold_bn",),
+    "fold_bn+channels_last": ("fold_bn", "channels_last"),
+    "fold_bn+channels_last+compile": ("fold_bn", "channels_last", "compile"),
+}
+
+
+def classifier_inputs(images, img_size):
+    """Normalised (N, 3, img_size, img_size) RGB batch, like the pipeline's crops."""
+    rgb = [cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_AREA)[:, :, ::-1] for img in images]
+    return normalize_batch(torch.from_numpy(np.stack(rgb)).permute(0, 3, 1, 2).float().div_(255.))
+
+
+def measure(model, fn, inputs, reference, repeats, channels_last):
+    """Max/mean deviation from reference and ms per call of fn(model, *inputs)."""
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    inputs = [x.contiguous(memory_format=memory_format) for x in inputs]
+    with torch.inference_mode():
+        output = fn(model, *inputs)  # warm-up (and compilation)
+        ms = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn(model, *inputs)
+            ms.append((time.perf_counter() - start) * 1000)
+    diff = (output.float() - reference.float()).abs()
+    return {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        # Relative to the largest eager output, comparable across models
+        "max_rel_diff": float(diff.max() / reference.float().abs().max().clamp_min(1e-12)),
+        "latency_ms": latency(np.array(ms)),
+    }
+
+
+def compare(load, fn, inputs, variants, repeats, compile_methods):
+    """Every variant of the model built by load(), against the eager one."""
+    base = load()
+    with torch.inference_mode():
+        reference = fn(base, *inputs)
+    results = {}
+    for name, optimizations in variants.items():
+        model = copy.deepcopy(base)
+        folded = len(conv_bn_pairs(model)) if "fold_bn" in optimizations else 0
+        try:
+            optimize_for_inference(model, optimizations, compile_methods)
+            r = measure(model, fn, inputs, reference, repeats, "channels_last" in optimizations)
+        except Exception as e:
+            # torch.compile needs a working C++ toolchain for the CPU backend
+            results[name] = {"optimizations": list(optimizations), "error": f"{type(e).__name__}: {e}"}
+            print(f"  {name:<30} failed: {e}")
+            continue
+        r.update(optimizations=list(optimizations), folded_batchnorms=folded)
+        results[name] = r
+        print(f"  {name:<30} {r['latency_ms']['mean']:>9.1f} ms  max rel diff {r['max_rel_diff']:.2e}", flush=True)
+    eager_ms = results["eager"]["latency_ms"]["mean"]
+    for r in results.values():
+        if "latency_ms" in r:
+            r["speedup"] = eager_ms / r["latency_ms"]["mean"]
+    return results
+
+
+def best(results, tolerance):
+    """Fastest variant whose outputs stay within tolerance of eager."""
+    ok = {name: r for name, r in results.items() if "speedup" in r and r["max_rel_diff"] <= tolerance}
+    return max(ok, key=lambda name: ok[name]["speedup"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="folder of sample images (default: synthetic)")
+    parser.add_argument("--limit", type=int, default=8, help="images per batch")
+    add_model_args(parser, yolo=False, saliency_arch=True)
+    parser.add_argument("--img-size", type=int, default=260)
+    parser.add_argument("--repeats", type=int, default=5, help="timed calls per variant")
+    parser.add_argument("--compile", action="store_true", help="also try torch.compile")
+    parser.add_argument("--tolerance", type=float, default=1e-3,
+                        help="max output deviation to accept, relative to the largest eager output")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.images:
+        images = load_images(args.images, args.limit)
+    else:
+        images = [synthetic_image(640 + 64 * i, 480 + 32 * i, seed=i) for i in range(args.limit)]
+    variants = {k: v for k, v in VARIANTS.items() if args.compile or "compile" not in v}
+    device = torch.device("cpu")
+
+    print(f"Saliency ({args.saliency_arch}), batch of {len(images)}:")
+    saliency = compare(
+        lambda: load_saliency_model(saliency_checkpoint(args), device, args.saliency_arch),
+        lambda model, img, tmap: model(img, tmap),
+        saliency_model_inputs(images), variants, args.repeats, ("forward",),
+    )
+    print(f"Classifier encoder, batch of {len(images)}:")
+    classifier = compare(
+        lambda: load_classifier(args.classifier, len(CLASSES), device),
+        lambda model, x: model.encode(x),
+        [classifier_inputs(images, args.img_size)], variants, args.repeats, ("encode",),
+    )
+
+    report = {
+        "threads": torch.get_num_threads(),
+        "batch_size": len(images),
+        "tolerance": args.tolerance,
+        "saliency": saliency,
+        "classifier": classifier,
+        "best": {"saliency": best(saliency, args.tolerance), "classifier": best(classifier, args.tolerance)},
+    }
+    print(f"{'model':<11} {'variant':<30} {'folded':>6} {'speedup':>8} {'rel diff':>9}")
+    for model in ("saliency", "classifier"):
+        for name, r in report[model].items():
+            if "speedup" in r:
+                print(f"{model:<11} {name:<30} {r['folded_batchnorms']:>6} {r['speedup']:>8.2f} "
+                      f"{r['max_rel_diff']:>9.1e}")
+    print(" ".join(
+        f"BRAND_OPTIMIZE_{model.upper()}={','.join(VARIANTS[name])}" for model, name in report["best"].items()
+    ))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
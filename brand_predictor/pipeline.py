@@ -2,100 +2,422 @@ import os
 import torch
 import cv2
 import numpy as np
+from contextlib import nullcontext
+from itertools import chain, groupby
+from operator import itemgetter
 from PIL import Image
-from ultralytics import YOLO
-from model_arch import ECT_SAL, TwoStreamEfficientNet
-from utils import get_text_map_simple, get_transforms
+from model_arch import ECT_SAL, LiteSaliency, TwoStreamEfficientNet
+from startup import StartupTimer
+from utils import get_text_map_simple, get_transforms, crop_boxes, normalize_batch
+from backends import (
+    OPTIMIZATIONS,
+    ExportedClassifier,
+    ExportedSaliency,
+    exported_yolo_path,
+    optimize_for_inference,
+    quantize_transformer_linears,
+    select_quantized_engine,
+)
+
+CLASSES = [
+    'Aquafina', 'Bisleri', 'Coca-Cola', 'Fanta', 
+    'Pepsi', 'Sprite', 'Tropicana', 'Unbranded'
+]
+
+# Saliency map for an ECT_SAL logit of 0, after the pipeline's sigmoid(sigmoid(x)): weights every pixel alike
+NEUTRAL_SALIENCY = float(1 / (1 + np.exp(-0.5)))
+
+# Cascade gate: an image skips ECT_SAL only if all of these hold for every box
+CASCADE_THRESHOLDS = {
+    "min_detection_confidence": 0.5,
+    "min_margin": 0.3,  # top-1 minus top-2 class probability
+    "escalate_labels": ("Unbranded",),
+}
+
+def load_checkpoint(path):
+    """State dict on CPU, memory-mapped so pages are only read when a tensor is first used."""
+    try:
+        return torch.load(path, map_location='cpu', mmap=True)
+    except RuntimeError:
+        # mmap needs the zipfile format (default since torch 1.6); older checkpoints load eagerly
+        return torch.load(path, map_location='cpu')
+
+def build_from_checkpoint(factory, state_dict, strict=True):
+    """Build a model straight from a state dict, skipping random init and pretrained downloads.
+
+    The architecture is created on the meta device and the checkpoint tensors
+    are assigned in place. If the checkpoint does not cover every tensor, the
+    model is built normally instead so the rest keeps its usual init.
+    """
+    with torch.device('meta'):
+        model = factory()
+    model.load_state_dict(state_dict, strict=strict, assign=True)
+    if any(t.is_meta for t in chain(model.parameters(), model.buffers())):
+        model = factory()
+        model.load_state_dict(state_dict, strict=strict)
+    return model
+
+# Saliency networks by name: the original ECT_SAL, or the LiteSaliency distilled from it (distill_saliency.py)
+SALIENCY_ARCHS = {
+    "ect_sal": lambda: ECT_SAL(fused=True, pretrained=False),
+    "lite": lambda: LiteSaliency(pretrained=False),
+}
+
+def load_saliency_model(saliency_path, device, arch="ect_sal"):
+    if arch not in SALIENCY_ARCHS:
+        raise ValueError(f"Unknown saliency architecture: {arch} (expected one of {sorted(SALIENCY_ARCHS)})")
+    state_dict_sal = load_checkpoint(saliency_path)
+    saliency_model = build_from_checkpoint(SALIENCY_ARCHS[arch], state_dict_sal, strict=arch != "ect_sal")
+    return saliency_model.to(device).eval()
+
+def saliency_model_inputs(bgr_images):
+    """(image, text map) float tensors of shape (N, 3, 256, 256) in [0, 1], as the saliency model takes them."""
+    imgs, tmaps = [], []
+    for bgr_image in bgr_images:
+        img_resized = cv2.resize(bgr_image, (256, 256))
+        imgs.append(img_resized)
+        tmaps.append(get_text_map_simple(img_resized))
+    return tuple(
+        torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).float().div_(255.).contiguous()
+        for arrays in (imgs, tmaps)
+    )
+
+def load_classifier(classifier_path, num_classes, device):
+    state_dict_cls = load_checkpoint(classifier_path)
+    classifier = build_from_checkpoint(lambda: TwoStreamEfficientNet(num_classes=num_classes, pretrained=False), state_dict_cls)
+    return classifier.to(device).eval()
 
 class BrandAttentionPipeline:
-    def __init__(self, yolo_path, saliency_path, classifier_path, classes, img_size=260, device=None):
+    """
+    backend: "eager" runs the PyTorch modules from the checkpoints.
+    "torchscript"/"onnx" run the artifacts written by export.py into
+    artifacts_dir instead (the logo YOLO too, if it was exported).
+
+    quantization: "dynamic" converts the transformer Linear layers of the
+    eager ECT_SAL to INT8 at load time (no calibration needed). "static"
+    loads the calibrated INT8 TorchScript artifacts written by quantize.py
+    into artifacts_dir. Both are CPU-only.
+
+    warmup_shapes: (height, width) images run through the whole pipeline once
+    at load time, so the first request does not pay for lazy initialization.
+    Phase timings go to self.timer (pass a shared StartupTimer to include
+    the caller's own phases).
+
+    instrumentation: optional hook with stage(name, items=None) (a context
+    manager timing one stage) and observe(name, value), e.g.
+    serving/metrics.py Instrumentation. None costs nothing.
+
+    cascade: classify every image with a neutral saliency map first and run
+    ECT_SAL only for images needs_saliency() flags: no boxes, a low
+    detection confidence or class margin, or an escalate_labels prediction.
+    cascade_thresholds overrides entries of CASCADE_THRESHOLDS.
+    cascade_stats counts images and escalations.
+
+    saliency_arch: "lite" loads saliency_path as a LiteSaliency checkpoint
+    written by distill_saliency.py instead of ECT_SAL. Exported backends run
+    whichever saliency graph export.py wrote (export.py --saliency-arch).
+
+    optimizations: {"saliency": [...], "classifier": [...]}, names from
+    backends.OPTIMIZATIONS applied to that eager model at load time
+    (BatchNorm folding, channels-last, torch.compile); inputs are then fed
+    channels-last too. Check parity and speedup with optimize_report.py.
+    """
+    def __init__(self, yolo_path, saliency_path, classifier_path, classes, img_size=260, device=None,
+                 image_batch_size=16, classifier_batch_size=32, backend="eager", artifacts_dir=None,
+                 quantization=None, warmup_shapes=(), timer=None, instrumentation=None,
+                 cascade=False, cascade_thresholds=None, saliency_arch="ect_sal", optimizations=None):
         self.device = device if device else torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.img_size = img_size
         self.classes = classes
+        self.backend = backend
+        self.quantization = quantization
+        self.timer = timer if timer is not None else StartupTimer()
+        self.instrumentation = instrumentation
+        self.cascade = cascade
+        self.cascade_thresholds = dict(CASCADE_THRESHOLDS, **(cascade_thresholds or {}))
+        self.cascade_stats = {"images": 0, "escalated": 0}
+        if saliency_arch not in SALIENCY_ARCHS:
+            raise ValueError(f"Unknown saliency architecture: {saliency_arch} (expected one of {sorted(SALIENCY_ARCHS)})")
+        self.saliency_arch = saliency_arch
+        self.optimizations = {k: tuple(v) for k, v in (optimizations or {}).items() if v}
+        if set(self.optimizations) - {"saliency", "classifier"}:
+            raise ValueError(f"optimizations keys must be 'saliency' and/or 'classifier', got {sorted(self.optimizations)}")
+        unknown = {o for names in self.optimizations.values() for o in names} - set(OPTIMIZATIONS)
+        if unknown:
+            raise ValueError(f"Unknown optimizations: {sorted(unknown)} (expected some of {OPTIMIZATIONS})")
+        # Memory format of the tensors fed to each model
+        self.input_formats = {
+            name: torch.channels_last if "channels_last" in self.optimizations.get(name, ()) else torch.contiguous_format
+            for name in ("saliency", "classifier")
+        }
+        # Upper bounds on a single forward: images per YOLO/ECT_SAL call, crops per classifier call
+        self.image_batch_size = image_batch_size
+        self.classifier_batch_size = classifier_batch_size
+
+        if quantization is not None:
+            if quantization not in ("dynamic", "static"):
+                raise ValueError(f"Unknown quantization: {quantization} (expected 'dynamic' or 'static')")
+            if quantization == "dynamic" and backend != "eager":
+                raise ValueError("quantization='dynamic' applies to the eager backend only")
+            if quantization == "static" and backend == "onnx":
+                raise ValueError("quantization='static' loads TorchScript artifacts (see quantize.py)")
+            # Quantized kernels are CPU-only
+            self.device = torch.device('cpu')
+            select_quantized_engine()
+            if quantization == "static":
+                backend = self.backend = "torchscript"
+
+        if backend != "eager":
+            if self.optimizations:
+                raise ValueError("optimizations apply to the eager backend only")
+            if artifacts_dir is None:
+                raise ValueError(f"backend='{backend}' needs artifacts_dir (see export.py / quantize.py)")
+            yolo_path = exported_yolo_path(artifacts_dir, backend, yolo_path)
 
         print("Loading YOLO...")
-        self.yolo = YOLO(yolo_path)
+        with self.timer.phase("import ultralytics"):
+            from ultralytics import YOLO
+        with self.timer.phase("load yolo"):
+            self.yolo = YOLO(yolo_path, task="detect")
 
         print("Loading Saliency Model...")
-        self.saliency_model = ECT_SAL()
-        state_dict_sal = torch.load(saliency_path, map_location=self.device)
-        self.saliency_model.load_state_dict(state_dict_sal, strict=False)
-        self.saliency_model.to(self.device).eval()
+        with self.timer.phase("load saliency"):
+            if backend == "eager":
+                self.saliency_model = load_saliency_model(saliency_path, self.device, saliency_arch)
+                if quantization == "dynamic":
+                    quantize_transformer_linears(self.saliency_model)
+                if "saliency" in self.optimizations:
+                    optimize_for_inference(self.saliency_model, self.optimizations["saliency"])
+            else:
+                self.saliency_model = ExportedSaliency(backend, artifacts_dir, self.device)
 
         print("Loading Classifier...")
-        self.classifier = TwoStreamEfficientNet(num_classes=len(classes))
-        state_dict_cls = torch.load(classifier_path, map_location=self.device)
-        self.classifier.load_state_dict(state_dict_cls)
-        self.classifier.to(self.device).eval()
+        with self.timer.phase("load classifier"):
+            if backend == "eager":
+                self.classifier = load_classifier(classifier_path, len(classes), self.device)
+                if "classifier" in self.optimizations:
+                    optimize_for_inference(self.classifier, self.optimizations["classifier"], compile_methods=("encode",))
+            else:
+                self.classifier = ExportedClassifier(backend, artifacts_dir, self.device)
 
         self.transform = get_transforms(img_size)
 
+        if warmup_shapes:
+            print("Warming up...")
+            with self.timer.phase("warm-up"):
+                self.warmup(warmup_shapes)
+
+    def stage(self, name, items=None):
+        return self.instrumentation.stage(name, items) if self.instrumentation is not None else nullcontext()
+
+    def observe(self, name, value):
+        if self.instrumentation is not None:
+            self.instrumentation.observe(name, value)
+
+    def warmup(self, shapes=((640, 640),)):
+        """Run one mid-gray image of each (height, width) through every stage."""
+        for h, w in shapes:
+            self.predict_boxes_bgr([np.full((h, w, 3), 114, dtype=np.uint8)])
+
     def run_saliency(self, original_img):
-        # ROI: 256x256 for ECT_SAL
-        img_resized = cv2.resize(original_img, (256, 256))
-        tmap = get_text_map_simple(img_resized)
-        
-        img = np.array(img_resized, dtype=np.float32) / 255.
-        tmap = np.array(tmap, dtype=np.float32) / 255.
-        
-        img = np.transpose(img, (2, 0, 1))
-        tmap = np.transpose(tmap, (2, 0, 1))
-        
-        img_t = torch.tensor(img).unsqueeze(0).float().to(self.device)
-        tmap_t = torch.tensor(tmap).unsqueeze(0).float().to(self.device)
-        
-        with torch.no_grad():
-            pred_saliency = self.saliency_model(img_t, tmap_t)
-            
-        pred_saliency = torch.sigmoid(pred_saliency).squeeze().cpu().numpy()
-        
-        # Resize saliency back to original image size
-        h, w = original_img.shape[:2]
-        pred_saliency = cv2.resize(pred_saliency, (w, h))
-        return pred_saliency
+        return self.run_saliency_batch([original_img])[0]
 
-    def predict(self, pil_image):
-        cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        
-        # 1. Pipeline: YOLO Detection
-        results = self.yolo(cv_image, verbose=False)
-        boxes = results[0].boxes
-        
-        # 2. Pipeline: Saliency Map Generation
-        saliency_map = self.run_saliency(cv_image)
+    def run_saliency_batch(self, original_imgs, output_size=None):
+        """Saliency maps for a list of BGR images, ECT_SAL run on stacked 256x256 inputs.
+
+        Maps are resized back to each image's own size, or to output_size
+        (width, height) if given.
+        """
+        saliency_maps = []
+        for start in range(0, len(original_imgs), self.image_batch_size):
+            chunk = original_imgs[start:start + self.image_batch_size]
+            with self.stage("text_map", items=len(chunk)):
+                # ROI: 256x256 for ECT_SAL
+                img_t, tmap_t = (
+                    t.to(self.device, memory_format=self.input_formats["saliency"]) for t in saliency_model_inputs(chunk)
+                )
+
+            with torch.inference_mode(), self.stage("ect_sal", items=len(chunk)):
+                pred_saliency = self.saliency_model(img_t, tmap_t)
+
+            pred_saliency = torch.sigmoid(pred_saliency)[:, 0].cpu().numpy()
+
+            # Resize saliency back to original image size (or the requested one)
+            for original_img, sal in zip(chunk, pred_saliency):
+                h, w = original_img.shape[:2]
+                saliency_maps.append(cv2.resize(sal, output_size or (w, h)))
+        return saliency_maps
+
+    def saliency_input(self, rgb_image, saliency_map):
         saliency_map_3c = np.repeat(saliency_map[:, :, np.newaxis], 3, axis=2)
-        filtered_np = (np.array(pil_image) / 255.0) * saliency_map_3c
+        filtered_np = (rgb_image / 255.0) * saliency_map_3c
         filtered_image = Image.fromarray((filtered_np * 255).astype(np.uint8))
+        return self.transform(filtered_image).unsqueeze(0)
 
-        saliency_input = self.transform(filtered_image).unsqueeze(0).to(self.device)
+    def saliency_inputs(self, cv_images, saliency_maps):
+        """Saliency-filtered classifier inputs for BGR images, built at img_size.
 
-        predictions = []
+        Equivalent to saliency_input within resampling tolerance, but the photo
+        is area-downscaled before it is weighted by a saliency map that is
+        already img_size x img_size, all in float32. Nothing is allocated at
+        the photo's full resolution.
+        """
+        size = (self.img_size, self.img_size)
+        batch = np.empty((len(cv_images), self.img_size, self.img_size, 3), dtype=np.float32)
+        with self.stage("saliency_filter", items=len(cv_images)):
+            for out, cv_image, saliency_map in zip(batch, cv_images, saliency_maps):
+                small = cv2.resize(cv_image, size, interpolation=cv2.INTER_AREA)
+                np.multiply(small[:, :, ::-1], saliency_map[:, :, np.newaxis] / np.float32(255), out=out)
+            return normalize_batch(torch.from_numpy(batch).permute(0, 3, 1, 2).contiguous())
 
+    def crop_inputs(self, cv_image, boxes):
         if len(boxes) > 0:
-            # Handle each detection
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                yolo_crop = pil_image.crop((x1, y1, x2, y2))
-                yolo_input = self.transform(yolo_crop).unsqueeze(0).to(self.device)
-                
-                # Inference
-                with torch.no_grad():
-                    # We repeat saliency input for each crop to match batch size 1
-                    output = self.classifier(yolo_input, saliency_input)
-                    _, predicted_idx = torch.max(output.data, 1)
-                    predicted_class = self.classes[predicted_idx.item()]
-                    predictions.append(predicted_class)
+            return crop_boxes(cv_image, boxes, self.img_size, bgr=True)
+        # No YOLO boxes -> Fallback to Black Image
+        return normalize_batch(torch.zeros((1, 3, self.img_size, self.img_size)))
+
+    def encode_saliency_stream(self, saliency_inputs):
+        """Classifier features of the saliency-filtered images, one row per image."""
+        with torch.inference_mode(), self.stage("classifier_saliency_stream", items=saliency_inputs.shape[0]):
+            return torch.cat([
+                self.classifier.encode(chunk.to(self.device, memory_format=self.input_formats["classifier"]))
+                for chunk in saliency_inputs.split(self.classifier_batch_size)
+            ])
+
+    def encode_crops(self, cv_images, boxes_per_image):
+        """Classifier features of every box crop, in classifier_batch_size chunks.
+
+        An image without boxes contributes one row for the black-image
+        fallback. Returns (features, owners), where owners holds the image
+        index of each row.
+        """
+        jobs = []
+        for i, boxes in enumerate(boxes_per_image):
+            if len(boxes) > 0:
+                jobs.extend((i, box) for box in boxes)
+            else:
+                jobs.append((i, None))
+
+        features = []
+        for start in range(0, len(jobs), self.classifier_batch_size):
+            chunk = jobs[start:start + self.classifier_batch_size]
+            with self.stage("crops", items=len(chunk)):
+                yolo_inputs = torch.cat([
+                    self.crop_inputs(cv_images[i], np.array([box for _, box in group if box is not None]))
+                    for i, group in groupby(chunk, key=itemgetter(0))
+                ]).to(self.device, memory_format=self.input_formats["classifier"])
+            with torch.inference_mode(), self.stage("classifier", items=len(chunk)):
+                features.append(self.classifier.encode(yolo_inputs))
+        owners = torch.tensor([i for i, _ in jobs], device=self.device)
+        return torch.cat(features), owners
+
+    def classify_features(self, crop_features, owners, saliency_features, boxes_per_image):
+        """Class probabilities per image (one row per crop) from encoded crops and saliency streams."""
+        with torch.inference_mode(), self.stage("classifier_head", items=crop_features.shape[0]):
+            output = self.classifier.classify(crop_features, saliency_features[owners])
+            probs = torch.softmax(output, dim=1).cpu().numpy()
+        counts = [max(len(boxes), 1) for boxes in boxes_per_image]
+        return np.split(probs, np.cumsum(counts)[:-1])
+
+    def classify_boxes(self, cv_images, boxes_per_image, saliency_inputs):
+        """Classify every box of every image.
+
+        The saliency stream is encoded once per image and shared by all of its
+        crops. An image without boxes contributes the black-image fallback.
+        Returns class probabilities per image, one row per crop.
+        """
+        saliency_features = self.encode_saliency_stream(saliency_inputs)
+        crop_features, owners = self.encode_crops(cv_images, boxes_per_image)
+        return self.classify_features(crop_features, owners, saliency_features, boxes_per_image)
+
+    def needs_saliency(self, boxes, det_conf, probs):
+        """Cascade gate: False only if every box is confidently detected and confidently classified."""
+        t = self.cascade_thresholds
+        if len(boxes) == 0 or det_conf.min() < t["min_detection_confidence"]:
+            return True
+        top2 = np.sort(probs, axis=1)[:, -2:]
+        if (top2[:, 1] - top2[:, 0]).min() < t["min_margin"]:
+            return True
+        return any(self.classes[idx] in t["escalate_labels"] for idx in probs.argmax(axis=1))
+
+    def cascade_classify(self, cv_images, boxes_per_image, det_conf, crop_features, owners):
+        """Classify with a neutral saliency map first, run ECT_SAL only on images needs_saliency flags."""
+        size = (self.img_size, self.img_size)
+        neutral = np.full(size, NEUTRAL_SALIENCY, dtype=np.float32)
+        saliency_features = self.encode_saliency_stream(self.saliency_inputs(cv_images, [neutral] * len(cv_images)))
+        probs_per_image = self.classify_features(crop_features, owners, saliency_features, boxes_per_image)
+
+        escalate = [
+            i for i, (boxes, conf, probs) in enumerate(zip(boxes_per_image, det_conf, probs_per_image))
+            if self.needs_saliency(boxes, conf, probs)
+        ]
+        self.cascade_stats["images"] += len(cv_images)
+        self.cascade_stats["escalated"] += len(escalate)
+        for i in range(len(cv_images)):
+            self.observe("cascade_escalated", int(i in escalate))
+        if not escalate:
+            return probs_per_image
+
+        subset = [cv_images[i] for i in escalate]
+        saliency_maps = self.run_saliency_batch(subset, output_size=size)
+        escalated_features = self.encode_saliency_stream(self.saliency_inputs(subset, saliency_maps))
+        with torch.inference_mode():
+            saliency_features[escalate] = escalated_features
+        full = self.classify_features(crop_features, owners, saliency_features, boxes_per_image)
+        for i in escalate:
+            probs_per_image[i] = full[i]
+        return probs_per_image
+
+    def predict_boxes_bgr(self, cv_images):
+        """Per-box predictions for each BGR uint8 image: box (None for the fallback), label, confidence and class probabilities."""
+        # 1. Pipeline: YOLO Detection
+        xyxy, det_conf = [], []
+        for start in range(0, len(cv_images), self.image_batch_size):
+            chunk = cv_images[start:start + self.image_batch_size]
+            with self.stage("yolo", items=len(chunk)):
+                detections = self.yolo(chunk, verbose=False)
+            for res in detections:
+                xyxy.append(res.boxes.xyxy.cpu().numpy().reshape(-1, 4))
+                det_conf.append(res.boxes.conf.cpu().numpy().reshape(-1))
+                self.observe("boxes_per_image", len(xyxy[-1]))
+
+        # 2. Pipeline: YOLO-stream features of every crop
+        crop_features, owners = self.encode_crops(cv_images, xyxy)
+
+        # 3. Pipeline: Saliency Map Generation (straight at classifier resolution) and two-stream classification
+        if self.cascade:
+            probs_per_image = self.cascade_classify(cv_images, xyxy, det_conf, crop_features, owners)
         else:
-            # No YOLO boxes -> Fallback to Black Image
-            yolo_crop = Image.new('RGB', (self.img_size, self.img_size), (0, 0, 0))
-            yolo_input = self.transform(yolo_crop).unsqueeze(0).to(self.device)
-            
-            with torch.no_grad():
-                output = self.classifier(yolo_input, saliency_input)
-                _, predicted_idx = torch.max(output.data, 1)
-                predicted_class = self.classes[predicted_idx.item()]
-                predictions.append(predicted_class)
-
-        # Return unique brands found
-        return list(set(predictions))
+            saliency_maps = self.run_saliency_batch(cv_images, output_size=(self.img_size, self.img_size))
+            saliency_features = self.encode_saliency_stream(self.saliency_inputs(cv_images, saliency_maps))
+            probs_per_image = self.classify_features(crop_features, owners, saliency_features, xyxy)
+
+        results = []
+        for boxes, conf, probs in zip(xyxy, det_conf, probs_per_image):
+            detections = []
+            for i, p in enumerate(probs):
+                idx = int(p.argmax())
+                detections.append({
+                    "box": boxes[i].tolist() if len(boxes) else None,
+                    "detection_confidence": float(conf[i]) if len(conf) else None,
+                    "label": self.classes[idx],
+                    "confidence": float(p[idx]),
+                    "probs": {c: float(v) for c, v in zip(self.classes, p)},
+                })
+            results.append(detections)
+        return results
+
+    def predict_boxes_batch(self, pil_images):
+        with self.stage("decode", items=len(pil_images)):
+            cv_images = [cv2.cvtColor(np.array(im.convert('RGB')), cv2.COLOR_RGB2BGR) for im in pil_images]
+        return self.predict_boxes_bgr(cv_images)
 
+    def predict_boxes(self, pil_image):
+        return self.predict_boxes_batch([pil_image])[0]
+
+    def predict_batch(self, pil_images):
+        # Unique brands found, one list per image
+        return [list({d["label"] for d in detections}) for detections in self.predict_boxes_batch(pil_images)]
+
+    def predict(self, pil_image):
+        return self.predict_batch([pil_image])[0]
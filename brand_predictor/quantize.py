@@ -0,0 +1,155 @@
+"""Post-training INT8 quantization of ECT_SAL and TwoStreamEfficientNet.
+
+    python quantize.py --images calibration_images/ --out quantized --report quantization_report.json
+
+The conv stacks (the ResNet-50 encoder of ECT_SAL and the EfficientNet-B2
+backbone) are quantized statically. FX graph mode inserts observers, the
+full pipeline runs over the calibration images so they see real
+activations, and the graphs are then converted to INT8. The Attention/Mlp
+Linear layers of the transformer encoders are quantized dynamically. The
+decoder convs and the classifier head stay FP32.
+
+The INT8 models are written as TorchScript artifacts that load with
+BrandAttentionPipeline(..., quantization="static", artifacts_dir=<out>).
+--report compares latency, model size and predictions of the "dynamic" and
+"static" variants against the FP32 pipeline on the same images.
+"""
+import argparse
+import copy
+import json
+import os
+
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from backends import (
+    ENCODER_ARTIFACT,
+    HEAD_ARTIFACT,
+    SALIENCY_ARTIFACT,
+    artifact_path,
+    quantize_transformer_linears,
+    select_quantized_engine,
+)
+from export import ClassifierHead, export_torchscript
+from pipeline import CLASSES, BrandAttentionPipeline
+from report_utils import add_model_args, agreement, latency, load_images, predict_timed, state_dict_mb
+
+
+def quantize_models(pipeline, images, batch_size=8):
+    """INT8 copies of an eager FP32 pipeline's saliency model and classifier, calibrated on images.
+
+    The pipeline's own modules are left untouched; they are only swapped out
+    for the observed copies while the calibration images run through it.
+    """
+    engine = select_quantized_engine()
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    saliency = copy.deepcopy(pipeline.saliency_model).cpu().eval()
+    classifier = copy.deepcopy(pipeline.classifier).cpu().eval()
+
+    saliency.encoder = prepare_fx(saliency.encoder, qconfig_mapping, (torch.rand(2, 3, 256, 256),))
+    classifier.backbone = prepare_fx(
+        classifier.backbone, qconfig_mapping, (torch.rand(2, 3, pipeline.img_size, pipeline.img_size),)
+    )
+
+    fp32 = pipeline.saliency_model, pipeline.classifier
+    pipeline.saliency_model, pipeline.classifier = saliency, classifier
+    try:
+        for start in range(0, len(images), batch_size):
+            pipeline.predict_boxes_bgr(images[start:start + batch_size])
+    finally:
+        pipeline.saliency_model, pipeline.classifier = fp32
+
+    saliency.encoder = convert_fx(saliency.encoder)
+    classifier.backbone = convert_fx(classifier.backbone)
+    quantize_transformer_linears(saliency)
+    return saliency, classifier
+
+
+def save_artifacts(saliency, classifier, out_dir, img_size=260):
+    """Write the INT8 models as the TorchScript artifacts the pipeline loads."""
+    os.makedirs(out_dir, exist_ok=True)
+    num_features = classifier.classifier[1].in_features // 2
+    graphs = {
+        SALIENCY_ARTIFACT: (saliency, (torch.rand(2, 3, 256, 256), torch.rand(2, 3, 256, 256))),
+        ENCODER_ARTIFACT: (classifier.backbone, (torch.rand(2, 3, img_size, img_size),)),
+        HEAD_ARTIFACT: (ClassifierHead(classifier).eval(), (torch.rand(2, num_features), torch.rand(2, num_features))),
+    }
+    written = []
+    for name, (module, example_inputs) in graphs.items():
+        path = artifact_path(out_dir, name, "torchscript")
+        export_torchscript(module, example_inputs, path)
+        written.append(path)
+    return written
+
+
+# ------------------------- Report -------------------------
+
+
+def build_report(reference, variants, images):
+    """reference: the FP32 pipeline. variants: {name: (pipeline, size_mb)}."""
+    ref_predictions, ref_ms = predict_timed(reference, images)
+    report = {
+        "images": len(images),
+        "threads": torch.get_num_threads(),
+        "engine": torch.backends.quantized.engine,
+        "fp32": {
+            "latency_ms": latency(ref_ms),
+            "size_mb": state_dict_mb(reference.saliency_model, reference.classifier),
+        },
+    }
+    for name, (pipeline, size_mb) in variants.items():
+        predictions, ms = predict_timed(pipeline, images)
+        report[name] = {
+            "latency_ms": latency(ms),
+            "speedup": float(ref_ms.mean() / ms.mean()),
+            "size_mb": size_mb,
+            "agreement": agreement(ref_predictions, predictions),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="folder of calibration images")
+    add_model_args(parser)
+    parser.add_argument("--out", default="quantized")
+    parser.add_argument("--limit", type=int, help="use at most this many images")
+    parser.add_argument("--batch-size", type=int, default=8, help="images per calibration forward")
+    parser.add_argument("--img-size", type=int, default=260)
+    parser.add_argument("--report", help="write the FP32 vs INT8 comparison to this JSON file")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    paths = (args.yolo, args.saliency, args.classifier)
+    fp32 = BrandAttentionPipeline(*paths, CLASSES, img_size=args.img_size, device=device)
+    images = load_images(args.images, args.limit)
+
+    print(f"Calibrating on {len(images)} images...")
+    saliency, classifier = quantize_models(fp32, images, args.batch_size)
+    for path in save_artifacts(saliency, classifier, args.out, args.img_size):
+        print(f"Wrote {path}")
+
+    if args.report:
+        dynamic = BrandAttentionPipeline(*paths, CLASSES, img_size=args.img_size, quantization="dynamic")
+        static = BrandAttentionPipeline(
+            *paths, CLASSES, img_size=args.img_size, quantization="static", artifacts_dir=args.out
+        )
+        report = build_report(fp32, {
+            "dynamic": (dynamic, state_dict_mb(dynamic.saliency_model, dynamic.classifier)),
+            "static": (static, state_dict_mb(saliency, classifier)),
+        }, images)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"{'variant':<8} {'mean ms':>8} {'p95 ms':>8} {'size MB':>8} {'label set':>10} {'top-1':>6}")
+        for name in ("fp32", "dynamic", "static"):
+            r = report[name]
+            agree = r.get("agreement", {"label_set": 1.0, "top1": 1.0})
+            print(f"{name:<8} {r['latency_ms']['mean']:>8.1f} {r['latency_ms']['p95']:>8.1f} "
+                  f"{r['size_mb']:>8.1f} {agree['label_set']:>10.3f} {agree['top1']:>6.3f}")
+        print(f"Wrote {args.report}")
+
+
+if __name__ == "__main__":
+    main()
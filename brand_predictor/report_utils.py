@@ -0,0 +1,78 @@
+"""Helpers shared by the report and tuning scripts (quantize.py, cascade_report.py, ...)."""
+import io
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from pipeline import SALIENCY_ARCHS
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def add_model_args(parser, yolo=True, saliency_arch=False, saliency_help=None):
+    """--yolo, --saliency (and --saliency-arch) and --classifier, defaulting to the checkpoints app.py loads."""
+    if yolo:
+        parser.add_argument("--yolo", default="Logo_Detection_Yolov8.pt")
+    if saliency_arch:
+        parser.add_argument("--saliency", help="default: ECT_SAL.pth, or lite_saliency.pth with --saliency-arch lite")
+        parser.add_argument("--saliency-arch", default="ect_sal", choices=sorted(SALIENCY_ARCHS))
+    else:
+        parser.add_argument("--saliency", default="ECT_SAL.pth", help=saliency_help)
+    parser.add_argument("--classifier", default="brand_attention_efficientnet_twostream.pth")
+
+
+def saliency_checkpoint(args):
+    """--saliency, or the default checkpoint of --saliency-arch."""
+    return args.saliency or ("lite_saliency.pth" if args.saliency_arch == "lite" else "ECT_SAL.pth")
+
+
+def load_images(folder, limit=None):
+    """BGR images from a folder, sorted by file name."""
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    images = [img for img in (cv2.imread(os.path.join(folder, f)) for f in names[:limit]) if img is not None]
+    if not images:
+        raise ValueError(f"No readable images in {folder}")
+    return images
+
+
+def state_dict_mb(*modules):
+    buffer = io.BytesIO()
+    torch.save([m.state_dict() for m in modules], buffer)
+    return buffer.tell() / 2**20
+
+
+def predict_timed(pipeline, images):
+    """Per-box predictions and per-image latency in ms, one image per call.
+
+    The pipeline's cascade_stats are reset after the warm-up call, so they
+    cover only the timed calls.
+    """
+    pipeline.predict_boxes_bgr(images[:1])  # warm-up
+    pipeline.cascade_stats = {"images": 0, "escalated": 0}
+    predictions, latencies = [], []
+    for img in images:
+        start = time.perf_counter()
+        predictions.extend(pipeline.predict_boxes_bgr([img]))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return predictions, np.array(latencies)
+
+
+def latency(ms):
+    return {"mean": float(ms.mean()), "p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95))}
+
+
+def agreement(reference, candidate):
+    """How closely candidate predictions follow the reference ones, image by image and box by box."""
+    label_sets = [{d["label"] for d in a} == {d["label"] for d in b} for a, b in zip(reference, candidate)]
+    pairs = [(x, y) for a, b in zip(reference, candidate) for x, y in zip(a, b)]
+    diffs = np.array([[abs(x["probs"][c] - y["probs"][c]) for c in x["probs"]] for x, y in pairs])
+    return {
+        "label_set": float(np.mean(label_sets)),
+        "top1": float(np.mean([x["label"] == y["label"] for x, y in pairs])),
+        "mean_abs_prob_diff": float(diffs.mean()),
+        "max_abs_prob_diff": float(diffs.max()),
+        "boxes": len(pairs),
+    }
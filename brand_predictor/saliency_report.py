@@ -0,0 +1,101 @@
+"""Compare the full-resolution and classifier-resolution saliency filtering paths.
+
+    python saliency_report.py photo1.jpg photo2.jpg
+    python saliency_report.py --synthetic 4000x3000
+
+For every image, the legacy path upsamples the saliency map to the photo's
+size, filters in float64 and lets get_transforms shrink the result. The
+current path builds the same classifier input at img_size directly. The
+report gives the difference between both inputs (in normalized units),
+their wall-clock time and their peak traced allocation (tracemalloc: numpy
+and OpenCV arrays, not PIL internals).
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+
+from pipeline import CLASSES, BrandAttentionPipeline
+from report_utils import add_model_args
+
+
+def _traced(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+        return result, time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare(pipeline, cv_image):
+    size = (pipeline.img_size, pipeline.img_size)
+
+    def legacy():
+        saliency_map = pipeline.run_saliency_batch([cv_image])[0]
+        return pipeline.saliency_input(cv_image[:, :, ::-1], saliency_map)
+
+    def resolution_aware():
+        saliency_map = pipeline.run_saliency_batch([cv_image], output_size=size)[0]
+        return pipeline.saliency_inputs([cv_image], [saliency_map])
+
+    reference, legacy_s, legacy_peak = _traced(legacy)
+    candidate, new_s, new_peak = _traced(resolution_aware)
+    diff = (reference - candidate).abs()
+    return {
+        "shape": list(cv_image.shape[:2]),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "legacy": {"ms": legacy_s * 1000, "peak_mb": legacy_peak / 2**20},
+        "resolution_aware": {"ms": new_s * 1000, "peak_mb": new_peak / 2**20},
+    }
+
+
+def synthetic_image(width, height, seed=0):
+    # Smooth random colors with some edges, so the text map and saliency have structure
+    rng = np.random.default_rng(seed)
+    small = (rng.random((height // 64 + 1, width // 64 + 1, 3)) * 255).astype(np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.putText(image, "BRAND", (width // 4, height // 2), cv2.FONT_HERSHEY_SIMPLEX, width / 400, (255, 255, 255), width // 200)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--synthetic", help="also test a generated WIDTHxHEIGHT image, e.g. 4000x3000")
+    add_model_args(parser)
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    pipeline = BrandAttentionPipeline(args.yolo, args.saliency, args.classifier, CLASSES, device=torch.device("cpu"))
+    images = [(path, cv2.imread(path)) for path in args.images]
+    if args.synthetic:
+        width, height = (int(v) for v in args.synthetic.lower().split("x"))
+        images.append((f"synthetic {args.synthetic}", synthetic_image(width, height)))
+
+    # First call pays for lazy initialization in both paths
+    pipeline.run_saliency_batch([synthetic_image(640, 480)])
+
+    report = {}
+    for name, cv_image in images:
+        if cv_image is None:
+            print(f"Skipping unreadable {name}")
+            continue
+        r = report[name] = compare(pipeline, cv_image)
+        print(f"{name} ({r['shape'][1]}x{r['shape'][0]}): max diff {r['max_abs_diff']:.3f}, mean {r['mean_abs_diff']:.4f} | "
+              f"legacy {r['legacy']['ms']:.0f} ms / {r['legacy']['peak_mb']:.0f} MB | "
+              f"resolution-aware {r['resolution_aware']['ms']:.0f} ms / {r['resolution_aware']['peak_mb']:.1f} MB")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
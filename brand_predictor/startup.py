@@ -0,0 +1,28 @@
+"""Startup phase timing. Kept free of heavy imports so it can start the clock first."""
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Wall-clock time per startup phase (imports, weight loading, warm-up), printed as a breakdown."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def log(self, title="Startup"):
+        print(f"{title} timings:")
+        for name, seconds in self.phases.items():
+            print(f"  {name:<28}{seconds * 1000:>8.0f} ms")
+        print(f"  {'total (wall clock)':<28}{self.elapsed() * 1000:>8.0f} ms")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The brand modules are flat (app.py runs from brand_predictor/), so import them the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,58 @@
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+from backends import conv_bn_pairs, fold_batchnorm
+from model_arch import ECT_SAL, LiteSaliency, TwoStreamEfficientNet
+
+
+def _randomize_batchnorms(model, generator):
+    # Fresh BatchNorms are the identity (mean 0, var 1, weight 1, bias 0), so folding them would prove nothing
+    for bn in model.modules():
+        if isinstance(bn, nn.BatchNorm2d):
+            n = bn.num_features
+            bn.running_mean.copy_(0.1 * torch.randn(n, generator=generator))
+            bn.running_var.copy_(torch.rand(n, generator=generator) + 0.5)
+            bn.weight.data.copy_(torch.rand(n, generator=generator) + 0.5)
+            bn.bias.data.copy_(0.1 * torch.randn(n, generator=generator))
+    return model
+
+
+def _saliency_inputs(generator):
+    return torch.rand(1, 3, 256, 256, generator=generator), torch.rand(1, 3, 256, 256, generator=generator)
+
+
+# name -> (model factory, fn(model, *inputs), inputs factory, BatchNorms expected to fold)
+MODELS = {
+    "ect_sal": (lambda: ECT_SAL(fused=True, pretrained=False), lambda m, *x: m(*x), _saliency_inputs, 59),
+    # The EfficientNet forward does not trace as a whole, so this also covers the per-child fallback
+    "efficientnet_encode": (
+        lambda: TwoStreamEfficientNet(8, pretrained=False),
+        lambda m, x: m.encode(x),
+        lambda g: (torch.rand(1, 3, 260, 260, generator=g),),
+        69,
+    ),
+    "lite_saliency": (lambda: LiteSaliency(pretrained=False), lambda m, *x: m(*x), _saliency_inputs, 35),
+}
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_fold_batchnorm_matches_unfolded(name):
+    build, fn, inputs, expected = MODELS[name]
+    torch.manual_seed(0)
+    generator = torch.Generator().manual_seed(1)
+    model = _randomize_batchnorms(build().eval(), generator)
+    inputs = inputs(generator)
+    batchnorms = sum(isinstance(m, nn.BatchNorm2d) for m in model.modules())
+
+    folded = copy.deepcopy(model)
+    assert fold_batchnorm(folded) == batchnorms == expected
+    assert not any(isinstance(m, nn.BatchNorm2d) for m in folded.modules())
+    assert conv_bn_pairs(folded) == []
+
+    with torch.inference_mode():
+        reference = fn(model, *inputs)
+        output = fn(folded, *inputs)
+    torch.testing.assert_close(output, reference, rtol=0, atol=1e-5)
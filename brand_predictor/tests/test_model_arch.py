@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from model_arch import ATTENTION_IMPL, ECT_SAL, Attention, set_attention_impl
+
+
+@pytest.fixture(scope="module")
+def ect_sal():
+    torch.manual_seed(0)
+    model = ECT_SAL(pretrained=False).eval()
+    # The default alpha of 0.5 weighs both streams equally, which would hide swapped streams
+    model.decoder.alpha.data.fill_(0.8)
+    return model
+
+
+@pytest.fixture(scope="module")
+def saliency_inputs():
+    generator = torch.Generator().manual_seed(1)
+    return torch.rand(2, 3, 256, 256, generator=generator), torch.rand(2, 3, 256, 256, generator=generator)
+
+
+def _run(model, inputs):
+    with torch.inference_mode():
+        return model(*inputs)
+
+
+def test_fused_matches_two_stream(ect_sal, saliency_inputs):
+    try:
+        ect_sal.fused = False
+        reference = _run(ect_sal, saliency_inputs)
+        ect_sal.fused = True
+        fused = _run(ect_sal, saliency_inputs)
+    finally:
+        ect_sal.fused = False
+    assert fused.shape == (2, 1, 256, 256)
+    torch.testing.assert_close(fused, reference, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("num_heads", [1, 4])
+def test_attention_sdpa_matches_math(num_heads):
+    torch.manual_seed(0)
+    attention = Attention({"hidden_size": 64, "num_heads": num_heads, "attention_dropout_rate": 0.1}).eval()
+    # Scaled up so the softmax is far from uniform
+    hidden_states = 4 * torch.randn(2, 49, 64, generator=torch.Generator().manual_seed(1))
+    outputs = {}
+    for impl in ("math", "sdpa"):
+        attention.impl = impl
+        with torch.inference_mode():
+            outputs[impl] = attention(hidden_states)
+    torch.testing.assert_close(outputs["sdpa"], outputs["math"], rtol=1e-5, atol=1e-5)
+
+
+def test_set_attention_impl_matches_on_ect_sal(ect_sal, saliency_inputs):
+    try:
+        set_attention_impl(ect_sal, "math")
+        reference = _run(ect_sal, saliency_inputs)
+        set_attention_impl(ect_sal, "sdpa")
+        sdpa = _run(ect_sal, saliency_inputs)
+    finally:
+        set_attention_impl(ect_sal, ATTENTION_IMPL)
+    torch.testing.assert_close(sdpa, reference, rtol=0, atol=1e-5)
+
+
+def test_set_attention_impl_rejects_unknown(ect_sal):
+    with pytest.raises(ValueError):
+        set_attention_impl(ect_sal, "flash")
@@ -1,6 +1,11 @@
 import cv2
 import numpy as np
+import torch
 from torchvision import transforms
+from torchvision.ops import roi_align
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
 
 def get_text_map_simple(image):
     if isinstance(image, str): image = cv2.imread(image)
@@ -16,5 +21,39 @@ def get_transforms(img_size):
     return transforms.Compose([
             transforms.Resize((img_size, img_size)),
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
         ])
+
+def normalize_batch(batch):
+    # batch: (N, 3, H, W) float in [0, 1], same normalisation as get_transforms
+    mean = torch.tensor(IMAGENET_MEAN, dtype=batch.dtype, device=batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, dtype=batch.dtype, device=batch.device).view(1, 3, 1, 1)
+    return (batch - mean) / std
+
+def crop_boxes(image, boxes, img_size, bgr=False):
+    """Crop and resize every box of an RGB uint8 image in one roi_align call.
+
+    image: (H, W, 3) uint8 array or tensor (BGR if bgr=True, flipped after
+    cropping so the full image is never copied), boxes: (N, 4) xyxy in pixels.
+    Returns a normalised (N, 3, img_size, img_size) float tensor, matching
+    PIL crop + get_transforms within interpolation tolerance.
+    """
+    image = torch.as_tensor(image)
+    boxes = torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4)
+    if boxes.shape[0] == 0:
+        return torch.empty((0, 3, img_size, img_size))
+    h, w = image.shape[:2]
+
+    # Only the union of the boxes is converted to float, not the whole photo
+    x0 = int(max(0, min(w, boxes[:, 0].min().floor().item())))
+    y0 = int(max(0, min(h, boxes[:, 1].min().floor().item())))
+    x1 = int(max(x0 + 1, min(w, boxes[:, 2].max().ceil().item())))
+    y1 = int(max(y0 + 1, min(h, boxes[:, 3].max().ceil().item())))
+    region = image[y0:y1, x0:x1].permute(2, 0, 1).unsqueeze(0).float().div_(255.)
+    if bgr:
+        region = region.flip(1)
+
+    rois = boxes - torch.tensor([x0, y0, x0, y0], dtype=torch.float32)
+    rois = torch.cat([torch.zeros((rois.shape[0], 1)), rois], dim=1)
+    crops = roi_align(region, rois, output_size=(img_size, img_size), spatial_scale=1.0, sampling_ratio=-1, aligned=True)
+    return normalize_batch(crops)
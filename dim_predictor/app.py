@@ -1,188 +1,56 @@
 import os
-import cv2
-import numpy as np
-from typing import Optional, Tuple
-from PIL import Image, ImageDraw, ImageFont
+import sys
+from contextlib import nullcontext
 
 import gradio as gr
 
-# ------------------------- YOLO -------------------------
-
-try:
-    from ultralytics import YOLO
-except Exception:
-    YOLO = None
+from geometry import ORIENTATIONS
+from measurement import (
+    CONFIDENCE,
+    IMG_SIZE,
+    MODEL_NAME,
+    YOLO_BACKEND,
+    compute_measurements,
+    compute_measurements_batch,
+    load_model,
+    set_instrumentation,
+)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "serving"))
+from batching import MicroBatcher, OverloadedError
+from cache import cache_from_env, weights_version
+from metrics import instrumentation_from_env
+from profiling import profiler_from_env
+from tiling import TiledDetector, tiled_from_env
 
 # ------------------------- Configuration -------------------------
 
-MODEL_NAME = os.environ.get("YOLO_MODEL", "yolov8n-seg")
-CONFIDENCE = 0.35
-IMG_SIZE = 640
-
-# ------------------------- Utilities -------------------------
-
-def load_model():
-    if YOLO is None:
-        raise RuntimeError("ultralytics not installed")
-    return YOLO(MODEL_NAME)
-
-
-def largest_mask_from_results(results):
-    res = results[0]
-    if res.masks is None:
-        raise RuntimeError("No segmentation masks detected")
-
-    masks = res.masks.data.cpu().numpy().astype(np.uint8)
-    areas = masks.reshape(masks.shape[0], -1).sum(axis=1)
-    idx = int(np.argmax(areas))
-
-    mask = masks[idx].astype(bool)
-    score = float(res.boxes.conf[idx].cpu().numpy())
-
-    return mask, {"score": score}
-
-
-def pixel_height_and_diameter_from_mask(mask: np.ndarray, crushed_mode: bool):
-    ys, xs = np.where(mask)
-    if ys.size == 0:
-        return 0, 0
-
-    height_px = int(ys.max() - ys.min())
-
-    widths = []
-    for y in range(ys.min(), ys.max() + 1):
-        row = xs[ys == y]
-        if row.size >= 2:
-            widths.append(row.max() - row.min())
-
-    diameter_px = int(
-        np.median(widths) if (crushed_mode and widths) else (max(widths) if widths else 0)
-    )
-
-    return height_px, diameter_px
-
-
-def detect_aruco_marker(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    params = cv2.aruco.DetectorParameters()
-    detector = cv2.aruco.ArucoDetector(aruco_dict, params)
-
-    corners, ids, _ = detector.detectMarkers(gray)
-    if ids is None:
-        return None
-
-    poly = corners[0].reshape(-1, 2)
-    dists = [np.linalg.norm(poly[i] - poly[(i + 1) % 4]) for i in range(4)]
-    return float(np.mean(dists))
-
-
-def detect_cap_diameter_px(image, mask):
-    ys, xs = np.where(mask)
-    if ys.size == 0:
-        return None
-
-    crop = image[ys.min():ys.max()+1, xs.min():xs.max()+1]
-    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (7, 7), 0)
-
-    circles = cv2.HoughCircles(
-        gray,
-        cv2.HOUGH_GRADIENT,
-        dp=1.2,
-        minDist=20,
-        param1=100,
-        param2=30,
-        minRadius=5,
-        maxRadius=200,
-    )
-
-    if circles is None:
-        return None
-
-    _, _, r = max(circles[0], key=lambda c: c[2])
-    return 2 * r
-
-
-def visualize(image, mask, h_cm, d_cm, scale, method):
-    pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(pil)
-
-    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    for c in cnts:
-        pts = [(int(p[0][0]), int(p[0][1])) for p in c]
-        if len(pts) > 2:
-            draw.line(pts + [pts[0]], width=3)
-
-    txt = f"H:{h_cm:.2f}cm  D:{d_cm:.2f}cm  ({method})"
-    draw.text((10, 10), txt, fill=(255, 255, 0))
-
-    return cv2.cvtColor(np.array(pil), cv2.COLOR_RGB2BGR)
-
-
-# ------------------------- CORE INFERENCE -------------------------
-
-def compute_measurements(
-    image,
-    use_aruco,
-    aruco_size,
-    cap_size,
-    fx,
-    fy,
-    dist,
-    crushed,
-    model,
-):
-    results = model.predict(
-        image,
-        imgsz=IMG_SIZE,
-        conf=CONFIDENCE,
-        device="cpu",
-        verbose=False,
-    )
-
-    mask, meta = largest_mask_from_results(results)
-    h_px, d_px = pixel_height_and_diameter_from_mask(mask, crushed)
-
-    scale = None
-    method = "pixel"
-
-    if use_aruco and aruco_size:
-        px = detect_aruco_marker(image)
-        if px:
-            scale = aruco_size / px
-            method = "aruco"
-
-    if scale is None and cap_size:
-        cap_px = detect_cap_diameter_px(image, mask)
-        if cap_px:
-            scale = cap_size / cap_px
-            method = "cap"
-
-    if scale is None and fy and dist:
-        scale = dist / fy
-        method = "camera"
-
-    h_cm = h_px * scale if scale else float(h_px)
-    d_cm = d_px * scale if scale else float(d_px)
-
-    vis = visualize(image, mask.astype(np.uint8) * 255, h_cm, d_cm, scale, method)
-
-    return vis, {
-        "height_cm": h_cm,
-        "diameter_cm": d_cm,
-        "height_px": h_px,
-        "diameter_px": d_px,
-        "scale_cm_per_px": scale,
-        "method": method,
-        "score": meta["score"],
-    }
-
+# Cross-request micro-batching
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+BATCH_MAX_QUEUE = int(os.environ.get("BATCH_MAX_QUEUE", 64))
 
 # ------------------------- GRADIO APP -------------------------
 
 def run_app():
-    model = load_model()
+    # DIM_TILE_SIZE > 0: segment large photos in overlapping tiles (DIM_TILE_OVERLAP, DIM_TILE_BATCH)
+    model = tiled_from_env(load_model(), "DIM_TILE")
+    model_version = f"{weights_version(MODEL_NAME)}-{YOLO_BACKEND}"
+    if isinstance(model, TiledDetector):
+        model_version += f"-tile{model.tile_size}-{model.overlap}"
+    cache = cache_from_env()
+    # Stage metrics on METRICS_PORT (unset: off; e.g. 9102), sampled torch.profiler traces (PROFILE_SAMPLE_RATE)
+    instrumentation = instrumentation_from_env("dim")
+    set_instrumentation(instrumentation)
+    profiler = profiler_from_env()
+    batcher = MicroBatcher(
+        profiler.wrap(lambda requests: compute_measurements_batch(requests, model), "dim"),
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        max_queue=BATCH_MAX_QUEUE,
+        name="dim-batcher",
+        instrumentation=instrumentation,
+    )
 
     def process_image(
         image,
@@ -193,9 +61,12 @@ def run_app():
         fx_val,
         fy_val,
         dist_val,
+        orientation_val="upright",
+        multi_val=False,
+        session_val="",
+        render_val=True,
     ):
-        vis, stats = compute_measurements(
-            image=image,
+        params = dict(
             use_aruco=use_aruco_val,
             aruco_size=aruco_size_val,
             cap_size=cap_size_val,
@@ -203,9 +74,21 @@ def run_app():
             fy=fy_val,
             dist=dist_val,
             crushed=crushed_val,
-            model=model,
+            orientation=orientation_val,
+            multi=multi_val,
+            session_id=session_val or None,
+            # API clients that only need the numbers skip the overlay (stats then carry polygon and box)
+            render=render_val,
         )
-        
+        cache_params = dict(params, conf=CONFIDENCE, imgsz=IMG_SIZE)
+        try:
+            with instrumentation.stage("request") if instrumentation else nullcontext():
+                vis, stats = cache.get_or_compute(
+                    image, model_version, lambda: batcher(dict(params, image=image)), cache_params
+                )
+        except OverloadedError:
+            raise gr.Error("Server is overloaded, please retry shortly.")
+
         return stats, vis
 
     with gr.Blocks() as demo:
@@ -222,6 +105,10 @@ def run_app():
                 fx = gr.Number(label="Camera fx (px)")
                 fy = gr.Number(label="Camera fy (px)")
                 dist = gr.Number(label="Camera distance (cm)")
+                orientation = gr.Dropdown(list(ORIENTATIONS), value="upright", label="Bottle orientation")
+                multi = gr.Checkbox(label="Measure all bottles")
+                session = gr.Textbox(label="Camera / session ID (reuses calibration)")
+                render = gr.Checkbox(value=True, label="Draw overlay")
                 btn = gr.Button("Run")
 
         out_img = gr.Image(label="Result")
@@ -238,11 +125,22 @@ def run_app():
                 fx,
                 fy,
                 dist,
+                orientation,
+                multi,
+                session,
+                render,
             ],
             outputs=[out_json, out_img],
             api_name="inference",
         )
 
+        def cache_stats() -> dict:
+            return cache.stats()
+
+        gr.api(cache_stats, api_name="cache_stats")
+
+    # Let concurrent requests reach the batcher instead of queueing one at a time in Gradio
+    demo.queue(default_concurrency_limit=BATCH_MAX_QUEUE)
     demo.launch()
 
 
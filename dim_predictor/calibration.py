@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from geometry import mask_bbox
+
+# ------------------------- Calibration -------------------------
+
+
+class Calibrator:
+    """Pixel-to-cm calibration with long-lived detectors and a per-session scale cache.
+
+    ArUco detectors are built once per thread and reused. Marker detection
+    runs on a reduced-resolution copy first (max side max_marker_side) and
+    only falls back to full resolution if nothing is found. start_marker_detection()
+    runs it on a background thread so it overlaps with segmentation. Cap
+    detection only searches the top of the bottle's bounding box, downscaled
+    to cap_max_side. Scales can be remembered per session/camera ID so a fixed
+    rig does not recalibrate on every frame.
+    """
+
+    def __init__(
+        self,
+        dictionary=cv2.aruco.DICT_4X4_50,
+        max_marker_side=1600,
+        cap_max_side=320,
+        scale_ttl=None,
+        max_workers=2,
+    ):
+        self.dictionary = dictionary
+        self.max_marker_side = max_marker_side
+        self.cap_max_side = cap_max_side
+        self.scale_ttl = scale_ttl
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="calibration")
+        self._scales = {}
+        self._lock = threading.Lock()
+
+    # --- ArUco ---
+
+    def _detector(self):
+        # ArucoDetector is not documented as thread-safe: one per thread, built once
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            aruco_dict = cv2.aruco.getPredefinedDictionary(self.dictionary)
+            params = cv2.aruco.DetectorParameters()
+            detector = cv2.aruco.ArucoDetector(aruco_dict, params)
+            self._local.detector = detector
+        return detector
+
+    def _detect(self, gray):
+        corners, ids, _ = self._detector().detectMarkers(gray)
+        if ids is None:
+            return None
+        poly = corners[0].reshape(-1, 2)
+        return float(np.mean(np.linalg.norm(poly - np.roll(poly, -1, axis=0), axis=1)))
+
+    def marker_side_px(self, image):
+        """Mean side length of the first ArUco marker, in full-resolution pixels, or None."""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        factor = min(1.0, self.max_marker_side / max(h, w))
+        if factor < 1.0:
+            small = cv2.resize(gray, (int(round(w * factor)), int(round(h * factor))), interpolation=cv2.INTER_AREA)
+            side = self._detect(small)
+            if side is not None:
+                return side / factor
+        return self._detect(gray)
+
+    def start_marker_detection(self, image):
+        """Run marker_side_px on the calibration thread pool; returns a Future."""
+        return self._pool.submit(self.marker_side_px, image)
+
+    # --- Cap ---
+
+    def cap_diameter_px(self, image, mask):
+        """Cap diameter in pixels from a Hough circle search at the top of the bottle mask."""
+        bbox = mask_bbox(mask)
+        if bbox is None:
+            return None
+
+        x0, y0, x1, y1 = bbox
+        w, h = x1 - x0, y1 - y0
+        # The cap is no wider than the bottle and sits in its top part
+        top = image[y0:y0 + min(h, max(w, h // 3)), x0:x1]
+        gray = cv2.cvtColor(top, cv2.COLOR_BGR2GRAY)
+
+        factor = min(1.0, self.cap_max_side / max(gray.shape))
+        if factor < 1.0:
+            gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(gray, (7, 7), 0)
+
+        circles = cv2.HoughCircles(
+            gray,
+            cv2.HOUGH_GRADIENT,
+            dp=1.2,
+            minDist=max(1.0, 20 * factor),
+            param1=100,
+            param2=30,
+            minRadius=max(2, int(5 * factor)),
+            maxRadius=max(3, int(min(200, w / 2) * factor)),
+        )
+
+        if circles is None:
+            return None
+
+        _, _, r = max(circles[0], key=lambda c: c[2])
+        return 2 * r / factor
+
+    # --- Per-session scale cache ---
+
+    def cached_scale(self, key):
+        with self._lock:
+            entry = self._scales.get(key)
+        if entry is None:
+            return None
+        scale, method, stamp = entry
+        if self.scale_ttl is not None and time.monotonic() - stamp > self.scale_ttl:
+            self.forget(key)
+            return None
+        return scale, method
+
+    def remember(self, key, scale, method):
+        with self._lock:
+            self._scales[key] = (scale, method, time.monotonic())
+
+    def forget(self, key=None):
+        with self._lock:
+            if key is None:
+                self._scales.clear()
+            else:
+                self._scales.pop(key, None)
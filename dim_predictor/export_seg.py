@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+from measurement import EXPORT_EXTENSIONS, MODEL_NAME, compute_measurements, exported_model_path, load_model
+
+# ------------------------- Export -------------------------
+
+
+def export_model(formats, model_name=MODEL_NAME):
+    """Export the YOLO-seg model with a dynamic batch axis; files land next to model_name."""
+    from ultralytics import YOLO
+
+    model = YOLO(model_name)
+    written = []
+    for fmt in formats:
+        exported = model.export(format=fmt, dynamic=True)
+        target = exported_model_path(fmt, model_name)
+        if os.path.abspath(exported) != os.path.abspath(target):
+            os.replace(exported, target)
+        written.append(target)
+    return written
+
+
+def check_parity(image_paths, backend):
+    """Compare measurements of the exported backend against eager on sample images."""
+    eager = load_model("eager")
+    exported = load_model(backend)
+    params = dict(use_aruco=False, aruco_size=None, cap_size=None, fx=None, fy=None, dist=None, crushed=False)
+
+    rows = []
+    for path in image_paths:
+        image = cv2.imread(path)
+        try:
+            _, ref = compute_measurements(image=image, model=eager, **params)
+            _, out = compute_measurements(image=image, model=exported, **params)
+        except RuntimeError as e:
+            rows.append({"image": path, "error": str(e)})
+            continue
+        rows.append({
+            "image": path,
+            "height_px_diff": abs(ref["height_px"] - out["height_px"]),
+            "diameter_px_diff": abs(ref["diameter_px"] - out["diameter_px"]),
+            "score_diff": abs(ref["score"] - out["score"]),
+        })
+
+    diffs = [r for r in rows if "error" not in r]
+    summary = {
+        "backend": backend,
+        "images": len(rows),
+        "max_height_px_diff": max((r["height_px_diff"] for r in diffs), default=None),
+        "max_diameter_px_diff": max((r["diameter_px_diff"] for r in diffs), default=None),
+        "mean_score_diff": float(np.mean([r["score_diff"] for r in diffs])) if diffs else None,
+    }
+    return summary, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the YOLO-seg model to TorchScript / ONNX and check parity.")
+    parser.add_argument("--formats", nargs="+", default=list(EXPORT_EXTENSIONS), choices=list(EXPORT_EXTENSIONS))
+    parser.add_argument("--check", nargs="*", metavar="IMAGE", help="sample images to compare against eager")
+    args = parser.parse_args()
+
+    for path in export_model(args.formats):
+        print(f"Wrote {path}")
+
+    if args.check:
+        for fmt in args.formats:
+            summary, _ = check_parity(args.check, fmt)
+            print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import cv2
+import numpy as np
+
+# ------------------------- Bottle geometry -------------------------
+#
+# All functions take boolean/uint8 masks at native image resolution (or
+# polygons in image coordinates) and work on the mask's bounding box only.
+# Nothing is converted to float at mask size.
+
+ORIENTATIONS = ("upright", "pca", "min_area_rect")
+
+
+def mask_bbox(mask: np.ndarray):
+    """(x0, y0, x1, y1) of the non-zero pixels, exclusive on x1/y1, or None if empty."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def row_widths(mask: np.ndarray):
+    """Per-row extents of a mask, vectorized.
+
+    Returns (ys, widths): the image row of every row holding at least two
+    pixels, and max(x) - min(x) over that row.
+    """
+    bbox = mask_bbox(mask)
+    if bbox is None:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    x0, y0, x1, y1 = bbox
+    crop = mask[y0:y1, x0:x1].astype(bool, copy=False)
+
+    counts = np.count_nonzero(crop, axis=1)
+    first = crop.argmax(axis=1)
+    last = crop.shape[1] - 1 - crop[:, ::-1].argmax(axis=1)
+    keep = counts >= 2
+    return np.flatnonzero(keep) + y0, (last - first)[keep]
+
+
+def diameter_from_widths(widths, crushed_mode: bool):
+    # Crushed bottles have irregular outlines: the median width is more robust than the max
+    if widths.size == 0:
+        return 0
+    return int(np.median(widths) if crushed_mode else widths.max())
+
+
+def height_and_diameter(mask: np.ndarray, crushed_mode: bool):
+    """Upright height (row span) and diameter (median or max row width) in pixels."""
+    bbox = mask_bbox(mask)
+    if bbox is None:
+        return 0, 0
+    _, widths = row_widths(mask)
+    return bbox[3] - 1 - bbox[1], diameter_from_widths(widths, crushed_mode)
+
+
+def polygon_local_mask(polygon):
+    """Rasterize an image-coordinate polygon into a mask over its bounding box only.
+
+    Returns (mask, (x0, y0)) where (x0, y0) is the mask's offset in the image.
+    """
+    pts = np.round(np.asarray(polygon, dtype=np.float32)).astype(np.int32).reshape(-1, 2)
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), np.uint8)
+    cv2.fillPoly(mask, [pts - (x0, y0)], 1)
+    return mask, (int(x0), int(y0))
+
+
+def polygon_to_mask(polygon, shape):
+    """Full-size uint8 mask of shape (H, W) for an image-coordinate polygon."""
+    mask = np.zeros(shape[:2], np.uint8)
+    pts = np.round(np.asarray(polygon, dtype=np.float32)).astype(np.int32).reshape(-1, 2)
+    cv2.fillPoly(mask, [pts], 1)
+    return mask
+
+
+def oriented_height_and_diameter(mask: np.ndarray, crushed_mode: bool, method: str = "pca"):
+    """Height and diameter along the bottle's own axis, for bottles that are not upright.
+
+    method="pca": the principal axis of the mask pixels is the height axis;
+    widths are measured perpendicular to it in 1 px slices, as in the upright case.
+    method="min_area_rect": sides of the minimum-area rectangle around the mask.
+    """
+    bbox = mask_bbox(mask)
+    if bbox is None:
+        return 0, 0
+    x0, y0, x1, y1 = bbox
+    crop = mask[y0:y1, x0:x1]
+
+    if method == "min_area_rect":
+        pts = cv2.findNonZero(crop.astype(np.uint8, copy=False))
+        (_, _), (w, h), _ = cv2.minAreaRect(pts)
+        return int(max(w, h)), int(min(w, h))
+    if method != "pca":
+        raise ValueError(f"Unknown orientation method: {method}")
+
+    ys, xs = np.nonzero(crop)
+    if ys.size < 2:
+        return 0, 0
+    pts = np.stack([xs, ys], axis=1).astype(np.float32)
+    pts -= pts.mean(axis=0)
+    _, vecs = np.linalg.eigh(pts.T @ pts)
+    major = pts @ vecs[:, 1]
+    minor = pts @ vecs[:, 0]
+
+    height_px = int(major.max() - major.min())
+
+    # Width of every 1 px slice along the major axis
+    slices = np.floor(major - major.min()).astype(np.int64)
+    order = np.argsort(slices, kind="stable")
+    slices, minor = slices[order], minor[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(slices) != 0])
+    counts = np.diff(np.r_[starts, slices.size])
+    widths = np.maximum.reduceat(minor, starts) - np.minimum.reduceat(minor, starts)
+    widths = np.round(widths[counts >= 2]).astype(np.int64)
+
+    return height_px, diameter_from_widths(widths, crushed_mode)
+
+
+def measure_mask(mask: np.ndarray, crushed_mode: bool, orientation: str = "upright"):
+    """Pixel height and diameter of a bottle mask; orientation is one of ORIENTATIONS."""
+    if orientation == "upright":
+        return height_and_diameter(mask, crushed_mode)
+    return oriented_height_and_diameter(mask, crushed_mode, method=orientation)
+
+
+def measure_polygon(polygon, crushed_mode: bool, orientation: str = "upright"):
+    """Same as measure_mask, from an image-coordinate polygon (e.g. Ultralytics masks.xy)."""
+    if polygon is None or len(polygon) < 3:
+        return 0, 0
+    mask, _ = polygon_local_mask(polygon)
+    return measure_mask(mask, crushed_mode, orientation)
@@ -0,0 +1,459 @@
+import os
+from contextlib import nullcontext
+
+import cv2
+import numpy as np
+from typing import Optional, Tuple
+
+from calibration import Calibrator
+from geometry import measure_mask, polygon_local_mask, polygon_to_mask
+
+# ------------------------- YOLO -------------------------
+
+try:
+    from ultralytics import YOLO
+except Exception:
+    YOLO = None
+
+# ------------------------- Configuration -------------------------
+
+MODEL_NAME = os.environ.get("YOLO_MODEL", "yolov8n-seg")
+# eager | torchscript | onnx (artifacts written by export_seg.py next to MODEL_NAME)
+YOLO_BACKEND = os.environ.get("YOLO_BACKEND", "eager")
+CONFIDENCE = 0.35
+IMG_SIZE = 640
+
+# Headless results: outline simplification tolerance (px) and on-demand JPEG previews
+POLYGON_EPSILON_PX = float(os.environ.get("POLYGON_EPSILON_PX", 1.5))
+PREVIEW_MAX_SIDE = int(os.environ.get("PREVIEW_MAX_SIDE", 1024))
+PREVIEW_JPEG_QUALITY = int(os.environ.get("PREVIEW_JPEG_QUALITY", 80))
+
+# Shared detectors and per-session scale cache (SCALE_TTL_S: seconds a session scale stays valid)
+CALIBRATOR = Calibrator(scale_ttl=float(os.environ["SCALE_TTL_S"]) if os.environ.get("SCALE_TTL_S") else None)
+
+# Optional instrumentation hook: stage(name, items=None) context manager and
+# observe(name, value), e.g. serving/metrics.py Instrumentation. None = off.
+INSTRUMENTATION = None
+
+
+def set_instrumentation(instrumentation):
+    global INSTRUMENTATION
+    INSTRUMENTATION = instrumentation
+
+
+def _stage(name, items=None):
+    return INSTRUMENTATION.stage(name, items) if INSTRUMENTATION is not None else nullcontext()
+
+
+def _observe(name, value):
+    if INSTRUMENTATION is not None:
+        INSTRUMENTATION.observe(name, value)
+
+# ------------------------- Utilities -------------------------
+
+class NoBottleError(RuntimeError):
+    """Raised when the segmentation result holds no bottle mask to measure."""
+
+
+EXPORT_EXTENSIONS = {"torchscript": ".torchscript", "onnx": ".onnx"}
+
+
+def exported_model_path(backend, model_name=MODEL_NAME):
+    return os.path.splitext(model_name)[0] + EXPORT_EXTENSIONS[backend]
+
+
+def load_model(backend=None):
+    if YOLO is None:
+        raise RuntimeError("ultralytics not installed")
+    backend = backend or YOLO_BACKEND
+    if backend == "eager":
+        return YOLO(MODEL_NAME)
+    if backend not in EXPORT_EXTENSIONS:
+        raise ValueError(f"Unknown backend: {backend}")
+    return YOLO(exported_model_path(backend), task="segment")
+
+
+def _mask_to_image(mask, orig_shape):
+    """Undo the letterbox of a model-input mask and resize it to image resolution."""
+    h, w = mask.shape
+    H, W = orig_shape[:2]
+    gain = min(h / H, w / W)
+    left = int(round((w - round(W * gain)) / 2 - 0.1))
+    top = int(round((h - round(H * gain)) / 2 - 0.1))
+    crop = mask[top:h - top, left:w - left]
+    return cv2.resize(crop, (W, H), interpolation=cv2.INTER_NEAREST)
+
+
+def largest_mask_from_results(results):
+    res = results[0]
+    if res.masks is None:
+        raise NoBottleError("No segmentation masks detected")
+
+    # Pick the instance on-device; only that one mask leaves it
+    areas = res.masks.data.flatten(1).sum(dim=1)
+    idx = int(areas.argmax())
+    selected = res.masks[idx:idx + 1]
+
+    # Polygons are in original image coordinates, unlike the raw mask raster
+    polygon = selected.xy[0]
+    if len(polygon) >= 3:
+        mask = polygon_to_mask(polygon, res.orig_shape)
+    else:
+        raw = selected.data[0].cpu().numpy().astype(np.uint8)
+        mask = _mask_to_image(raw, res.orig_shape)
+        polygon = None
+
+    score = float(res.boxes.conf[idx].cpu().numpy())
+
+    return mask.view(bool), {"score": score, "polygon": polygon}
+
+
+def instances_from_results(results, min_conf=CONFIDENCE):
+    """Every instance scoring at least min_conf, most confident first.
+
+    Filtering happens on-device; only the selected masks are converted to
+    polygons on CPU. Each instance is a dict with score, box (xyxy) and
+    polygon (image coordinates, None if the mask was too small to trace).
+    """
+    res = results[0]
+    if res.masks is None:
+        raise NoBottleError("No segmentation masks detected")
+
+    conf = res.boxes.conf
+    keep = (conf >= min_conf).nonzero().flatten()
+    if keep.numel() == 0:
+        raise NoBottleError("No segmentation masks detected")
+    keep = keep[conf[keep].argsort(descending=True)]
+
+    selected = res.masks[keep]
+    scores = conf[keep].cpu().numpy()
+    boxes = res.boxes.xyxy[keep].cpu().numpy()
+
+    instances = []
+    for i, polygon in enumerate(selected.xy):
+        instances.append({
+            "score": float(scores[i]),
+            "box": [float(v) for v in boxes[i]],
+            "polygon": polygon if len(polygon) >= 3 else None,
+            "index": i,
+        })
+    return instances, selected
+
+
+def instance_mask(instance, selected, orig_shape, local=True):
+    """Mask of one instance at image resolution.
+
+    local=True returns (mask over the polygon's bounding box, offset);
+    local=False returns a full (H, W) uint8 mask.
+    """
+    if instance["polygon"] is not None:
+        if local:
+            return polygon_local_mask(instance["polygon"])
+        return polygon_to_mask(instance["polygon"], orig_shape)
+    mask = _mask_to_image(selected.data[instance["index"]].cpu().numpy().astype(np.uint8), orig_shape)
+    return (mask, (0, 0)) if local else mask
+
+
+def pixel_height_and_diameter_from_mask(mask: np.ndarray, crushed_mode: bool, orientation: str = "upright"):
+    with _stage("geometry"):
+        return measure_mask(mask, crushed_mode, orientation)
+
+
+def detect_aruco_marker(image):
+    return CALIBRATOR.marker_side_px(image)
+
+
+def detect_cap_diameter_px(image, mask):
+    return CALIBRATOR.cap_diameter_px(image, mask)
+
+
+def visualize(image, mask, h_cm, d_cm, scale, method):
+    with _stage("visualization"):
+        return _draw(image, mask, h_cm, d_cm, scale, method)
+
+
+def _draw(image, mask, h_cm, d_cm, scale, method):
+    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return _annotate(image.copy(), [c for c in cnts if len(c) > 2], _caption(h_cm, d_cm, method), 3)
+
+
+def _caption(h_cm, d_cm, method):
+    return f"H:{h_cm:.2f}cm  D:{d_cm:.2f}cm  ({method})"
+
+
+def _annotate(canvas, outlines, text, thickness):
+    """Outlines and the caption drawn in place on a BGR image."""
+    cv2.polylines(canvas, outlines, True, (255, 255, 255), thickness)
+    cv2.putText(canvas, text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 1, cv2.LINE_AA)
+    return canvas
+
+
+def outline_geometry(polygon=None, mask=None, offset=(0, 0)):
+    """Compact outline of one bottle in image coordinates.
+
+    From the instance polygon, or the largest contour of mask (placed at
+    offset) when there is none. Returns {"polygon": [[x, y], ...],
+    "box": [x0, y0, x1, y1]} with integer pixels, the polygon simplified to
+    within POLYGON_EPSILON_PX.
+    """
+    if polygon is None:
+        cnts, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not cnts:
+            return {"polygon": None, "box": None}
+        polygon = max(cnts, key=cv2.contourArea).reshape(-1, 2) + np.array(offset)
+    points = np.round(np.asarray(polygon, np.float32)).astype(np.int32)
+    simplified = cv2.approxPolyDP(points.reshape(-1, 1, 2), POLYGON_EPSILON_PX, True).reshape(-1, 2)
+    return {
+        "polygon": simplified.tolist(),
+        "box": points.min(axis=0).tolist() + points.max(axis=0).tolist(),
+    }
+
+
+def render_preview(image, stats, max_side=PREVIEW_MAX_SIDE, quality=PREVIEW_JPEG_QUALITY):
+    """JPEG bytes of image with the outlines of headless (render=False) stats, at most max_side px on the long side.
+
+    Rendering is decoupled from measuring: call it only when a client asks
+    for a picture, with the stats measured earlier.
+    """
+    with _stage("visualization"):
+        scale = min(1.0, max_side / max(image.shape[:2]))
+        if scale < 1.0:
+            canvas = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            canvas = image.copy()
+        bottles = stats.get("bottles", [stats])
+        outlines = [
+            np.round(np.array(b["polygon"]) * scale).astype(np.int32)
+            for b in bottles if b.get("polygon") and len(b["polygon"]) > 2
+        ]
+        method = stats["method"] if "bottles" not in stats else f"{stats['method']}, {stats['count']} bottles"
+        _annotate(canvas, outlines, _caption(bottles[0]["height_cm"], bottles[0]["diameter_cm"], method), 2)
+        ok, encoded = cv2.imencode(".jpg", canvas, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise RuntimeError("Could not encode preview")
+        return encoded.tobytes()
+
+
+# ------------------------- CORE INFERENCE -------------------------
+
+def segment(images, model):
+    with _stage("segmentation", items=len(images) if isinstance(images, list) else 1):
+        return model.predict(
+            images,
+            imgsz=IMG_SIZE,
+            conf=CONFIDENCE,
+            device="cpu",
+            verbose=False,
+        )
+
+
+def start_calibration(image, use_aruco, aruco_size, session_id=None, cap_size=None, fy=None, dist=None):
+    """Start ArUco detection in the background unless the session already has a scale."""
+    if not (use_aruco and aruco_size):
+        return None
+    if session_id is not None and CALIBRATOR.cached_scale(_session_key(session_id, use_aruco, aruco_size, cap_size, fy, dist)):
+        return None
+    return CALIBRATOR.start_marker_detection(image)
+
+
+def _session_key(session_id, use_aruco, aruco_size, cap_size, fy, dist):
+    # A new reference (ArUco on/off, sizes) or camera setting invalidates the session's scale
+    return (session_id, bool(use_aruco), aruco_size, cap_size, fy, dist)
+
+
+def estimate_scale(image, mask, use_aruco, aruco_size, cap_size, fy, dist, marker=None, session_id=None):
+    """cm per pixel from the first available reference: ArUco marker, cap diameter, camera model.
+
+    marker: Future from start_calibration, if detection was started early.
+    session_id: reuse (and remember) the scale of a fixed camera/session.
+    """
+    with _stage("calibration"):
+        return _estimate_scale(image, mask, use_aruco, aruco_size, cap_size, fy, dist, marker, session_id)
+
+
+def _estimate_scale(image, mask, use_aruco, aruco_size, cap_size, fy, dist, marker, session_id):
+    key = _session_key(session_id, use_aruco, aruco_size, cap_size, fy, dist)
+    if session_id is not None:
+        cached = CALIBRATOR.cached_scale(key)
+        if cached:
+            return cached
+
+    scale, method = None, "pixel"
+
+    if use_aruco and aruco_size:
+        px = marker.result() if marker is not None else detect_aruco_marker(image)
+        if px:
+            scale, method = aruco_size / px, "aruco"
+
+    if scale is None and cap_size:
+        cap_px = detect_cap_diameter_px(image, mask)
+        if cap_px:
+            scale, method = cap_size / cap_px, "cap"
+
+    if scale is None and fy and dist:
+        scale, method = dist / fy, "camera"
+
+    if scale is not None and session_id is not None:
+        CALIBRATOR.remember(key, scale, method)
+    return scale, method
+
+
+def measurements_from_result(
+    image,
+    result,
+    use_aruco,
+    aruco_size,
+    cap_size,
+    fx,
+    fy,
+    dist,
+    crushed,
+    orientation="upright",
+    multi=False,
+    session_id=None,
+    marker=None,
+    render=True,
+):
+    """(overlay, stats) for one segmentation result.
+
+    render=False skips the overlay (None is returned in its place) and adds
+    the bottle's outline (polygon, box) to stats instead; render_preview
+    draws it later if needed.
+    """
+    if multi:
+        return multi_measurements_from_result(
+            image, result, use_aruco, aruco_size, cap_size, fx, fy, dist, crushed, orientation,
+            session_id, marker, render,
+        )
+
+    mask, meta = largest_mask_from_results([result])
+    h_px, d_px = pixel_height_and_diameter_from_mask(mask, crushed, orientation)
+
+    scale, method = estimate_scale(image, mask, use_aruco, aruco_size, cap_size, fy, dist, marker, session_id)
+
+    h_cm = h_px * scale if scale else float(h_px)
+    d_cm = d_px * scale if scale else float(d_px)
+
+    stats = {
+        "height_cm": h_cm,
+        "diameter_cm": d_cm,
+        "height_px": h_px,
+        "diameter_px": d_px,
+        "scale_cm_per_px": scale,
+        "method": method,
+        "score": meta["score"],
+    }
+    if not render:
+        stats.update(outline_geometry(meta["polygon"], mask))
+        return None, stats
+    return visualize(image, mask.astype(np.uint8) * 255, h_cm, d_cm, scale, method), stats
+
+
+def multi_measurements_from_result(
+    image,
+    result,
+    use_aruco,
+    aruco_size,
+    cap_size,
+    fx,
+    fy,
+    dist,
+    crushed,
+    orientation="upright",
+    session_id=None,
+    marker=None,
+    render=True,
+):
+    """Measure every bottle above CONFIDENCE from one segmentation pass.
+
+    One scale estimate is shared by all bottles. The cap reference comes
+    from the most confident instance. render=False: see measurements_from_result.
+    """
+    instances, selected = instances_from_results([result])
+    _observe("bottles_per_image", len(instances))
+
+    reference = instance_mask(instances[0], selected, result.orig_shape, local=False)
+    scale, method = estimate_scale(image, reference, use_aruco, aruco_size, cap_size, fy, dist, marker, session_id)
+
+    bottles = []
+    union = np.zeros(image.shape[:2], np.uint8) if render else None
+    for inst in instances:
+        mask, (x0, y0) = instance_mask(inst, selected, result.orig_shape)
+        h_px, d_px = pixel_height_and_diameter_from_mask(mask, crushed, orientation)
+        bottle = {
+            "height_cm": h_px * scale if scale else float(h_px),
+            "diameter_cm": d_px * scale if scale else float(d_px),
+            "height_px": h_px,
+            "diameter_px": d_px,
+            "score": inst["score"],
+            "box": inst["box"],
+        }
+        if render:
+            # Polygon vertices may sit on the image border; clip before pasting
+            sub = mask[:union.shape[0] - y0, :union.shape[1] - x0]
+            union[y0:y0 + sub.shape[0], x0:x0 + sub.shape[1]] |= sub
+        else:
+            bottle["polygon"] = outline_geometry(inst["polygon"], mask, (x0, y0))["polygon"]
+        bottles.append(bottle)
+
+    stats = {
+        "bottles": bottles,
+        "count": len(bottles),
+        "scale_cm_per_px": scale,
+        "method": method,
+    }
+    if not render:
+        return None, stats
+    first = bottles[0]
+    vis = visualize(image, union * 255, first["height_cm"], first["diameter_cm"], scale, f"{method}, {len(bottles)} bottles")
+    return vis, stats
+
+
+def compute_measurements(
+    image,
+    use_aruco,
+    aruco_size,
+    cap_size,
+    fx,
+    fy,
+    dist,
+    crushed,
+    model,
+    orientation="upright",
+    multi=False,
+    session_id=None,
+    render=True,
+):
+    # Marker detection does not need the mask: overlap it with segmentation
+    marker = start_calibration(image, use_aruco, aruco_size, session_id, cap_size, fy, dist)
+    results = segment(image, model)
+    return measurements_from_result(
+        image, results[0], use_aruco, aruco_size, cap_size, fx, fy, dist, crushed, orientation, multi,
+        session_id, marker, render,
+    )
+
+
+def compute_measurements_batch(requests, model):
+    """Measure several images with one segmentation forward.
+
+    requests: list of dicts holding compute_measurements keyword arguments
+    (without model; render=False for headless results). Returns one
+    (vis, stats) tuple per request, or the exception raised for that image,
+    so one bad image does not fail the batch.
+    """
+    markers = [
+        start_calibration(
+            r["image"], r.get("use_aruco"), r.get("aruco_size"), r.get("session_id"),
+            r.get("cap_size"), r.get("fy"), r.get("dist"),
+        )
+        for r in requests
+    ]
+    results = segment([r["image"] for r in requests], model)
+
+    outputs = []
+    for r, res, marker in zip(requests, results, markers):
+        try:
+            outputs.append(measurements_from_result(result=res, marker=marker, **r))
+        except Exception as e:
+            outputs.append(e)
+    return outputs
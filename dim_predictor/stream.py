@@ -0,0 +1,333 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+from measurement import (
+    NoBottleError,
+    estimate_scale,
+    instance_mask,
+    instances_from_results,
+    load_model,
+    pixel_height_and_diameter_from_mask,
+    segment,
+    start_calibration,
+)
+
+# ------------------------- Frame sources -------------------------
+
+
+def read_frames(source):
+    """Yield BGR frames from a video file, stream URL or camera index."""
+    cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video source: {source}")
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        cap.release()
+
+
+class LatestFrameReader:
+    """Reads a live source on a background thread and hands out only the newest frame.
+
+    Frames that arrive while the consumer is still busy are overwritten and
+    counted in `dropped`, so a slow consumer never falls behind the camera.
+    If the source raises (it cannot be opened, the camera drops), iteration
+    re-raises that error once the last frame has been handed out.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.dropped = 0
+        self._frame = None
+        self._done = False
+        self._error = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="frame-reader", daemon=True).start()
+
+    def _run(self):
+        try:
+            for frame in self.frames:
+                with self._cond:
+                    if self._frame is not None:
+                        self.dropped += 1
+                    self._frame = frame
+                    self._cond.notify()
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify()
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                while self._frame is None and not self._done:
+                    self._cond.wait()
+                if self._frame is None:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                frame, self._frame = self._frame, None
+            yield frame
+
+
+# ------------------------- Tracking -------------------------
+
+
+def box_iou(a, b):
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class Track:
+    def __init__(self, track_id, box, frame_idx):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, np.float32)
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.missed = 0
+        self.observations = []
+
+    def predicted_box(self):
+        # Constant velocity per keyframe, e.g. bottles moving along a belt
+        return self.box + self.velocity
+
+    def update(self, box, frame_idx):
+        box = np.asarray(box, dtype=np.float32)
+        self.velocity = box - self.box
+        self.box = box
+        self.last_frame = frame_idx
+        self.missed = 0
+
+
+def center_shift(a, b):
+    """Center distance between (N, 4) and (M, 4) boxes, relative to the larger side of each a box."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    ca = (a[:, :2] + a[:, 2:]) / 2
+    cb = (b[:, :2] + b[:, 2:]) / 2
+    size = np.maximum((a[:, 2:] - a[:, :2]).max(axis=1), 1.0)
+    return np.linalg.norm(ca[:, None] - cb[None], axis=2) / size[:, None]
+
+
+class IouTracker:
+    """Greedy association of keyframe detections against predicted track boxes.
+
+    Pairs are matched by IoU first. Detections still unmatched then go to the
+    nearest track whose center moved less than max_center_shift box sizes.
+    This covers thin bottles that move further than their width between
+    keyframes, before a velocity estimate exists.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=3, max_center_shift=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.max_center_shift = max_center_shift
+        self.tracks = []
+        self._next_id = 1
+
+    def _assign(self, scores, boxes, assigned, frame_idx, accept):
+        for flat in np.argsort(scores, axis=None):
+            ti, bi = np.unravel_index(flat, scores.shape)
+            if not accept(scores[ti, bi]):
+                break
+            track = self.tracks[ti]
+            if assigned[bi] is None and track.last_frame != frame_idx:
+                track.update(boxes[bi], frame_idx)
+                assigned[bi] = track
+
+    def update(self, boxes, frame_idx):
+        """Match boxes to tracks. Returns (track per box, tracks that just ended)."""
+        assigned = [None] * len(boxes)
+        if self.tracks and len(boxes):
+            predicted = [t.predicted_box() for t in self.tracks]
+            iou = box_iou(predicted, boxes)
+            self._assign(-iou, boxes, assigned, frame_idx, lambda s: -s >= self.iou_threshold)
+            shift = center_shift(predicted, boxes)
+            self._assign(shift, boxes, assigned, frame_idx, lambda s: s <= self.max_center_shift)
+
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is None:
+                track = Track(self._next_id, box, frame_idx)
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned[bi] = track
+
+        ended = []
+        for track in self.tracks:
+            if track.last_frame != frame_idx:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    ended.append(track)
+        self.tracks = [t for t in self.tracks if t not in ended]
+        return assigned, ended
+
+    def flush(self):
+        ended, self.tracks = self.tracks, []
+        return ended
+
+
+# ------------------------- Streaming measurement -------------------------
+
+
+class StreamMeasurer:
+    """Measure bottles in a video stream, one smoothed record per tracked bottle.
+
+    YOLO-seg runs on every keyframe_interval-th frame only. Detections are
+    linked across keyframes by IoU tracking. The calibration scale is computed
+    once and reused through the session cache. When a track ends, the median
+    of its per-keyframe measurements is emitted, provided it was seen in at
+    least min_observations keyframes.
+    """
+
+    def __init__(
+        self,
+        model,
+        keyframe_interval=5,
+        use_aruco=True,
+        aruco_size=None,
+        cap_size=None,
+        fy=None,
+        dist=None,
+        crushed=False,
+        orientation="upright",
+        iou_threshold=0.3,
+        max_missed=3,
+        min_observations=2,
+        session_id=None,
+    ):
+        self.model = model
+        self.keyframe_interval = keyframe_interval
+        self.calibration = dict(use_aruco=use_aruco, aruco_size=aruco_size, cap_size=cap_size, fy=fy, dist=dist)
+        self.crushed = crushed
+        self.orientation = orientation
+        self.min_observations = min_observations
+        self.session_id = session_id or f"stream-{uuid.uuid4().hex[:8]}"
+        self.tracker = IouTracker(iou_threshold=iou_threshold, max_missed=max_missed)
+        self.counters = {"frames": 0, "keyframes": 0, "dropped": 0, "tracks": 0, "elapsed_s": 0.0}
+
+    def _measure_keyframe(self, frame, frame_idx):
+        c = self.calibration
+        marker = start_calibration(frame, c["use_aruco"], c["aruco_size"], self.session_id, c["cap_size"], c["fy"], c["dist"])
+        result = segment(frame, self.model)[0]
+        try:
+            instances, selected = instances_from_results([result])
+        except NoBottleError:
+            if marker is not None:
+                marker.cancel()
+            return self.tracker.update([], frame_idx)[1]
+
+        reference = instance_mask(instances[0], selected, result.orig_shape, local=False)
+        scale, method = estimate_scale(frame, reference, marker=marker, session_id=self.session_id, **c)
+
+        assigned, ended = self.tracker.update([inst["box"] for inst in instances], frame_idx)
+        for inst, track in zip(instances, assigned):
+            mask, _ = instance_mask(inst, selected, result.orig_shape)
+            h_px, d_px = pixel_height_and_diameter_from_mask(mask, self.crushed, self.orientation)
+            track.observations.append((h_px, d_px, inst["score"], scale, method))
+        return ended
+
+    def _record(self, track):
+        obs = np.array([o[:3] for o in track.observations], dtype=np.float64)
+        h_px, d_px, score = np.median(obs, axis=0)
+        scale, method = track.observations[-1][3:]
+        return {
+            "track_id": track.id,
+            "height_cm": h_px * scale if scale else float(h_px),
+            "diameter_cm": d_px * scale if scale else float(d_px),
+            "height_px": float(h_px),
+            "diameter_px": float(d_px),
+            "scale_cm_per_px": scale,
+            "method": method,
+            "score": float(score),
+            "observations": len(track.observations),
+            "first_frame": track.first_frame,
+            "last_frame": track.last_frame,
+            "box": track.box.tolist(),
+        }
+
+    def _emit(self, tracks):
+        for track in tracks:
+            if len(track.observations) >= self.min_observations:
+                self.counters["tracks"] += 1
+                yield self._record(track)
+
+    def measure(self, frames, live=False):
+        """Generator of per-bottle records. live=True drops frames the pipeline cannot keep up with."""
+        reader = LatestFrameReader(frames) if live else None
+        source = reader if live else frames
+        start = time.perf_counter()
+        try:
+            for frame_idx, frame in enumerate(source):
+                self.counters["frames"] += 1
+                if frame_idx % self.keyframe_interval == 0:
+                    self.counters["keyframes"] += 1
+                    yield from self._emit(self._measure_keyframe(frame, frame_idx))
+                if reader is not None:
+                    self.counters["dropped"] = reader.dropped
+                self.counters["elapsed_s"] = time.perf_counter() - start
+            yield from self._emit(self.tracker.flush())
+        finally:
+            self.counters["elapsed_s"] = time.perf_counter() - start
+
+    def stats(self):
+        elapsed = self.counters["elapsed_s"]
+        return dict(
+            self.counters,
+            fps=self.counters["frames"] / elapsed if elapsed else 0.0,
+            keyframe_fps=self.counters["keyframes"] / elapsed if elapsed else 0.0,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bottles in a video file or camera stream (JSON lines on stdout).")
+    parser.add_argument("source", help="video path, stream URL or camera index")
+    parser.add_argument("--keyframe-interval", type=int, default=5)
+    parser.add_argument("--aruco-size", type=float)
+    parser.add_argument("--cap-size", type=float)
+    parser.add_argument("--fy", type=float)
+    parser.add_argument("--dist", type=float)
+    parser.add_argument("--crushed", action="store_true")
+    parser.add_argument("--orientation", default="upright")
+    parser.add_argument("--min-observations", type=int, default=2)
+    parser.add_argument("--live", action="store_true", help="drop frames instead of falling behind the source")
+    args = parser.parse_args()
+
+    measurer = StreamMeasurer(
+        load_model(),
+        keyframe_interval=args.keyframe_interval,
+        use_aruco=args.aruco_size is not None,
+        aruco_size=args.aruco_size,
+        cap_size=args.cap_size,
+        fy=args.fy,
+        dist=args.dist,
+        crushed=args.crushed,
+        orientation=args.orientation,
+        min_observations=args.min_observations,
+    )
+    for record in measurer.measure(read_frames(args.source), live=args.live):
+        print(json.dumps(record), flush=True)
+    print(json.dumps({"stats": measurer.stats()}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
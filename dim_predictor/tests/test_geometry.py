@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import pytest
+
+from geometry import height_and_diameter, oriented_height_and_diameter, row_widths
+
+
+def _loop_height_and_diameter(mask, crushed_mode):
+    # The per-row loop height_and_diameter replaced (measurement.pixel_height_and_diameter_from_mask)
+    ys, xs = np.where(mask)
+    if ys.size == 0:
+        return 0, 0
+    height_px = int(ys.max() - ys.min())
+    widths = []
+    for y in range(ys.min(), ys.max() + 1):
+        row = xs[ys == y]
+        if row.size >= 2:
+            widths.append(row.max() - row.min())
+    diameter_px = int(np.median(widths) if (crushed_mode and widths) else (max(widths) if widths else 0))
+    return height_px, diameter_px
+
+
+def _rotated_rect(shape, center, size, angle):
+    mask = np.zeros(shape, np.uint8)
+    cv2.fillPoly(mask, [np.round(cv2.boxPoints((center, size, angle))).astype(np.int32)], 1)
+    return mask
+
+
+def _masks():
+    rng = np.random.default_rng(0)
+    single_row = np.zeros((40, 60), np.uint8)
+    single_row[17, 5:42] = 1
+    single_pixel = np.zeros((40, 60), np.uint8)
+    single_pixel[3, 7] = 1
+    # Rows with gaps and a row holding one pixel: widths span the gaps, the lone pixel is skipped
+    gaps = np.zeros((40, 60), np.uint8)
+    gaps[5:30, 10:20] = 1
+    gaps[5:30, 35:40] = 1
+    gaps[31, 25] = 1
+    blobs = (cv2.GaussianBlur(rng.random((80, 120)).astype(np.float32), (0, 0), 4) > 0.5).astype(np.uint8)
+    return {
+        "empty": np.zeros((40, 60), np.uint8),
+        "single_row": single_row,
+        "single_pixel": single_pixel,
+        "gaps": gaps,
+        "rotated": _rotated_rect((300, 300), (150, 150), (60, 200), 25),
+        "rotated_bool": _rotated_rect((300, 300), (140, 160), (45, 180), -60).astype(bool),
+        "blobs": blobs,
+    }
+
+
+@pytest.mark.parametrize("crushed_mode", [False, True])
+@pytest.mark.parametrize("name", list(_masks()))
+def test_height_and_diameter_matches_row_loop(name, crushed_mode):
+    mask = _masks()[name]
+    assert height_and_diameter(mask, crushed_mode) == _loop_height_and_diameter(mask, crushed_mode)
+
+
+def test_row_widths_skip_short_rows():
+    ys, widths = row_widths(_masks()["gaps"])
+    assert ys.tolist() == list(range(5, 30))
+    assert set(widths.tolist()) == {29}
+    assert row_widths(_masks()["empty"])[0].size == 0
+
+
+@pytest.mark.parametrize("method", ["pca", "min_area_rect"])
+@pytest.mark.parametrize("angle", [0, 25, 60, 90, 135])
+def test_oriented_height_and_diameter_of_rotated_rect(method, angle):
+    height, diameter = 200, 60
+    mask = _rotated_rect((320, 320), (160, 160), (diameter, height), angle)
+    h, d = oriented_height_and_diameter(mask, crushed_mode=False, method=method)
+    # Rasterizing the rotated corners moves each side by up to about 2 px
+    assert abs(h - height) <= 3
+    assert abs(d - diameter) <= 3
+    assert oriented_height_and_diameter(mask, crushed_mode=True, method=method)[1] <= d
+
+
+def test_oriented_height_and_diameter_edge_cases():
+    masks = _masks()
+    assert oriented_height_and_diameter(masks["empty"], False) == (0, 0)
+    assert oriented_height_and_diameter(masks["single_pixel"], False) == (0, 0)
+    with pytest.raises(ValueError):
+        oriented_height_and_diameter(masks["rotated"], False, method="hough")
@@ -0,0 +1,115 @@
+import os
+
+import gradio as gr
+import uvicorn
+from fastapi import FastAPI
+
+from batch_upload import BatchScanner, BatchStore, batch_router
+from metrics import Instrumentation, instrumentation_from_env
+from profiling import profiler_from_env
+from scan_service import ROOT, ScanService, scan_router
+from tiling import tiled_from_env
+
+from pipeline import BrandAttentionPipeline, CLASSES
+from measurement import load_model, set_instrumentation
+
+# --- DEPENDENCIES ---
+BRAND_DIR = os.path.join(ROOT, "brand_predictor")
+YOLO_PATH = os.environ.get("BRAND_YOLO_PATH", os.path.join(BRAND_DIR, "Logo_Detection_Yolov8.pt"))
+# SALIENCY_ARCH=lite: SALIENCY_PATH is a LiteSaliency checkpoint from distill_saliency.py
+SALIENCY_ARCH = os.environ.get("SALIENCY_ARCH", "ect_sal")
+SALIENCY_PATH = os.environ.get(
+    "SALIENCY_PATH", os.path.join(BRAND_DIR, "lite_saliency.pth" if SALIENCY_ARCH == "lite" else "ECT_SAL.pth")
+)
+CLASSIFIER_PATH = os.environ.get("CLASSIFIER_PATH", os.path.join(BRAND_DIR, "brand_attention_efficientnet_twostream.pth"))
+# Load-time graph optimizations per brand model, comma-separated (see brand_predictor/optimize_report.py)
+OPTIMIZATIONS = {
+    "saliency": [o.strip() for o in os.environ.get("BRAND_OPTIMIZE_SALIENCY", "").split(",") if o.strip()],
+    "classifier": [o.strip() for o in os.environ.get("BRAND_OPTIMIZE_CLASSIFIER", "").split(",") if o.strip()],
+}
+
+# Batch uploads: results persisted per batchId in BATCH_DIR
+BATCH_DIR = os.environ.get("BATCH_DIR", "batches")
+BATCH_DECODE_WORKERS = int(os.environ.get("BATCH_DECODE_WORKERS", 4))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 20))
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 7860))
+
+
+def run_app():
+    # One /metrics endpoint (METRICS_PORT, unset: off; e.g. 9103) with brand_*, dim_* and scan_* series
+    instrumentation = instrumentation_from_env("scan")
+    set_instrumentation(instrumentation and Instrumentation("dim"))
+    brand_pipeline = BrandAttentionPipeline(
+        yolo_path=YOLO_PATH,
+        saliency_path=SALIENCY_PATH,
+        classifier_path=CLASSIFIER_PATH,
+        classes=CLASSES,
+        instrumentation=instrumentation and Instrumentation("brand"),
+        saliency_arch=SALIENCY_ARCH,
+        optimizations=OPTIMIZATIONS,
+    )
+    # Tiled inference for large photos: BRAND_TILE_SIZE / DIM_TILE_SIZE (plus _OVERLAP, _BATCH)
+    brand_pipeline.yolo = tiled_from_env(brand_pipeline.yolo, "BRAND_TILE")
+    service = ScanService(
+        brand_pipeline,
+        tiled_from_env(load_model(), "DIM_TILE"),
+        instrumentation=instrumentation,
+    )
+    # Sampled torch.profiler traces (PROFILE_SAMPLE_RATE, PROFILE_DIR)
+    scan_image = profiler_from_env().wrap(service.scan, "scan")
+
+    def scan(image_path, aruco_size, use_aruco, cap_size, crushed, fx, fy, dist):
+        if image_path is None:
+            raise gr.Error("Please upload an image.")
+        with open(image_path, "rb") as f:
+            data = f.read()
+        return scan_image(
+            data,
+            use_aruco=use_aruco,
+            aruco_size=aruco_size,
+            cap_size=cap_size,
+            fx=fx,
+            fy=fy,
+            dist=dist,
+            crushed=crushed,
+        )
+
+    demo = gr.Interface(
+        fn=scan,
+        inputs=[
+            gr.Image(type="filepath", label="Input Image"),
+            gr.Number(label="ArUco size (cm)"),
+            gr.Checkbox(value=True, label="Use ArUco"),
+            gr.Number(label="Cap diameter (cm)"),
+            gr.Checkbox(label="Crushed bottle"),
+            gr.Number(label="Camera fx (px)"),
+            gr.Number(label="Camera fy (px)"),
+            gr.Number(label="Camera distance (cm)"),
+        ],
+        outputs=gr.JSON(label="Detection"),
+        title="PET Bottle Scan",
+        description="Brand and dimension inference on one upload: the image is decoded once and both models run concurrently.",
+        api_name="scan",
+    )
+    demo.queue(default_concurrency_limit=4)
+
+    # POST /api/scan (headless JSON, optional preview) and /api/scan/batch (one NDJSON line
+    # per image); the Gradio UI stays at /
+    scanner = BatchScanner(
+        service,
+        BatchStore(BATCH_DIR),
+        decode_workers=BATCH_DECODE_WORKERS,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        instrumentation=instrumentation and Instrumentation("batch"),
+    )
+    api = FastAPI()
+    api.include_router(scan_router(service))
+    api.include_router(batch_router(scanner))
+    uvicorn.run(gr.mount_gradio_app(api, demo, path="/"), host=HOST, port=PORT)
+
+
+if __name__ == "__main__":
+    run_app()
@@ -0,0 +1,221 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import tarfile
+import threading
+import uuid
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from batching import MicroBatcher
+from scan_service import decode_image, merge_record
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+BATCH_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def expand_uploads(uploads):
+    """(filename, bytes) of every image, with .zip/.tar archives unpacked in member order."""
+    items = []
+    for name, data in uploads:
+        lower = name.lower()
+        if lower.endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                items.extend(
+                    (info.filename, archive.read(info)) for info in archive.infolist()
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+                )
+        elif lower.endswith(ARCHIVE_EXTENSIONS):
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                items.extend(
+                    (member.name, archive.extractfile(member).read()) for member in archive.getmembers()
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+        else:
+            items.append((name, data))
+    return items
+
+
+class BatchStore:
+    """Per-batch NDJSON files under root: one line per finished image, appended as it completes.
+
+    Results are on disk before they are streamed, so a client that
+    disconnects can fetch them later (GET /api/scan/batch/{batchId}) or
+    re-upload the batch and only pay for the images that are missing.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, batch_id):
+        return os.path.join(self.root, f"{batch_id}.ndjson")
+
+    def append(self, batch_id, line):
+        with self._lock, open(self.path(batch_id), "a") as f:
+            f.write(json.dumps(line) + "\n")
+
+    def read(self, batch_id):
+        try:
+            with open(self.path(batch_id)) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+
+
+class BatchScanner:
+    """Runs whole upload batches through ScanService, one NDJSON line per image.
+
+    Images are decoded on decode_workers threads. Decoded images go through a
+    MicroBatcher into batched BrandAttentionPipeline.predict_boxes_bgr calls,
+    while measurements run on the ScanService pool. Each image is written to
+    the BatchStore and streamed as soon as both halves are done, so lines
+    arrive in completion order (every line carries its upload index). At
+    most max_in_flight decoded images are held at once.
+
+    A batch runs on its own thread, independent of the HTTP response: if the
+    client goes away, the batch still finishes and is persisted.
+    """
+
+    def __init__(self, service, store, decode_workers=4, max_batch_size=8, max_wait_ms=20, max_in_flight=16,
+                 instrumentation=None):
+        self.service = service
+        self.store = store
+        self.max_in_flight = max_in_flight
+        self.instrumentation = instrumentation
+        self.decode_pool = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="batch-decode")
+        # Never rejects: max_in_flight already bounds what one batch queues
+        self.brand = MicroBatcher(
+            service.brand_pipeline.predict_boxes_bgr,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_queue=1024,
+            name="batch-brand-batcher",
+            instrumentation=instrumentation,
+        )
+
+    def start(self, batch_id, items, params):
+        """Start scanning items ((filename, bytes) pairs). Returns a queue of result lines, None at the end."""
+        lines = queue.Queue()
+        threading.Thread(target=self._run, args=(batch_id, items, params, lines), name=f"batch-{batch_id}", daemon=True).start()
+        return lines
+
+    def _run(self, batch_id, items, params, lines):
+        # Images already persisted under this batchId (an earlier, interrupted upload) are not scanned again.
+        # Matched by content: names repeat (image.jpg from phones, same basename in different archive folders)
+        done = {
+            line["sha256"]: line for line in self.store.read(batch_id) or [] if "result" in line and "sha256" in line
+        }
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        pending = []
+        for index, (filename, data) in enumerate(items):
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in done:
+                lines.put(dict(done[digest], index=index, filename=filename))
+                continue
+            slots.acquire()
+            line = {"batchId": batch_id, "index": index, "filename": filename, "sha256": digest}
+            finished = Future()
+            pending.append(finished)
+            finish = partial(self._finish, batch_id, lines=lines, slots=slots, finished=finished)
+            self.decode_pool.submit(self._scan_one, data, params, line, finish)
+        failed = sum("error" in finished.result() for finished in pending)
+        lines.put({"batchId": batch_id, "done": True, "images": len(items), "failed": failed})
+        lines.put(None)
+
+    def _scan_one(self, image_bytes, params, line, finish):
+        """Decode on this thread, then hand off to the brand batcher and the measurement pool."""
+        try:
+            image = decode_image(image_bytes)
+            brand = self.brand.submit(image)
+            dim = self.service.pool.submit(self.service.measure, image, params)
+        except Exception as e:
+            finish(dict(line, error=str(e)))
+            return
+        remaining = [2]
+        lock = threading.Lock()
+
+        def combine(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                record = merge_record(brand.result(), dim.result())
+            except Exception as e:
+                finish(dict(line, error=str(e)))
+            else:
+                finish(dict(line, result=record))
+
+        brand.add_done_callback(combine)
+        dim.add_done_callback(combine)
+
+    def _finish(self, batch_id, line, lines, slots, finished):
+        """Persist first, then stream: a line the client saw is always in the store."""
+        try:
+            self.store.append(batch_id, line)
+        finally:
+            lines.put(line)
+            slots.release()
+            finished.set_result(line)
+
+    def close(self):
+        self.brand.close()
+        self.decode_pool.shutdown(wait=True)
+
+
+def _stream(lines):
+    while True:
+        line = lines.get()
+        if line is None:
+            return
+        yield json.dumps(line) + "\n"
+
+
+def batch_router(scanner):
+    """POST /api/scan/batch (multipart images or archives, streamed NDJSON) and GET /api/scan/batch/{batchId}."""
+    router = APIRouter(prefix="/api/scan/batch")
+
+    @router.post("")
+    async def scan_batch(
+        images: list[UploadFile] = File(...),
+        batchId: str = Form(None),
+        use_aruco: bool = Form(True),
+        aruco_size: float = Form(None),
+        cap_size: float = Form(None),
+        fx: float = Form(None),
+        fy: float = Form(None),
+        dist: float = Form(None),
+        crushed: bool = Form(False),
+    ):
+        batch_id = batchId or uuid.uuid4().hex
+        if not BATCH_ID.match(batch_id):
+            raise HTTPException(400, "batchId may only contain letters, digits, '.', '_' and '-' (max 64)")
+        try:
+            items = expand_uploads([(f.filename or f"image-{i}", await f.read()) for i, f in enumerate(images)])
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise HTTPException(400, f"Unreadable archive: {e}")
+        if not items:
+            raise HTTPException(400, "No images in upload")
+
+        params = dict(use_aruco=use_aruco, aruco_size=aruco_size, cap_size=cap_size, fx=fx, fy=fy, dist=dist, crushed=crushed)
+        lines = scanner.start(batch_id, items, params)
+        return StreamingResponse(_stream(lines), media_type="application/x-ndjson", headers={"X-Batch-Id": batch_id})
+
+    @router.get("/{batch_id}")
+    def batch_results(batch_id: str):
+        results = scanner.store.read(batch_id) if BATCH_ID.match(batch_id) else None
+        if results is None:
+            raise HTTPException(404, f"Unknown batch {batch_id}")
+        return StreamingResponse(iter([json.dumps(line) + "\n" for line in results]), media_type="application/x-ndjson")
+
+    return router
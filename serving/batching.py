@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class OverloadedError(RuntimeError):
+    """Raised by MicroBatcher.submit when the request queue is full."""
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for a batched inference function.
+
+    batch_fn receives a list of items and must return one result per item, in
+    order. A result that is an Exception instance fails only its own request.
+    A batch is dispatched when it reaches max_batch_size, or max_wait_ms after
+    its oldest request was queued. At most max_queue requests wait at once;
+    submit() raises OverloadedError beyond that instead of queueing unbounded
+    work.
+
+    instrumentation (optional, see metrics.Instrumentation) receives the
+    queue wait of every request and the size of every batch.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10, max_queue=64, name="batcher",
+                 instrumentation=None):
+        self.batch_fn = batch_fn
+        self.instrumentation = instrumentation
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self.stats = {"requests": 0, "batches": 0, "rejected": 0, "max_batch": 0}
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.monotonic()))
+        except queue.Full:
+            self.stats["rejected"] += 1
+            raise OverloadedError(f"Request queue is full ({self._queue.maxsize} pending)")
+        self.stats["requests"] += 1
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def close(self):
+        self._closed = True
+        self._queue.put((None, None, None))
+        self._worker.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first[1] is None:
+            return None
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry[1] is None:
+                # Close requested: finish this batch, then stop
+                self._queue.put(entry)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Callers that gave up (cancelled futures) are dropped from the batch
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.stats["batches"] += 1
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            if self.instrumentation is not None:
+                now = time.monotonic()
+                for _, _, queued_at in batch:
+                    self.instrumentation.observe("queue_wait_seconds", now - queued_at)
+                self.instrumentation.observe("batch_size", len(batch))
+
+            try:
+                outputs = list(self.batch_fn([item for item, _, _ in batch]))
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"batch_fn returned {len(outputs)} results for {len(batch)} requests")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), output in zip(batch, outputs):
+                if isinstance(output, Exception):
+                    future.set_exception(output)
+                else:
+                    future.set_result(output)
@@ -0,0 +1,385 @@
+"""Re-score a directory tree of scan images with the brand and dimension models.
+
+    python bulk_score.py --images /data/scans --out scores.jsonl
+    python bulk_score.py --images /data/scans --out scores/ --format parquet
+
+Files stream through a bounded pipeline. The tree is walked lazily in a
+stable order; a thread pool decodes up to --prefetch images ahead; decoded
+images are scored --batch-size at a time, BrandAttentionPipeline and the
+YOLO-seg measurements side by side as in ScanService; a writer thread
+appends one Detection-shaped record per image (plus "file"), in walk order.
+Memory does not grow with the dataset: at most prefetch + batch-size
+images are decoded at once and the writer queue is bounded.
+
+JSONL goes to one file. Parquet (needs pyarrow) goes to a directory of
+part files, one per checkpoint, with the headline numbers as columns and
+the full record as JSON.
+
+Every --checkpoint-every images the output is flushed and
+<out>.checkpoint.json records how many images are done. Rerunning the same
+command resumes there: output written after the checkpoint is discarded
+and those images are scored again. Ctrl-C checkpoints what was written.
+--restart ignores an existing checkpoint.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from batch_upload import IMAGE_EXTENSIONS
+from metrics import resident_memory_bytes
+from scan_service import ROOT, decode_image, merge_record
+from tiling import tiled_from_env
+
+from measurement import NoBottleError, compute_measurements_batch, load_model
+from pipeline import CLASSES, SALIENCY_ARCHS, BrandAttentionPipeline
+
+BRAND_DIR = os.path.join(ROOT, "brand_predictor")
+
+
+def iter_images(root):
+    """Image paths under root, relative to it, directories and files in sorted order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def prefetch(paths, decode, workers, depth):
+    """(path, image or exception) in input order, decoding up to depth images ahead on workers threads."""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-decode") as pool:
+        window = deque()
+        for path in paths:
+            window.append((path, pool.submit(decode, path)))
+            if len(window) >= depth:
+                yield _settle(*window.popleft())
+        while window:
+            yield _settle(*window.popleft())
+
+
+def _settle(path, future):
+    try:
+        return path, future.result()
+    except Exception as e:
+        return path, e
+
+
+def batched(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+# ---- Scoring ----
+
+class BulkScorer:
+    """Scores batches of decoded images. params: compute_measurements calibration keywords."""
+
+    def __init__(self, brand_pipeline, seg_model, params):
+        self.brand_pipeline = brand_pipeline
+        self.seg_model = seg_model
+        self.params = params
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-brand")
+
+    def score(self, batch):
+        """One record per (path, image or exception) pair, in order."""
+        decoded = [(path, image) for path, image in batch if not isinstance(image, Exception)]
+        images = [image for _, image in decoded]
+        brands, dims = [], []
+        if images:
+            brand_future = self.pool.submit(self.brand_pipeline.predict_boxes_bgr, images)
+            try:
+                dims = compute_measurements_batch(
+                    [dict(self.params, image=image, render=False) for image in images], self.seg_model
+                )
+            except Exception as e:
+                dims = [e] * len(images)
+            try:
+                brands = brand_future.result()
+            except Exception as e:
+                brands = [e] * len(images)
+
+        scored = {path: (brand, dim) for (path, _), brand, dim in zip(decoded, brands, dims)}
+        records = []
+        for path, image in batch:
+            brand, dim = scored.get(path, (image, None))
+            if isinstance(dim, NoBottleError):
+                # No bottle mask: the brand result is still useful on its own
+                dim = None
+            error = next((e for e in (brand, dim) if isinstance(e, Exception)), None)
+            if error is not None:
+                records.append({"file": path, "error": f"{type(error).__name__}: {error}"})
+            else:
+                records.append({"file": path, **merge_record(brand, dim[1] if dim else None)})
+        return records
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+# ---- Output ----
+
+class JsonlSink:
+    """One JSON line per record. Resuming truncates the file to the checkpointed offset."""
+
+    def __init__(self, path, state=None):
+        if state is None:
+            open(path, "wb").close()
+        else:
+            os.truncate(path, state["offset"])
+        self.f = open(path, "ab")
+
+    def write(self, record):
+        self.f.write((json.dumps(record) + "\n").encode())
+
+    def commit(self):
+        """Make everything written durable; returns the state to resume from."""
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {"offset": self.f.tell()}
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetSink:
+    """part-NNNNN.parquet files in a directory, one per commit. Resuming removes parts after the checkpoint."""
+
+    def __init__(self, path, state=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("pyarrow not installed (needed for --format parquet)")
+        self.pa, self.pq = pa, pq
+        self.schema = pa.schema([
+            ("file", pa.string()),
+            ("error", pa.string()),
+            ("label", pa.string()),
+            ("brand", pa.string()),
+            ("confidence", pa.float64()),
+            ("height_cm", pa.float64()),
+            ("diameter_cm", pa.float64()),
+            ("scale_cm_per_px", pa.float64()),
+            ("method", pa.string()),
+            ("record", pa.string()),
+        ])
+        self.path = path
+        self.part = state["part"] if state else 0
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith("part-") and name.endswith(".parquet") and int(name[5:-8]) >= self.part:
+                os.remove(os.path.join(path, name))
+        self.rows = []
+
+    def write(self, record):
+        meta = record.get("meta", {})
+        self.rows.append({
+            "file": record["file"],
+            "error": record.get("error"),
+            "label": record.get("label"),
+            "brand": record.get("brand"),
+            "confidence": record.get("confidence"),
+            "height_cm": meta.get("height"),
+            "diameter_cm": meta.get("diameter"),
+            "scale_cm_per_px": meta.get("scale_cm_per_px"),
+            "method": meta.get("method"),
+            "record": json.dumps(record),
+        })
+
+    def commit(self):
+        if self.rows:
+            table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+            final = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+            self.pq.write_table(table, final + ".tmp")
+            os.replace(final + ".tmp", final)
+            self.part += 1
+            self.rows = []
+        return {"part": self.part}
+
+    def close(self):
+        pass
+
+
+SINKS = {"jsonl": JsonlSink, "parquet": ParquetSink}
+
+
+class ResultWriter:
+    """Writes records on a background thread and checkpoints every checkpoint_every records.
+
+    put() blocks once max_queue records are waiting, which holds back the
+    scoring loop instead of buffering the backlog in memory.
+    """
+
+    def __init__(self, sink, checkpoint_path, checkpoint_every, done=0, last=None, max_queue=256, meta=None):
+        self.sink = sink
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.done = done
+        self.meta = meta or {}
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._last = last
+        self._thread = threading.Thread(target=self._run, name="bulk-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(record)
+
+    def _run(self):
+        try:
+            while (record := self._queue.get()) is not None:
+                self.sink.write(record)
+                self.done += 1
+                self._last = record["file"]
+                if self.done % self.checkpoint_every == 0:
+                    self.checkpoint()
+        except Exception as e:
+            self.error = e
+            # Keep draining so put() never blocks on a dead writer
+            while self._queue.get() is not None:
+                pass
+
+    def checkpoint(self, complete=False):
+        state = dict(self.meta, images=self.done, last=self._last, sink=self.sink.commit(), complete=complete)
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def close(self, complete=False):
+        """Write what is queued, then a final checkpoint."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is None:
+            self.checkpoint(complete)
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+
+def load_checkpoint(path, meta):
+    """The checkpoint at path if it belongs to a run with the same meta, else None."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if any(state.get(k) != v for k, v in meta.items()):
+        found = {k: state.get(k) for k in meta}
+        raise SystemExit(f"{path} belongs to a different run ({found}); use --restart")
+    return state
+
+
+def skip(paths, state):
+    """paths after the state["images"] already scored; fails if the tree changed before that point."""
+    last = None
+    for last in islice(paths, state["images"]):
+        pass
+    if last != state["last"]:
+        raise SystemExit(f"Image tree changed since the checkpoint (expected {state['last']!r}, found {last!r}); use --restart")
+    return paths
+
+
+# ---- CLI ----
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="directory tree of images")
+    parser.add_argument("--out", required=True, help="JSONL file or Parquet directory")
+    parser.add_argument("--format", choices=sorted(SINKS), default="jsonl")
+    parser.add_argument("--batch-size", type=int, default=16, help="images per inference call")
+    parser.add_argument("--prefetch", type=int, default=64, help="images decoded ahead of inference")
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="images between checkpoints")
+    parser.add_argument("--log-every", type=float, default=30, help="seconds between progress lines")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--yolo", default=os.environ.get("BRAND_YOLO_PATH", os.path.join(BRAND_DIR, "Logo_Detection_Yolov8.pt")))
+    parser.add_argument("--saliency", default=os.environ.get("SALIENCY_PATH"),
+                        help="default: ECT_SAL.pth, or lite_saliency.pth with --saliency-arch lite")
+    parser.add_argument("--saliency-arch", default=os.environ.get("SALIENCY_ARCH", "ect_sal"), choices=sorted(SALIENCY_ARCHS))
+    parser.add_argument("--classifier", default=os.environ.get(
+        "CLASSIFIER_PATH", os.path.join(BRAND_DIR, "brand_attention_efficientnet_twostream.pth")))
+    parser.add_argument("--optimize-saliency", default=os.environ.get("BRAND_OPTIMIZE_SALIENCY", ""),
+                        help="comma-separated fold_bn,channels_last,compile (see brand_predictor/optimize_report.py)")
+    parser.add_argument("--optimize-classifier", default=os.environ.get("BRAND_OPTIMIZE_CLASSIFIER", ""),
+                        help="comma-separated fold_bn,channels_last,compile")
+    parser.add_argument("--no-aruco", action="store_true")
+    parser.add_argument("--aruco-size", type=float, help="ArUco marker side (cm)")
+    parser.add_argument("--cap-size", type=float, help="cap diameter (cm)")
+    parser.add_argument("--fx", type=float)
+    parser.add_argument("--fy", type=float)
+    parser.add_argument("--dist", type=float, help="camera distance (cm)")
+    parser.add_argument("--crushed", action="store_true")
+    args = parser.parse_args()
+    if args.saliency is None:
+        args.saliency = os.path.join(BRAND_DIR, "lite_saliency.pth" if args.saliency_arch == "lite" else "ECT_SAL.pth")
+
+    checkpoint_path = args.out.rstrip("/") + ".checkpoint.json"
+    meta = {"images_dir": os.path.abspath(args.images), "format": args.format}
+    state = None if args.restart else load_checkpoint(checkpoint_path, meta)
+    if state and state.get("complete"):
+        print(f"{args.out} is complete ({state['images']} images); use --restart to score again")
+        return
+    resumed = state["images"] if state else 0
+    paths = iter_images(args.images)
+    if state:
+        paths = skip(paths, state)
+        print(f"Resuming after {state['images']} images ({state['last']})")
+
+    optimizations = {
+        "saliency": [o.strip() for o in args.optimize_saliency.split(",") if o.strip()],
+        "classifier": [o.strip() for o in args.optimize_classifier.split(",") if o.strip()],
+    }
+    brand_pipeline = BrandAttentionPipeline(args.yolo, args.saliency, args.classifier, CLASSES,
+                                            image_batch_size=args.batch_size, saliency_arch=args.saliency_arch,
+                                            optimizations=optimizations)
+    # Tiled inference for large photos: BRAND_TILE_SIZE / DIM_TILE_SIZE (plus _OVERLAP, _BATCH)
+    brand_pipeline.yolo = tiled_from_env(brand_pipeline.yolo, "BRAND_TILE")
+    params = dict(use_aruco=not args.no_aruco, aruco_size=args.aruco_size, cap_size=args.cap_size,
+                  fx=args.fx, fy=args.fy, dist=args.dist, crushed=args.crushed)
+    scorer = BulkScorer(brand_pipeline, tiled_from_env(load_model(), "DIM_TILE"), params)
+
+    def decode(path):
+        with open(os.path.join(args.images, path), "rb") as f:
+            return decode_image(f.read())
+
+    sink = SINKS[args.format](args.out, state["sink"] if state else None)
+    writer = ResultWriter(sink, checkpoint_path, args.checkpoint_every, done=resumed,
+                          last=state["last"] if state else None, max_queue=4 * args.batch_size, meta=meta)
+    scored = failed = 0
+    start = last_log = time.perf_counter()
+    complete = False
+    try:
+        for batch in batched(prefetch(paths, decode, args.decode_workers, args.prefetch), args.batch_size):
+            for record in scorer.score(batch):
+                writer.put(record)
+                failed += "error" in record
+            scored += len(batch)
+            now = time.perf_counter()
+            if now - last_log >= args.log_every:
+                last_log = now
+                print(f"{resumed + scored} images, {scored / (now - start):.2f} images/s, "
+                      f"{failed} failed, RSS {(resident_memory_bytes() or 0) / 2**20:.0f} MB", flush=True)
+        complete = True
+    except KeyboardInterrupt:
+        print("Interrupted; checkpointing what was written")
+    finally:
+        scorer.close()
+        writer.close(complete)
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {scored} images in {elapsed:.1f} s ({scored / elapsed if elapsed else 0.0:.2f} images/s), "
+          f"{failed} failed; {writer.done} images in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+
+def weights_version(*paths):
+    """Cheap version tag for model weights: name, size and mtime of each file."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}")
+        except OSError:
+            parts.append(str(path))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+def pixel_digest(image):
+    """sha256 of the decoded pixels (plus shape/dtype), independent of file encoding."""
+    arr = np.ascontiguousarray(np.asarray(image))
+    h = hashlib.sha256(f"{arr.shape}|{arr.dtype}".encode())
+    h.update(memoryview(arr).cast("B"))
+    return h.hexdigest()
+
+
+def perceptual_hash(image):
+    """64-bit DCT perceptual hash, robust to re-encoding and small resizes."""
+    arr = np.asarray(image)
+    gray = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY) if arr.ndim == 3 else arr
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _sizeof(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Content-addressed cache for inference results.
+
+    Entries are keyed by the decoded pixels, a model/weights version and the
+    request parameters, so retried uploads and duplicate frames skip
+    inference. The in-memory tier is an LRU bounded by max_bytes. With
+    disk_dir set, results are also pickled there and survive restarts (the
+    disk tier has no budget of its own). With near_duplicate=True a miss
+    falls back to the in-memory entry with the same version/parameters whose
+    perceptual hash is closest, if it is within max_hamming bits.
+
+    get_or_compute is single-flight: concurrent misses for the same key
+    (e.g. client retries of one upload) run compute() once, and the other
+    callers wait for that result.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None, near_duplicate=False, max_hamming=4):
+        if not 0 <= max_hamming < 64:
+            raise ValueError(f"max_hamming must be between 0 and 63, got {max_hamming}")
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.near_duplicate = near_duplicate
+        self.max_hamming = max_hamming
+        # Hashes within max_hamming bits agree exactly on at least one of max_hamming + 1 bands,
+        # so a lookup only compares entries sharing a band with it
+        bands = max_hamming + 1
+        widths = [64 // bands + (i < 64 % bands) for i in range(bands)]
+        self._bands = [(sum(widths[:i]), (1 << w) - 1) for i, w in enumerate(widths)]
+        self._entries = OrderedDict()  # key -> (value, size, scope, phash)
+        self._buckets = {}  # (scope, band, bits) -> keys of the entries with those bits
+        self._inflight = {}  # key -> Future of the get_or_compute call computing it
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "near_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def _scope(version, params):
+        blob = json.dumps({"version": version, "params": params or {}}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".pkl")
+
+    def key(self, image, version, params=None):
+        scope = self._scope(version, params)
+        return hashlib.sha256((scope + pixel_digest(image)).encode()).hexdigest(), scope
+
+    def _bucket_keys(self, scope, phash):
+        return [(scope, band, (phash >> shift) & mask) for band, (shift, mask) in enumerate(self._bands)]
+
+    def get(self, image, version, params=None, default=None):
+        key, scope = self.key(image, version, params)
+        return self._lookup(key, scope, image, default)
+
+    def _lookup(self, key, scope, image, default):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return self._entries[key][0]
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            if value is not None:
+                self._store(key, value, scope, perceptual_hash(image) if self.near_duplicate else None)
+                with self._lock:
+                    self.counters["disk_hits"] += 1
+                return value
+
+        if self.near_duplicate:
+            phash = perceptual_hash(image)
+            with self._lock:
+                candidates = set().union(*(self._buckets.get(b, ()) for b in self._bucket_keys(scope, phash)))
+                distances = {k: bin(phash ^ self._entries[k][3]).count("1") for k in candidates}
+                nearest = min(distances, key=distances.get, default=None)
+                if nearest is not None and distances[nearest] <= self.max_hamming:
+                    self._entries.move_to_end(nearest)
+                    self.counters["near_hits"] += 1
+                    return self._entries[nearest][0]
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return default
+
+    def put(self, image, version, value, params=None):
+        key, scope = self.key(image, version, params)
+        self._store(key, value, scope, perceptual_hash(image) if self.near_duplicate else None)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+
+    def get_or_compute(self, image, version, compute, params=None):
+        _missing = object()
+        key, scope = self.key(image, version, params)
+        value = self._lookup(key, scope, image, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                # Stored by a leader that finished since the lookup above
+                self.counters["misses"] -= 1
+                self.counters["hits"] += 1
+                return self._entries[key][0]
+            leader = self._inflight.get(key)
+            if leader is None:
+                future = self._inflight[key] = Future()
+            else:
+                # Counted as a miss by the lookup, but served without running compute()
+                self.counters["misses"] -= 1
+                self.counters["coalesced"] += 1
+        if leader is not None:
+            return leader.result()
+
+        try:
+            value = compute()
+            self.put(image, version, value, params)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return value
+
+    def _store(self, key, value, scope, phash):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, self._entries.pop(key))
+            self._entries[key] = (value, size, scope, phash)
+            self._bytes += size
+            if phash is not None:
+                for bucket in self._bucket_keys(scope, phash):
+                    self._buckets.setdefault(bucket, set()).add(key)
+            while self._bytes > self.max_bytes:
+                self._remove(*self._entries.popitem(last=False))
+                self.counters["evictions"] += 1
+
+    def _remove(self, key, entry):
+        """Account for an entry already popped from _entries. Call with the lock held."""
+        _, size, scope, phash = entry
+        self._bytes -= size
+        if phash is not None:
+            for bucket in self._bucket_keys(scope, phash):
+                keys = self._buckets[bucket]
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counters[k] for k in ("hits", "near_hits", "disk_hits", "coalesced", "misses"))
+            hits = lookups - self.counters["misses"]
+            return dict(
+                self.counters,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                hit_rate=hits / lookups if lookups else 0.0,
+            )
+
+
+def cache_from_env():
+    return ResultCache(
+        max_bytes=int(float(os.environ.get("CACHE_MAX_MB", 256)) * 1024 * 1024),
+        disk_dir=os.environ.get("CACHE_DIR") or None,
+        near_duplicate=os.environ.get("CACHE_NEAR_DUPLICATE", "0") == "1",
+        max_hamming=int(os.environ.get("CACHE_MAX_HAMMING", 4)),
+    )
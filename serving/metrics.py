@@ -0,0 +1,219 @@
+import bisect
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds: from sub-millisecond geometry up to multi-second saliency on large batches
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: (list(c), s, n) for k, (c, s, n) in self._series.items()}
+        for key, (counts, total, n) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels(self.label_names, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return lines
+
+
+class Gauge:
+    """Value read from fn() at scrape time."""
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        return self._get(name, lambda: Histogram(name, help, buckets, labels))
+
+    def gauge(self, name, help, fn):
+        return self._get(name, lambda: Gauge(name, help, fn))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+# ------------------------- Process memory -------------------------
+
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_resident_memory_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cuda_allocated_bytes():
+    import torch
+
+    return torch.cuda.memory_allocated() if torch.cuda.is_available() else None
+
+
+REGISTRY = Registry()
+REGISTRY.gauge("process_resident_memory_bytes", "Resident memory size in bytes.", resident_memory_bytes)
+REGISTRY.gauge("process_peak_resident_memory_bytes", "Peak resident memory size in bytes.", peak_resident_memory_bytes)
+REGISTRY.gauge("torch_cuda_memory_allocated_bytes", "Memory held by CUDA tensors.", _cuda_allocated_bytes)
+
+
+# ------------------------- Pipeline hook -------------------------
+
+
+class Instrumentation:
+    """Stage timings and observed values of one service, recorded into a Registry.
+
+    This is the object the pipelines accept as their instrumentation hook:
+    stage(name, items) times a block and observe(name, value) records a
+    value. With items, the per-item latency is recorded too (e.g. classifier
+    seconds per box). Stages also appear as named ranges in torch.profiler
+    traces.
+    """
+
+    def __init__(self, service, registry=REGISTRY):
+        self.service = service
+        self.registry = registry
+        self.stage_seconds = registry.histogram(
+            f"{service}_stage_seconds", f"Wall-clock time per {service} pipeline stage.", labels=("stage",)
+        )
+        self.item_seconds = registry.histogram(
+            f"{service}_stage_seconds_per_item", f"{service} stage time divided by the items it processed.", labels=("stage",)
+        )
+
+    @contextmanager
+    def stage(self, name, items=None):
+        from torch.profiler import record_function
+
+        start = time.perf_counter()
+        try:
+            with record_function(f"{self.service}.{name}"):
+                yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stage_seconds.observe(seconds, stage=name)
+            if items:
+                self.item_seconds.observe(seconds / items, stage=name)
+
+    def observe(self, name, value):
+        buckets = LATENCY_BUCKETS if name.endswith("_seconds") else COUNT_BUCKETS
+        self.registry.histogram(f"{self.service}_{name}", f"{self.service} {name.replace('_', ' ')}.", buckets).observe(value)
+
+
+# ------------------------- HTTP endpoint -------------------------
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port, addr="127.0.0.1", registry=REGISTRY):
+    """Serve registry.render() as Prometheus text on http://addr:port/metrics (once per process)."""
+    global _server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((addr, port), Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Metrics on http://{addr}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def instrumentation_from_env(service):
+    """Instrumentation for service, plus the /metrics endpoint on METRICS_PORT.
+
+    Off (returns None) unless METRICS_PORT is set. The endpoint listens on
+    METRICS_ADDR, 127.0.0.1 by default. Services sharing a host need their
+    own ports: 9101 for brand_predictor, 9102 for dim_predictor and 9103
+    for serving/app.py. A port that is already taken fails startup.
+    """
+    port = int(os.environ.get("METRICS_PORT", 0))
+    if port == 0:
+        return None
+    addr = os.environ.get("METRICS_ADDR", "127.0.0.1")
+    try:
+        start_http_server(port, addr)
+    except OSError as e:
+        raise RuntimeError(f"Could not start metrics endpoint on {addr}:{port} (METRICS_PORT): {e}") from e
+    return Instrumentation(service)
@@ -0,0 +1,60 @@
+import os
+import random
+import threading
+import time
+import uuid
+
+
+class SampledProfiler:
+    """torch.profiler traces for a random fraction of calls, written as Chrome traces.
+
+    Only one trace is captured at a time (torch.profiler sessions cannot
+    overlap). A sampled call that finds another trace in progress simply
+    runs unprofiled. Open the JSON files in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, sample_rate=0.0, out_dir="profiles"):
+        self.sample_rate = sample_rate
+        self.out_dir = out_dir
+        self.traces = 0
+        self._busy = threading.Lock()
+
+    def wrap(self, fn, name):
+        """fn, profiled for sample_rate of its calls."""
+        if self.sample_rate <= 0:
+            return fn
+
+        def profiled(*args, **kwargs):
+            if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+                return fn(*args, **kwargs)
+            try:
+                return self._profile(fn, name, args, kwargs)
+            finally:
+                self._busy.release()
+
+        return profiled
+
+    def _profile(self, fn, name, args, kwargs):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+            result = fn(*args, **kwargs)
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.json")
+        prof.export_chrome_trace(path)
+        self.traces += 1
+        print(f"Wrote profiler trace {path}")
+        return result
+
+
+def profiler_from_env():
+    """PROFILE_SAMPLE_RATE (fraction of calls, default 0 = off) and PROFILE_DIR (default profiles/)."""
+    return SampledProfiler(
+        sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+        out_dir=os.environ.get("PROFILE_DIR", "profiles"),
+    )
@@ -0,0 +1,155 @@
+import base64
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import cv2
+import numpy as np
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "brand_predictor"))
+sys.path.append(os.path.join(ROOT, "dim_predictor"))
+
+from measurement import PREVIEW_MAX_SIDE, NoBottleError, compute_measurements, render_preview
+
+
+def decode_image(data):
+    """Decode encoded image bytes once into a BGR uint8 array."""
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+def merge_record(detections, stats, mask_url=None):
+    """Merge brand detections and bottle measurements into one Detection-shaped record.
+
+    stats are headless measurements (render=False), so meta carries the
+    bottle outline. mask_url: optional preview, e.g. a data: URL.
+    """
+    top = max(detections, key=lambda d: d["confidence"]) if detections else None
+    meta = {
+        "brands": sorted({d["label"] for d in detections}),
+        "detections": detections,
+        "probs": top["probs"] if top else None,
+    }
+    if stats is not None:
+        meta.update(
+            height=stats["height_cm"],
+            diameter=stats["diameter_cm"],
+            height_px=stats["height_px"],
+            diameter_px=stats["diameter_px"],
+            scale_cm_per_px=stats["scale_cm_per_px"],
+            method=stats["method"],
+            polygon=stats["polygon"],
+            box=stats["box"],
+        )
+
+    return {
+        "source": "ScanService",
+        "label": "bottle" if stats is not None else "unknown",
+        "confidence": stats["score"] if stats is not None else 0.0,
+        "brand": top["label"] if top else "Unknown",
+        "color": "Unknown",
+        "material": "Unknown",
+        "maskUrl": mask_url,
+        "meta": meta,
+    }
+
+
+class ScanService:
+    """Brand and dimension inference on one decoded image.
+
+    The image is decoded once. The BGR buffer is shared by both stages (the
+    brand pipeline only takes strided RGB views of it). BrandAttentionPipeline
+    and compute_measurements run concurrently on a thread pool. Both spend
+    their time inside torch/OpenCV with the GIL released, so latency is
+    roughly that of the slower stage.
+
+    instrumentation (metrics.Instrumentation) times decode and whole scans.
+    """
+
+    def __init__(self, brand_pipeline, seg_model, max_workers=2, instrumentation=None):
+        self.brand_pipeline = brand_pipeline
+        self.seg_model = seg_model
+        self.instrumentation = instrumentation
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+
+    def measure(self, image, params):
+        """Headless bottle measurements of a decoded image, or None when no bottle is found."""
+        try:
+            _, stats = compute_measurements(image=image, model=self.seg_model, render=False, **params)
+        except NoBottleError:
+            # No bottle mask: the brand result is still useful on its own
+            return None
+        return stats
+
+    def scan(self, image, use_aruco=True, aruco_size=None, cap_size=None, fx=None, fy=None, dist=None, crushed=False,
+             preview=False, preview_max_side=PREVIEW_MAX_SIDE):
+        """image: encoded bytes or a BGR uint8 array. Returns a Detection-shaped dict.
+
+        preview=True also draws the bottle outline on a copy downscaled to
+        preview_max_side and returns it as a JPEG data: URL in maskUrl.
+        """
+        with self._stage("request"):
+            return self._scan(image, use_aruco, aruco_size, cap_size, fx, fy, dist, crushed, preview, preview_max_side)
+
+    def _stage(self, name):
+        return self.instrumentation.stage(name) if self.instrumentation is not None else nullcontext()
+
+    def _scan(self, image, use_aruco, aruco_size, cap_size, fx, fy, dist, crushed, preview, preview_max_side):
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            with self._stage("decode"):
+                image = decode_image(image)
+        params = dict(
+            use_aruco=use_aruco,
+            aruco_size=aruco_size,
+            cap_size=cap_size,
+            fx=fx,
+            fy=fy,
+            dist=dist,
+            crushed=crushed,
+        )
+
+        brand_future = self.pool.submit(self.brand_pipeline.predict_boxes_bgr, [image])
+        dim_future = self.pool.submit(self.measure, image, params)
+
+        stats = dim_future.result()
+        mask_url = None
+        if preview and stats is not None:
+            jpeg = render_preview(image, stats, max_side=preview_max_side)
+            mask_url = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+        return merge_record(brand_future.result()[0], stats, mask_url)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def scan_router(service):
+    """POST /api/scan: one multipart image, Detection JSON; preview=true adds a JPEG overlay as maskUrl."""
+    router = APIRouter(prefix="/api/scan")
+
+    @router.post("")
+    def scan(
+        image: UploadFile = File(...),
+        use_aruco: bool = Form(True),
+        aruco_size: float = Form(None),
+        cap_size: float = Form(None),
+        fx: float = Form(None),
+        fy: float = Form(None),
+        dist: float = Form(None),
+        crushed: bool = Form(False),
+        preview: bool = Form(False),
+        preview_max_side: int = Form(PREVIEW_MAX_SIDE),
+    ):
+        try:
+            return service.scan(
+                image.file.read(), use_aruco=use_aruco, aruco_size=aruco_size, cap_size=cap_size, fx=fx, fy=fy,
+                dist=dist, crushed=crushed, preview=preview, preview_max_side=preview_max_side,
+            )
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+
+    return router
@@ -0,0 +1,237 @@
+import os
+
+
+def tile_grid(width, height, tile_size, overlap):
+    """(x0, y0, x1, y1) tiles of at most tile_size px covering the image, neighbours overlapping by overlap (0-1)."""
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        # The last tile is aligned with the far edge instead of running past it
+        return positions + [length - tile_size]
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def _pairwise_iou(a, b):
+    """IoU of broadcastable (..., 4) xyxy boxes; empty boxes have IoU 0."""
+    lt = a[..., :2].maximum(b[..., :2])
+    rb = a[..., 2:].minimum(b[..., 2:])
+    inter = (rb - lt).clamp(min=0).prod(dim=-1)
+    area_a = (a[..., 2:] - a[..., :2]).clamp(min=0).prod(dim=-1)
+    area_b = (b[..., 2:] - b[..., :2]).clamp(min=0).prod(dim=-1)
+    return inter / (area_a + area_b - inter).clamp(min=1e-6)
+
+
+def _clip(boxes, region):
+    """boxes clipped to region (both broadcastable (..., 4) xyxy)."""
+    import torch
+
+    lt = boxes[..., :2].maximum(region[..., :2]).minimum(region[..., 2:])
+    rb = boxes[..., 2:].minimum(region[..., 2:]).maximum(lt)
+    return torch.cat([lt, rb], dim=-1)
+
+
+def _touches_seam(box, tile, width, height, margin):
+    """True if box reaches an edge of its tile that lies inside the image, i.e. it may be cut off."""
+    bx0, by0, bx1, by1 = box
+    tx0, ty0, tx1, ty1 = tile
+    return bool(
+        (tx0 > 0 and bx0 <= tx0 + margin)
+        or (ty0 > 0 and by0 <= ty0 + margin)
+        or (tx1 < width and bx1 >= tx1 - margin)
+        or (ty1 < height and by1 >= ty1 - margin)
+    )
+
+
+class TiledDetector:
+    """Wraps an Ultralytics YOLO model (detect or segment) with tiled inference for large images.
+
+    Images larger than tile_size are cut into overlapping tiles. All tiles
+    of a call go through the model together, max_batch tiles per forward.
+    Boxes and masks are mapped back to full-image coordinates, then
+    detections from different tiles are merged across seams when they are
+    the same object:
+    - IoU >= iou: the object was seen whole by two overlapping tiles.
+    - One of them touches an inner tile edge (a tile cut the object off) and
+      their boxes, clipped to the region both tiles saw, have IoU >= iou.
+    Matches are merged transitively, so an object spanning several tiles
+    becomes one detection with the highest confidence, the union box and
+    the OR of the masks. Images that fit in one tile run through the model as is.
+
+    Masks are assembled at mask_max_side px on the long side (never above
+    full resolution) and returned as a regular Results, so existing code
+    reading boxes, masks.data and masks.xy keeps working. Cost grows
+    linearly with the number of tiles, i.e. with image area.
+
+    Drop-in for the model: predict(images, **kwargs) / __call__ take the same
+    arguments, and kwargs such as imgsz and conf apply to every tile.
+    """
+
+    def __init__(self, model, tile_size=1280, overlap=0.2, iou=0.5, max_batch=16, mask_max_side=2048):
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be in [0, 1)")
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.iou = iou
+        self.max_batch = max_batch
+        self.mask_max_side = mask_max_side
+
+    def __getattr__(self, name):
+        # names, task, ... of the wrapped model
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def predict(self, images, **kwargs):
+        import numpy as np
+
+        batch = images if isinstance(images, list) else [images]
+        results = [None] * len(batch)
+
+        whole = [i for i, img in enumerate(batch) if max(img.shape[:2]) <= self.tile_size]
+        if whole:
+            for i, res in zip(whole, self.model.predict([batch[i] for i in whole], **kwargs)):
+                results[i] = res
+
+        jobs = []
+        for i, img in enumerate(batch):
+            if results[i] is None:
+                height, width = img.shape[:2]
+                jobs.extend((i, tile) for tile in tile_grid(width, height, self.tile_size, self.overlap))
+        parts = {}
+        for start in range(0, len(jobs), self.max_batch):
+            chunk = jobs[start:start + self.max_batch]
+            crops = [np.ascontiguousarray(batch[i][y0:y1, x0:x1]) for i, (x0, y0, x1, y1) in chunk]
+            for (i, tile), res in zip(chunk, self.model.predict(crops, **kwargs)):
+                parts.setdefault(i, []).append((tile, res))
+        for i, tile_results in parts.items():
+            results[i] = self.merge(batch[i], tile_results)
+        return results
+
+    __call__ = predict
+
+    def merge(self, image, tile_results):
+        """One full-image Results from (tile, Results) pairs."""
+        import torch
+        from ultralytics.engine.results import Results
+
+        height, width = image.shape[:2]
+        scale = min(1.0, self.mask_max_side / max(height, width))
+        canvas_h, canvas_w = round(height * scale), round(width * scale)
+
+        boxes, owners, masks = [], [], []
+        for t, (tile, res) in enumerate(tile_results):
+            if res.boxes is None or len(res.boxes) == 0:
+                continue
+            data = res.boxes.data.cpu().clone()
+            data[:, [0, 2]] += tile[0]
+            data[:, [1, 3]] += tile[1]
+            boxes.append(data)
+            owners.extend([t] * len(data))
+            if res.masks is not None:
+                masks.extend(self._local_masks(res.masks.data.cpu(), tile, scale))
+
+        names = getattr(self.model, "names", tile_results[0][1].names)
+        path = tile_results[0][1].path
+        if not boxes:
+            return Results(image, path=path, names=names, boxes=torch.zeros((0, 6)))
+
+        data = torch.cat(boxes)
+        groups = self._groups(data, owners, [tile for tile, _ in tile_results], width, height)
+        merged = torch.stack([
+            torch.cat([
+                data[g, 0].min(dim=0, keepdim=True).values,
+                data[g, 1].min(dim=0, keepdim=True).values,
+                data[g, 2].max(dim=0, keepdim=True).values,
+                data[g, 3].max(dim=0, keepdim=True).values,
+                data[g[0], 4:6],
+            ])
+            for g in groups
+        ])
+
+        canvas = None
+        if masks:
+            canvas = torch.zeros((len(groups), canvas_h, canvas_w), dtype=torch.uint8)
+            for k, group in enumerate(groups):
+                for j in group:
+                    local, (cx, cy) = masks[j]
+                    h = min(local.shape[0], canvas_h - cy)
+                    w = min(local.shape[1], canvas_w - cx)
+                    canvas[k, cy:cy + h, cx:cx + w] |= local[:h, :w]
+        return Results(image, path=path, names=names, boxes=merged, masks=canvas)
+
+    def _local_masks(self, data, tile, scale):
+        """Tile masks (letterboxed model input) as uint8 masks at canvas scale, with their canvas offsets."""
+        import torch
+        import torch.nn.functional as F
+
+        x0, y0, x1, y1 = tile
+        th, tw = y1 - y0, x1 - x0
+        mh, mw = data.shape[1:]
+        gain = min(mh / th, mw / tw)
+        pad_x, pad_y = (mw - tw * gain) / 2, (mh - th * gain) / 2
+        top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+        content = data[:, top:mh - top, left:mw - left]
+        size = (max(1, round(th * scale)), max(1, round(tw * scale)))
+        local = F.interpolate(content[:, None].float(), size=size, mode="nearest")[:, 0] > 0.5
+        offset = (round(x0 * scale), round(y0 * scale))
+        return [(m.to(torch.uint8), offset) for m in local]
+
+    def _groups(self, data, owners, tiles, width, height):
+        """Detection indices per merged object (connected matches), each group led by its most confident member."""
+        import torch
+
+        xyxy, conf, cls = data[:, :4], data[:, 4], data[:, 5]
+        owner_tiles = torch.tensor([tiles[t] for t in owners], dtype=xyxy.dtype)
+        iou = _pairwise_iou(xyxy[:, None], xyxy[None, :])
+        # The same boxes clipped to the region both tiles saw: a cut object matches its other part there
+        lt = torch.maximum(owner_tiles[:, None, :2], owner_tiles[None, :, :2])
+        rb = torch.minimum(owner_tiles[:, None, 2:], owner_tiles[None, :, 2:])
+        shared = torch.cat([lt, rb], dim=2)
+        seam_iou = _pairwise_iou(_clip(xyxy[:, None], shared), _clip(xyxy[None, :], shared))
+        cut = torch.tensor([_touches_seam(xyxy[i].tolist(), tiles[owners[i]], width, height, 2.0) for i in range(len(data))])
+
+        owner = torch.tensor(owners)
+        match = (owner[:, None] != owner[None, :]) & (cls[:, None] == cls[None, :]) & (
+            (iou >= self.iou) | ((seam_iou >= self.iou) & (cut[:, None] | cut[None, :]))
+        )
+
+        parent = list(range(len(data)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in match.nonzero().tolist():
+            parent[find(i)] = find(j)
+        groups = {}
+        for i in conf.argsort(descending=True).tolist():
+            groups.setdefault(find(i), []).append(i)
+        return list(groups.values())
+
+
+def tiled_from_env(model, prefix):
+    """model wrapped in a TiledDetector if {prefix}_SIZE is set (> 0), else model unchanged.
+
+    {prefix}_OVERLAP (default 0.2) and {prefix}_BATCH (tiles per forward,
+    default 16) configure it.
+    """
+    tile_size = int(os.environ.get(f"{prefix}_SIZE", 0))
+    if tile_size <= 0:
+        return model
+    return TiledDetector(
+        model,
+        tile_size=tile_size,
+        overlap=float(os.environ.get(f"{prefix}_OVERLAP", 0.2)),
+        max_batch=int(os.environ.get(f"{prefix}_BATCH", 16)),
+    )
@@ -0,0 +1,216 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from batching import OverloadedError
+
+
+def cpu_ids():
+    """CPUs this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def pin_threads(threads, cpus=None):
+    """Limit torch intra-op and OpenCV threads of this process, optionally binding it to cpus."""
+    import cv2
+    import torch
+
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def private_memory_bytes(pid):
+    """Memory only this process holds (private clean + dirty pages), None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line and not line.startswith(" "))
+    except OSError:
+        return None
+    return sum(int(fields[k].split()[0]) * 1024 for k in ("Private_Clean", "Private_Dirty") if k in fields)
+
+
+def _worker(index, factory, target, method, threads, cpus, max_batch_size, requests, results):
+    pin_threads(threads, cpus)
+    obj = target if target is not None else factory()
+    fn = getattr(obj, method)
+    results.put(("ready", index, None, None))
+    while True:
+        first = requests.get()
+        if first is None:
+            return
+        # Requests that queued up behind a running batch are run together
+        batch = [first]
+        while len(batch) < max_batch_size:
+            try:
+                entry = requests.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                requests.put(None)
+                break
+            batch.append(entry)
+        try:
+            outputs = list(fn([item for _, item in batch]))
+            if len(outputs) != len(batch):
+                raise RuntimeError(f"{method} returned {len(outputs)} results for {len(batch)} requests")
+        except Exception as e:
+            outputs = [RuntimeError(f"{type(e).__name__}: {e}")] * len(batch)
+        for (request_id, _), output in zip(batch, outputs):
+            results.put(("result", index, request_id, output))
+
+
+class WorkerPool:
+    """Runs a batched method of a model object in N worker processes.
+
+    factory() builds the object (e.g. a BrandAttentionPipeline); method takes
+    a list of items and returns one result per item, like MicroBatcher's
+    batch_fn. Each worker pins torch and OpenCV to threads_per_worker
+    threads, and to its own cores when there are enough of them.
+
+    With start_method="fork" (default), factory() runs once in this process
+    (as self.target) and the workers inherit the object. Its weights are
+    never written during inference, so their pages stay shared
+    copy-on-write and N workers cost roughly one copy of the models. This
+    process is pinned to one thread first: a child of a process that already
+    ran multi-threaded torch ops deadlocks in GNU OpenMP, so create the pool
+    before running any inference here (let factory() do the warm-up).
+    With "spawn" or "forkserver" every worker calls factory() itself
+    (factory must be picklable) and self.target is None; checkpoints loaded
+    by pipeline.load_checkpoint are memory-mapped, so the page cache still
+    holds one copy of ECT_SAL and the classifier.
+
+    submit() routes each request to the worker with the fewest requests in
+    flight, and raises OverloadedError once max_queue requests are in
+    flight. A worker runs whatever queued up behind its current batch
+    together, up to max_batch_size items.
+    """
+
+    def __init__(self, factory, method, workers=2, threads_per_worker=1, max_batch_size=8, max_queue=64,
+                 start_method="fork", pin_cores=True, name="worker-pool"):
+        self.method = method
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.max_queue = max_queue
+        self.stats = {"requests": 0, "rejected": 0, "in_flight": [0] * workers}
+        context = mp.get_context(start_method)
+        self.target = None
+        if start_method == "fork":
+            pin_threads(1)
+            self.target = factory()
+        available = cpu_ids()
+        use_cores = pin_cores and workers * threads_per_worker <= len(available)
+
+        self._results = context.Queue()
+        self._requests = []
+        self._processes = []
+        self._pending = {}
+        self._owners = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        for i in range(workers):
+            cpus = available[i * threads_per_worker:(i + 1) * threads_per_worker] if use_cores else None
+            requests = context.Queue()
+            process = context.Process(
+                target=_worker,
+                args=(i, None if self.target is not None else factory, self.target, method, threads_per_worker, cpus,
+                      max_batch_size, requests, self._results),
+                name=f"{name}-{i}",
+                daemon=True,
+            )
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+
+        self._alive = set()
+        while len(self._alive) < workers:
+            try:
+                _, index, _, _ = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if any(p.exitcode is not None for p in self._processes):
+                    self.close()
+                    raise RuntimeError("A worker process exited during startup")
+                continue
+            self._alive.add(index)
+        self._reader = threading.Thread(target=self._read, name=f"{name}-results", daemon=True)
+        self._reader.start()
+
+    @property
+    def pids(self):
+        return [p.pid for p in self._processes]
+
+    def submit(self, item):
+        if self._closed:
+            raise RuntimeError("WorkerPool is closed")
+        future = Future()
+        with self._lock:
+            if not self._alive:
+                raise RuntimeError("No live worker processes")
+            if sum(self.stats["in_flight"]) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise OverloadedError(f"Worker pool is full ({self.max_queue} requests in flight)")
+            index = min(self._alive, key=lambda i: self.stats["in_flight"][i])
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self._owners[request_id] = index
+            self.stats["in_flight"][index] += 1
+            self.stats["requests"] += 1
+        self._requests[index].put((request_id, item))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _resolve(self, request_id, output):
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+            index = self._owners.pop(request_id, None)
+            if index is not None:
+                self.stats["in_flight"][index] -= 1
+        if future is None:
+            return
+        if isinstance(output, Exception):
+            future.set_exception(output)
+        else:
+            future.set_result(output)
+
+    def _read(self):
+        while not self._closed:
+            try:
+                _, _, request_id, output = self._results.get(timeout=1.0)
+            except queue.Empty:
+                pass
+            else:
+                self._resolve(request_id, output)
+            self._fail_dead_workers()
+
+    def _fail_dead_workers(self):
+        dead = {i for i in self._alive if not self._processes[i].is_alive()}
+        if not dead or self._closed:
+            return
+        print(f"Worker processes {sorted(dead)} exited; routing around them")
+        with self._lock:
+            self._alive -= dead
+            lost = [r for r, i in self._owners.items() if i in dead]
+        for request_id in lost:
+            self._resolve(request_id, RuntimeError("Worker process exited"))
+
+    def close(self):
+        self._closed = True
+        for requests in self._requests:
+            requests.put(None)
+        deadline = time.monotonic() + 10
+        for process in self._processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.terminate()